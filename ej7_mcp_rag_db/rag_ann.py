@@ -0,0 +1,469 @@
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+# Índices de búsqueda por similitud sobre una matriz de embeddings ya
+# normalizados (la similitud coseno es un producto escalar). Todos ofrecen
+# el mismo método `search(query, k) -> (posiciones, puntuaciones)` para que
+# rag_local pueda cambiar de uno a otro por configuración.
+
+INDEX_KINDS = ("exact", "ivf", "int8", "binary", "sharded")
+QUANTIZED_KINDS = ("int8", "binary")
+
+# Nº de bits a 1 de cada byte, para calcular distancias de Hamming.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Devuelve los índices de las k mejores puntuaciones, ordenados de mayor
+    a menor. Usa argpartition para no ordenar el array completo; en caso de
+    empate se respeta el orden original (como un sort estable).
+    """
+    n = scores.shape[0]
+    k = min(max(1, k), n)
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(n)
+    return top[np.lexsort((top, -scores[top]))]
+
+
+class ExactIndex:
+    """
+    Búsqueda exacta: un producto matriz-vector sobre todas las filas.
+    """
+
+    kind = "exact"
+
+    def __init__(self, matrix: np.ndarray) -> None:
+        self.matrix = matrix
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.matrix @ query
+        top = top_k(scores, k)
+        return top, scores[top]
+
+
+class IVFFlatIndex:
+    """
+    Índice IVF-flat: agrupa las filas en `nlist` celdas con k-means esférico
+    y, en cada consulta, solo puntúa las filas de las `nprobe` celdas cuyo
+    centroide está más cerca de la pregunta. El coste por consulta pasa de
+    O(n) a ~O(nlist + n * nprobe / nlist).
+    """
+
+    kind = "ivf"
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        nlist: int = 0,
+        nprobe: int = 8,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> None:
+        self.matrix = matrix
+        n = matrix.shape[0]
+        if nlist <= 0:
+            nlist = max(1, int(math.sqrt(n)))
+        self.nlist = max(1, min(nlist, n))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+
+        rng = np.random.default_rng(seed)
+        self.centroids = self._train(rng, iterations)
+        assignments = self._assign(matrix)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[c] : bounds[c + 1]] for c in range(self.nlist)]
+
+    def _assign(self, rows: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        out = np.empty(rows.shape[0], dtype=np.int64)
+        for start in range(0, rows.shape[0], chunk):
+            block = rows[start : start + chunk]
+            out[start : start + chunk] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def _train(self, rng: np.random.Generator, iterations: int) -> np.ndarray:
+        n = self.matrix.shape[0]
+        # Como en otras librerías IVF, basta con entrenar sobre una muestra.
+        sample_size = min(n, self.nlist * 64)
+        sample = self.matrix[rng.choice(n, size=sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, size=self.nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=self.nlist)
+            empty = counts == 0
+            if empty.any():
+                # Celdas vacías: se resiembran con filas aleatorias.
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids = (sums / np.where(norms < 1e-10, 1.0, norms)).astype(np.float32)
+        return self.centroids
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        probes = top_k(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate([self.lists[c] for c in probes])
+        if candidates.size == 0:
+            return candidates, np.zeros(0, dtype=np.float32)
+        # Mantener el orden original de filas para desempatar igual que la búsqueda exacta.
+        candidates.sort()
+        scores = self.matrix[candidates] @ query
+        top = top_k(scores, k)
+        return candidates[top], scores[top]
+
+
+def _hamming(xored: np.ndarray) -> np.ndarray:
+    """Nº de bits a 1 por fila de una matriz uint8 (distancia de Hamming)."""
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(xored).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[xored].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex:
+    """
+    Búsqueda en dos fases sobre vectores cuantizados:
+
+    1. Una pasada aproximada por todas las filas usando códigos compactos:
+       `int8` (cuantización escalar por dimensión, 4x menos memoria que
+       float32) o `binary` (solo el signo de cada componente, 32x menos;
+       la similitud se aproxima con la distancia de Hamming).
+    2. Reordenación exacta con los vectores float de las `k * rescore`
+       mejores filas de la primera fase.
+
+    `matrix` solo se lee en la segunda fase, así que puede ser un
+    `np.memmap` en disco: en memoria solo quedan los códigos.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        kind: str = "int8",
+        rescore: int = 4,
+        chunk: int = 8192,
+    ) -> None:
+        if kind not in QUANTIZED_KINDS:
+            raise ValueError(f"Cuantización desconocida: {kind!r}. Usa una de {QUANTIZED_KINDS}.")
+        self.kind = kind
+        self.matrix = matrix
+        self.rescore = max(1, rescore)
+        self.chunk = chunk
+
+        if kind == "int8":
+            # El máximo absoluto de cada dimensión se corresponde con 127.
+            scale = np.abs(matrix).max(axis=0).astype(np.float32) / 127.0
+            self.scale = np.where(scale < 1e-12, 1.0, scale).astype(np.float32)
+            self.codes = np.empty(matrix.shape, dtype=np.int8)
+            for start in range(0, matrix.shape[0], chunk):
+                block = np.asarray(matrix[start : start + chunk]) / self.scale
+                self.codes[start : start + chunk] = np.clip(np.rint(block), -127, 127)
+        else:
+            self.codes = np.packbits(np.asarray(matrix) > 0, axis=1)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria ocupada por los códigos cuantizados (y sus escalas)."""
+        extra = self.scale.nbytes if self.kind == "int8" else 0
+        return int(self.codes.nbytes + extra)
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        n = self.codes.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        if self.kind == "int8":
+            scaled = (query * self.scale).astype(np.float32)
+            # Bloques pequeños reutilizando el mismo buffer float32: la
+            # conversión int8 -> float32 no reserva memoria en cada consulta.
+            buffer = np.empty((min(self.chunk, n), self.codes.shape[1]), dtype=np.float32)
+            for start in range(0, n, self.chunk):
+                block = self.codes[start : start + self.chunk]
+                out = buffer[: block.shape[0]]
+                np.copyto(out, block, casting="unsafe")
+                np.matmul(out, scaled, out=scores[start : start + block.shape[0]])
+        else:
+            bits = np.packbits(query > 0)
+            for start in range(0, n, self.chunk):
+                block = np.bitwise_xor(self.codes[start : start + self.chunk], bits)
+                scores[start : start + block.shape[0]] = -_hamming(block)
+        return scores
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        shortlist = top_k(self._approximate_scores(query), max(1, k) * self.rescore)
+        # Mantener el orden original de filas para desempatar igual que la búsqueda exacta.
+        shortlist.sort()
+        scores = np.asarray(self.matrix[shortlist]) @ query
+        top = top_k(scores, k)
+        return shortlist[top], scores[top]
+
+
+# Segmentos de memoria compartida ya abiertos en este proceso (workers de
+# ShardedIndex), por nombre y del más antiguo al más reciente. Cada worker se
+# engancha una sola vez a cada segmento y solo conserva los últimos: cada
+# reindexación crea un segmento nuevo y los antiguos ya no se consultan.
+_ATTACHED: Dict[str, Tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+_MAX_ATTACHED = 2
+
+
+def _attach(name: str, shape: Tuple[int, int]) -> np.ndarray:
+    entry = _ATTACHED.get(name)
+    if entry is None:
+        while len(_ATTACHED) >= _MAX_ATTACHED:
+            # Las vistas de un segmento no salen del worker (se devuelven
+            # copias), así que se puede desmapear sin riesgo.
+            old_shm, _ = _ATTACHED.pop(next(iter(_ATTACHED)))
+            old_shm.close()
+        # Los workers "spawn" comparten el resource tracker del proceso
+        # principal, que es quien borra el segmento en `_release`.
+        shm = shared_memory.SharedMemory(name=name)
+        entry = (shm, np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+        _ATTACHED[name] = entry
+    return entry[1]
+
+
+def _search_shard(
+    name: str, shape: Tuple[int, int], start: int, end: int, query: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k local de las filas [start, end) (se ejecuta en un worker)."""
+    scores = _attach(name, shape)[start:end] @ query
+    top = top_k(scores, k)
+    return top + start, scores[top]
+
+
+def _unlink(shm: shared_memory.SharedMemory) -> None:
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass  # ya lo borró ShardedIndex.close()
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    # Solo se llama cuando ya no queda ningún array sobre el segmento en este
+    # proceso (ver ShardedIndex), así que desmapearlo no invalida nada.
+    shm.close()
+    _unlink(shm)
+
+
+# Pools de procesos compartidos por todos los ShardedIndex, uno por nº de
+# workers: cada reindexación crea un índice nuevo, pero no vuelve a arrancar
+# los workers. Un pool nunca se para mientras un índice pueda usarlo.
+_POOLS: Dict[int, ProcessPoolExecutor] = {}
+_POOL_LOCK = threading.Lock()
+
+
+def _shared_pool(workers: int) -> ProcessPoolExecutor:
+    with _POOL_LOCK:
+        pool = _POOLS.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _POOLS[workers] = pool
+        return pool
+
+
+def shutdown_pool() -> None:
+    """
+    Para los workers de los pools compartidos. Los índices vivos no se
+    rompen: su siguiente búsqueda vuelve a arrancar un pool.
+    """
+    with _POOL_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ShardedIndex:
+    """
+    Búsqueda exacta repartida entre varios procesos.
+
+    La matriz se copia a un segmento de memoria compartida y se divide en
+    `shards` bloques contiguos de filas. Cada consulta lanza un top-k local
+    por bloque en un pool de procesos (cada worker lee el segmento sin
+    copiarlo) y fusiona los resultados en el top-k global, que coincide con
+    el de ExactIndex. Así el cálculo de similitudes usa varios núcleos aunque
+    el proceso principal tenga el GIL.
+
+    `matrix` es el propio segmento, no una segunda copia. Toda vista que se
+    saque de ella lo mantiene vivo: el segmento se desmapea cuando ya no
+    queda ninguna, así que `close()` (o descartar el índice) nunca deja
+    colgando arrays que sigan en uso. El pool de workers ("spawn", para no
+    heredar hilos del servidor) se dimensiona con `workers` o, por defecto,
+    con `shards` o el nº de CPUs, y se comparte entre índices.
+    """
+
+    kind = "sharded"
+
+    def __init__(self, matrix: np.ndarray, shards: int = 0, workers: int = 0) -> None:
+        n = matrix.shape[0]
+        shards = shards if shards > 0 else (os.cpu_count() or 1)
+        # El pool no depende de n: índices de distinto tamaño comparten workers.
+        self.workers = workers if workers > 0 else shards
+        self.shards = max(1, min(shards, n))
+        bounds = np.linspace(0, n, self.shards + 1).astype(np.int64)
+        self.bounds: List[Tuple[int, int]] = [
+            (int(bounds[i]), int(bounds[i + 1])) for i in range(self.shards)
+        ]
+
+        nbytes = int(np.prod(matrix.shape)) * np.dtype(np.float32).itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        self.matrix = np.ndarray(matrix.shape, dtype=np.float32, buffer=self._shm.buf)
+        self.matrix[:] = matrix
+        # Las vistas de `matrix` la referencian como base, así que el
+        # finalizador solo se ejecuta cuando el índice y todas ellas son
+        # inalcanzables.
+        weakref.finalize(self.matrix, _release, self._shm)
+
+    @property
+    def _pool(self) -> ProcessPoolExecutor:
+        return _shared_pool(self.workers)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query, dtype=np.float32)
+        futures = [
+            self._pool.submit(
+                _search_shard, self._shm.name, self.matrix.shape, start, end, query, k
+            )
+            for start, end in self.bounds
+        ]
+        results = [future.result() for future in futures]
+        positions = np.concatenate([pos for pos, _ in results])
+        scores = np.concatenate([sc for _, sc in results])
+        # Los bloques van en orden de filas, así que los empates se resuelven
+        # igual que en la búsqueda exacta.
+        top = top_k(scores, k)
+        return positions[top], scores[top]
+
+    def close(self) -> None:
+        """
+        Borra el nombre del segmento; la memoria se libera cuando ya no queda
+        ninguna vista de `matrix` (el pool de workers se conserva).
+        """
+        _unlink(self._shm)
+
+
+def build_index(
+    kind: str, matrix: np.ndarray, **params: Any
+) -> ExactIndex | IVFFlatIndex | QuantizedIndex | ShardedIndex:
+    """
+    Construye el índice `kind` ("exact", "ivf", "int8", "binary" o
+    "sharded") sobre `matrix`.
+    """
+    if kind == "exact" or matrix.shape[0] == 0:
+        return ExactIndex(matrix)
+    if kind == "ivf":
+        return IVFFlatIndex(matrix, **params)
+    if kind in QUANTIZED_KINDS:
+        return QuantizedIndex(matrix, kind=kind, **params)
+    if kind == "sharded":
+        return ShardedIndex(matrix, **params)
+    raise ValueError(f"Tipo de índice desconocido: {kind!r}. Usa uno de {INDEX_KINDS}.")
+
+
+def recall_at_k(
+    index: ExactIndex | IVFFlatIndex | QuantizedIndex | ShardedIndex,
+    queries: np.ndarray,
+    k: int,
+) -> Dict[str, float]:
+    """
+    Compara `index` con la búsqueda exacta sobre las mismas filas.
+
+    Devuelve el recall@k medio (fracción de los k vecinos exactos que
+    también devuelve el índice) y la latencia media por consulta de
+    ambos métodos en milisegundos.
+    """
+    exact = ExactIndex(index.matrix)
+    hits = 0
+    exact_time = 0.0
+    index_time = 0.0
+    for query in queries:
+        t0 = time.perf_counter()
+        expected, _ = exact.search(query, k)
+        t1 = time.perf_counter()
+        got, _ = index.search(query, k)
+        t2 = time.perf_counter()
+        exact_time += t1 - t0
+        index_time += t2 - t1
+        hits += len(set(expected.tolist()) & set(got.tolist()))
+
+    n_queries = max(1, len(queries))
+    return {
+        "recall_at_k": hits / (n_queries * max(1, min(k, index.matrix.shape[0]))),
+        "exact_ms": 1000 * exact_time / n_queries,
+        "index_ms": 1000 * index_time / n_queries,
+    }
+
+
+def _synthetic_corpus(
+    n: int, dim: int, clusters: int, rng: np.random.Generator
+) -> np.ndarray:
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    data = centers[labels] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def main() -> None:
+    """
+    Benchmark sintético: recall@k, latencia y memoria de los índices IVF y
+    cuantizados frente a la búsqueda exacta sobre un corpus aleatorio agrupado.
+    """
+    rng = np.random.default_rng(42)
+    n, dim, k = 100_000, 256, 5
+    print(f"Generando corpus sintético de {n} vectores de dimensión {dim}...")
+    matrix = _synthetic_corpus(n, dim, clusters=200, rng=rng)
+    queries = matrix[rng.choice(n, size=200, replace=False)] + 0.1 * rng.normal(
+        size=(200, dim)
+    ).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    for nprobe in (1, 4, 8, 16):
+        t0 = time.perf_counter()
+        index = IVFFlatIndex(matrix, nprobe=nprobe)
+        build_s = time.perf_counter() - t0
+        result = recall_at_k(index, queries, k)
+        print(
+            f"ivf nlist={index.nlist} nprobe={nprobe}: "
+            f"recall@{k}={result['recall_at_k']:.3f} "
+            f"exacto={result['exact_ms']:.2f} ms ivf={result['index_ms']:.2f} ms "
+            f"(construcción {build_s:.1f} s)"
+        )
+
+    float_mb = matrix.nbytes / 1e6
+    for kind, rescore in (("int8", 1), ("int8", 4), ("binary", 4), ("binary", 16)):
+        index = QuantizedIndex(matrix, kind=kind, rescore=rescore)
+        result = recall_at_k(index, queries, k)
+        print(
+            f"{kind} rescore={rescore}: recall@{k}={result['recall_at_k']:.3f} "
+            f"exacto={result['exact_ms']:.2f} ms {kind}={result['index_ms']:.2f} ms "
+            f"memoria {index.nbytes / 1e6:.1f} MB frente a {float_mb:.1f} MB en float32"
+        )
+
+    for shards in sorted({2, 4, os.cpu_count() or 1}):
+        index = ShardedIndex(matrix, shards=shards)
+        index.search(queries[0], k)  # arranque de los workers
+        result = recall_at_k(index, queries, k)
+        print(
+            f"sharded shards={shards}: recall@{k}={result['recall_at_k']:.3f} "
+            f"exacto={result['exact_ms']:.2f} ms sharded={result['index_ms']:.2f} ms"
+        )
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
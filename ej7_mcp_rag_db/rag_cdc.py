@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Tuple
+
+try:
+    from . import rag_db
+except ImportError:
+    import rag_db
+
+
+# Change data capture sobre `tickets`: unos triggers apuntan en
+# `ticket_changes` cada alta, modificación o baja, y rag_local consume ese
+# log para actualizar solo los tickets afectados en lugar de releer la tabla.
+# Es la misma definición que schema.sql, en versión idempotente para añadirla
+# a bases de datos creadas antes de que existiera.
+_CDC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticket_changes (
+  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  ticket_id INTEGER NOT NULL,
+  op TEXT NOT NULL,
+  changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TRIGGER IF NOT EXISTS tickets_cdc_ai AFTER INSERT ON tickets BEGIN
+  INSERT INTO ticket_changes(ticket_id, op) VALUES (new.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_cdc_au AFTER UPDATE ON tickets BEGIN
+  INSERT INTO ticket_changes(ticket_id, op)
+  SELECT old.id, 'delete' WHERE old.id != new.id;
+  INSERT INTO ticket_changes(ticket_id, op) VALUES (new.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_cdc_ad AFTER DELETE ON tickets BEGIN
+  INSERT INTO ticket_changes(ticket_id, op) VALUES (old.id, 'delete');
+END;
+"""
+
+# Un cambio del log: (seq, ticket_id, operación).
+Change = Tuple[int, int, str]
+
+
+def ensure_change_log(db_path: Path | str) -> bool:
+    """
+    Crea la tabla `ticket_changes` y sus triggers si la base de datos no los
+    tiene todavía. Los tickets ya existentes no se apuntan: se indexan con
+    una reindexación completa.
+
+    Devuelve False (sin tocar nada) si la base de datos o la tabla
+    `tickets` no existen.
+    """
+    if not Path(db_path).exists():
+        return False
+    conn = rag_db.connect(db_path)
+    names = {
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE name IN ('tickets', 'tickets_cdc_ad')"
+        )
+    }
+    if "tickets" not in names:
+        return False
+    if "tickets_cdc_ad" not in names:
+        conn.executescript(_CDC_SCHEMA)
+        conn.commit()
+    return True
+
+
+def latest_seq(db_path: Path | str) -> int:
+    """Último número de secuencia del log (0 si está vacío)."""
+    conn = rag_db.connect(db_path)
+    row = conn.execute("SELECT MAX(seq) FROM ticket_changes").fetchone()
+    return int(row[0] or 0)
+
+
+def oldest_seq(db_path: Path | str) -> int:
+    """Primer número de secuencia pendiente en el log (0 si está vacío)."""
+    conn = rag_db.connect(db_path)
+    row = conn.execute("SELECT MIN(seq) FROM ticket_changes").fetchone()
+    return int(row[0] or 0)
+
+
+def read_changes(db_path: Path | str, after_seq: int, limit: int = 1000) -> List[Change]:
+    """
+    Devuelve los cambios con seq > `after_seq`, en orden, como mucho `limit`.
+    """
+    conn = rag_db.connect(db_path)
+    rows = conn.execute(
+        "SELECT seq, ticket_id, op FROM ticket_changes "
+        "WHERE seq > ? ORDER BY seq LIMIT ?",
+        (after_seq, limit),
+    ).fetchall()
+    return [(int(seq), int(ticket_id), str(op)) for seq, ticket_id, op in rows]
+
+
+def purge_changes(db_path: Path | str, up_to_seq: int) -> int:
+    """
+    Borra del log los cambios ya aplicados (seq <= `up_to_seq`) para que no
+    crezca sin límite. Devuelve cuántos se han borrado.
+
+    Si no hay nada que borrar no se escribe en la base de datos: cada
+    escritura cambia `PRAGMA data_version` y despertaría al hilo de
+    refresco (rag_refresh) sin motivo.
+    """
+    conn = rag_db.connect(db_path)
+    pending = conn.execute(
+        "SELECT 1 FROM ticket_changes WHERE seq <= ? LIMIT 1", (up_to_seq,)
+    ).fetchone()
+    if pending is None:
+        return 0
+    with conn:
+        cur = conn.execute("DELETE FROM ticket_changes WHERE seq <= ?", (up_to_seq,))
+        deleted = cur.rowcount
+    return deleted
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+# Gestor de conexiones a incidents.db compartido por rag_local, rag_store,
+# rag_fts y rag_cdc. En lugar de abrir (y configurar) una conexión nueva en
+# cada consulta, cada hilo reutiliza la suya:
+#
+# - modo WAL: los lectores no bloquean a los escritores (seed_db, el índice)
+#   ni al revés;
+# - `mmap_size` y una caché de páginas más grande para las lecturas;
+# - caché de sentencias preparadas (`cached_statements`) del módulo sqlite3;
+# - conexiones de solo lectura (URI `mode=ro`) para los recursos MCP.
+
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KIB = 64 * 1024
+DEFAULT_CACHED_STATEMENTS = 256
+DEFAULT_BUSY_TIMEOUT = 5.0
+
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(DEFAULT_MMAP_SIZE)))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", str(DEFAULT_CACHE_SIZE_KIB)))
+SQLITE_CACHED_STATEMENTS = int(
+    os.getenv("SQLITE_CACHED_STATEMENTS", str(DEFAULT_CACHED_STATEMENTS))
+)
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", str(DEFAULT_BUSY_TIMEOUT)))
+
+# Clave de una conexión: (ruta absoluta, solo lectura).
+ConnectionKey = Tuple[str, bool]
+
+_LOCAL = threading.local()
+# Todas las conexiones abiertas (de cualquier hilo), para close_all().
+_OPEN: List[sqlite3.Connection] = []
+_OPEN_LOCK = threading.Lock()
+# Se incrementa en cada close_all(): las conexiones que otros hilos tengan
+# en caché de una generación anterior ya están cerradas y se reabren.
+_GENERATION = 0
+
+
+def _open(path: Path, readonly: bool) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(
+            f"{path.as_uri()}?mode=ro",
+            uri=True,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+            check_same_thread=False,
+        )
+    else:
+        conn = sqlite3.connect(
+            path,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+            check_same_thread=False,
+        )
+        # journal_mode se guarda en el propio fichero: basta con fijarlo una
+        # vez, pero repetirlo sobre una base de datos ya en WAL no cuesta nada.
+        conn.execute("PRAGMA journal_mode=WAL")
+        # En WAL, NORMAL no arriesga la integridad (solo las últimas
+        # transacciones ante un corte de luz) y evita un fsync por commit.
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE:d}")
+    conn.execute(f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KIB:d}")
+    with _OPEN_LOCK:
+        _OPEN.append(conn)
+    return conn
+
+
+def _discard(conn: sqlite3.Connection) -> None:
+    with _OPEN_LOCK:
+        if conn in _OPEN:
+            _OPEN.remove(conn)
+    conn.close()
+
+
+def connect(db_path: Path | str, readonly: bool = False) -> sqlite3.Connection:
+    """
+    Devuelve la conexión del hilo actual a `db_path`, creándola y
+    configurándola la primera vez. No hay que cerrarla: se reutiliza en las
+    siguientes llamadas del mismo hilo. Las escrituras deben ir dentro de
+    `with conn:` para que se confirmen (o se deshagan) al terminar.
+
+    Si el fichero se ha recreado (p. ej. con seed_db) se detecta por el
+    inodo y se abre una conexión nueva.
+    """
+    path = Path(db_path).resolve()
+    try:
+        inode: int | None = path.stat().st_ino
+    except FileNotFoundError:
+        if readonly:
+            raise
+        inode = None  # sqlite3 crea el fichero al abrirlo en escritura
+    connections: Dict[ConnectionKey, Tuple[int, int, sqlite3.Connection]] = getattr(
+        _LOCAL, "connections", None
+    ) or {}
+    _LOCAL.connections = connections
+
+    key = (str(path), readonly)
+    cached = connections.get(key)
+    if cached is not None:
+        cached_inode, generation, conn = cached
+        if cached_inode == inode and generation == _GENERATION:
+            return conn
+        _discard(conn)
+
+    generation = _GENERATION
+    conn = _open(path, readonly)
+    connections[key] = (path.stat().st_ino if inode is None else inode, generation, conn)
+    return conn
+
+
+def close_all() -> None:
+    """Cierra todas las conexiones abiertas (de todos los hilos)."""
+    global _GENERATION
+    with _OPEN_LOCK:
+        connections = list(_OPEN)
+        _OPEN.clear()
+        _GENERATION += 1
+    for conn in connections:
+        conn.close()
+    _LOCAL.__dict__.clear()
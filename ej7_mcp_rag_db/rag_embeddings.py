@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import random
+import re
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+# Valores por defecto pensados para los límites de la API de embeddings de
+# OpenAI (máx. 2048 entradas y ~300k tokens por petición), con margen.
+DEFAULT_MAX_BATCH_ITEMS = 256
+DEFAULT_MAX_BATCH_TOKENS = 200_000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+
+# Proveedores de embeddings disponibles (ver make_embedder).
+EMBEDDING_PROVIDERS = ("openai", "local")
+# Dimensión de los vectores del proveedor local.
+DEFAULT_LOCAL_DIM = 512
+# Por debajo de este nº de textos no compensa arrancar procesos: el
+# proveedor local embebe en el propio proceso.
+DEFAULT_LOCAL_PARALLEL_MIN = 2048
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación local y barata del número de tokens de un texto
+    (~4 caracteres por token), suficiente para dimensionar lotes.
+    """
+    return len(text) // 4 + 1
+
+
+def split_batches(
+    texts: List[str],
+    max_items: int = DEFAULT_MAX_BATCH_ITEMS,
+    max_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+) -> List[List[int]]:
+    """
+    Parte `texts` en lotes consecutivos (listas de posiciones) que respetan
+    a la vez un máximo de elementos y un presupuesto de tokens por petición.
+
+    Un texto que por sí solo supera el presupuesto va en un lote propio.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (
+            len(current) >= max_items or current_tokens + tokens > max_tokens
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch_with_retry(
+    client: Any,
+    model: str,
+    texts: List[str],
+    max_retries: int,
+    base_delay: float,
+) -> List[List[float]]:
+    """
+    Embebe un lote reintentando con backoff exponencial (y algo de jitter)
+    cuando el proveedor responde con un error de rate limit.
+    """
+    # Import diferido: el SDK de OpenAI tarda en cargar y el proveedor local
+    # no lo necesita.
+    from openai import RateLimitError
+
+    attempt = 0
+    while True:
+        try:
+            response = client.embeddings.create(model=model, input=texts)
+            break
+        except RateLimitError:
+            if attempt >= max_retries:
+                raise
+            delay = base_delay * (2**attempt)
+            time.sleep(delay + random.uniform(0, delay / 2))
+            attempt += 1
+
+    # La API devuelve un `index` por elemento; lo usamos para no depender
+    # del orden de la respuesta.
+    items = sorted(response.data, key=lambda item: item.index)
+    return [item.embedding for item in items]
+
+
+def embed_batched(
+    client: Any,
+    model: str,
+    texts: List[str],
+    max_items: int = DEFAULT_MAX_BATCH_ITEMS,
+    max_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    base_delay: float = DEFAULT_BASE_DELAY,
+) -> List[List[float]]:
+    """
+    Calcula los embeddings de `texts` troceando la entrada en lotes y
+    lanzando como mucho `concurrency` peticiones a la vez.
+
+    El resultado mantiene el mismo orden que `texts`.
+    """
+    if not texts:
+        return []
+
+    batches = split_batches(texts, max_items=max_items, max_tokens=max_tokens)
+
+    def run(batch: List[int]) -> List[List[float]]:
+        return _embed_batch_with_retry(
+            client, model, [texts[i] for i in batch], max_retries, base_delay
+        )
+
+    if len(batches) == 1:
+        return run(batches[0])
+
+    results: List[List[float]] = [[] for _ in texts]
+    # El tamaño del pool actúa como semáforo: nunca hay más de
+    # `concurrency` peticiones en vuelo.
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for batch, vectors in zip(batches, pool.map(run, batches)):
+            for i, vector in zip(batch, vectors):
+                results[i] = vector
+    return results
+
+
+class OpenAIEmbedder:
+    """
+    Proveedor de embeddings remoto: la API de OpenAI, con el troceado en
+    lotes, la concurrencia y los reintentos de `embed_batched`.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        max_items: int = DEFAULT_MAX_BATCH_ITEMS,
+        max_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ) -> None:
+        self.client = client
+        self.name = model
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return embed_batched(
+            self.client,
+            self.name,
+            texts,
+            max_items=self.max_items,
+            max_tokens=self.max_tokens,
+            concurrency=self.concurrency,
+        )
+
+
+def _features(text: str) -> Iterator[Tuple[str, float]]:
+    """
+    Rasgos de un texto con su peso: palabras, pares de palabras consecutivas
+    y trigramas de caracteres (con menos peso; ayudan con plurales, flexiones
+    y erratas: "timeout"/"timeouts", "conexión"/"conexion").
+    """
+    words = re.findall(r"\w+", text.lower())
+    for word in words:
+        yield word, 1.0
+    for first, second in zip(words, words[1:]):
+        yield f"{first} {second}", 0.5
+    for word in words:
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            yield "#" + padded[i : i + 3], 0.25
+
+
+def hash_embed(text: str, dim: int = DEFAULT_LOCAL_DIM) -> List[float]:
+    """
+    Embedding local de un texto con el "hashing trick": cada rasgo se
+    proyecta con crc32 a una de `dim` posiciones, con signo (para que las
+    colisiones tiendan a cancelarse), la frecuencia se amortigua con un
+    logaritmo y el vector se normaliza (norma L2 = 1).
+
+    Es determinista y no depende del corpus (no hay IDF que recalcular),
+    así que los vectores se pueden guardar en rag_store y actualizar de
+    forma incremental igual que los de OpenAI.
+    """
+    counts: Dict[int, float] = {}
+    for feature, weight in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        counts[h % dim] = counts.get(h % dim, 0.0) + sign * weight
+
+    vector = [0.0] * dim
+    for pos, value in counts.items():
+        if value:
+            vector[pos] = math.copysign(math.log1p(abs(value)), value)
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm:
+        vector = [x / norm for x in vector]
+    return vector
+
+
+def local_model_name(dim: int) -> str:
+    """Nombre con el que se guardan los vectores del proveedor local."""
+    return f"local-hash-{dim}"
+
+
+def _hash_embed_many(texts: List[str], dim: int) -> List[List[float]]:
+    return [hash_embed(text, dim) for text in texts]
+
+
+class HashingEmbedder:
+    """
+    Proveedor de embeddings local, en CPU y sin red: `hash_embed` sobre
+    cada texto. Una pregunta se embebe en el propio proceso en menos de un
+    milisegundo; las indexaciones grandes se reparten en lotes entre
+    `workers` procesos (0 = uno por CPU).
+
+    Es mucho más rápido que la API, pero la calidad es la de una búsqueda
+    léxica difusa: encuentra tickets que comparten palabras (o trozos de
+    palabras) con la pregunta, no sinónimos.
+    """
+
+    def __init__(
+        self,
+        dim: int = DEFAULT_LOCAL_DIM,
+        workers: int = 0,
+        parallel_min: int = DEFAULT_LOCAL_PARALLEL_MIN,
+    ) -> None:
+        self.dim = dim
+        self.name = local_model_name(dim)
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_min = parallel_min
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) < self.parallel_min or self.workers < 2:
+            return _hash_embed_many(texts, self.dim)
+
+        size = math.ceil(len(texts) / self.workers)
+        batches = [texts[i : i + size] for i in range(0, len(texts), size)]
+        # "spawn" como en rag_ann: el proceso padre puede tener hilos (el
+        # refresco en segundo plano) y fork con hilos no es seguro.
+        with ProcessPoolExecutor(
+            max_workers=len(batches), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = pool.map(_hash_embed_many, batches, [self.dim] * len(batches))
+            return [vector for batch in results for vector in batch]
+
+
+def make_embedder(
+    provider: str,
+    client: Any = None,
+    model: str = "text-embedding-3-small",
+    dim: int = DEFAULT_LOCAL_DIM,
+    **params: Any,
+) -> OpenAIEmbedder | HashingEmbedder:
+    """
+    Construye el proveedor de embeddings indicado ("openai" o "local").
+    Los dos exponen lo mismo: `name` (identifica el modelo en rag_store y en
+    las cachés) y `embed(texts)`, que devuelve un vector por texto en orden.
+    `params` se pasa al constructor del proveedor.
+    """
+    if provider == "openai":
+        return OpenAIEmbedder(client, model, **params)
+    if provider == "local":
+        return HashingEmbedder(dim, **params)
+    raise ValueError(
+        f"Proveedor de embeddings desconocido: {provider!r} "
+        f"(opciones: {', '.join(EMBEDDING_PROVIDERS)})"
+    )
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+
+# Almacén de feedback "append-only" en formato JSONL: una entrada JSON por
+# línea. Guardar feedback es añadir una línea al final del fichero (O(1)),
+# y leer las últimas entradas solo recorre el final del fichero.
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+_READ_BLOCK = 64 * 1024
+
+
+class FeedbackStore:
+    """
+    Log de feedback en disco con escrituras atómicas y rotación por tamaño.
+
+    - `append` escribe cada entrada con una única llamada `os.write` sobre un
+      descriptor abierto en modo O_APPEND, así que escrituras concurrentes
+      (hilos o procesos) no se mezclan ni se pisan.
+    - Cuando el fichero supera `max_bytes` se rota: `feedback.jsonl` pasa a
+      `feedback.jsonl.1`, el `.1` a `.2`, etc., conservando `backups` ficheros.
+    - `tail(n)` lee el fichero desde el final por bloques.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        backups: int = DEFAULT_BACKUPS,
+    ) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._count: int | None = None
+
+    def _segments(self) -> List[Path]:
+        """Ficheros del log, del más antiguo al más reciente."""
+        rotated = [self.path.with_name(f"{self.path.name}.{i}") for i in range(self.backups, 0, -1)]
+        return [p for p in rotated + [self.path] if p.exists()]
+
+    def _rotate(self) -> None:
+        oldest = self.path.with_name(f"{self.path.name}.{self.backups}")
+        if oldest.exists():
+            dropped = _count_lines(oldest)
+            oldest.unlink()
+            if self._count is not None:
+                self._count -= dropped
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                src.rename(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            self.path.rename(self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+            self._count = 0
+
+    def append(self, entry: Dict[str, Any]) -> int:
+        """
+        Añade una entrada al log y devuelve el total de entradas conservadas.
+        """
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            total = self.count()
+            if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                self._rotate()
+                total = self._count if self._count is not None else self.count()
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+            self._count = total + 1
+            return self._count
+
+    def count(self) -> int:
+        """
+        Nº de entradas conservadas. Se calcula una vez contando saltos de
+        línea y después se mantiene en memoria.
+        """
+        if self._count is None:
+            self._count = sum(_count_lines(p) for p in self._segments())
+        return self._count
+
+    def tail(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Devuelve las últimas `limit` entradas (de la más antigua a la más
+        reciente) leyendo solo el final del log.
+        """
+        limit = max(1, limit)
+        entries: List[Dict[str, Any]] = []
+        for segment in reversed(self._segments()):
+            for raw in _reverse_lines(segment):
+                entry = _parse(raw)
+                if entry is not None:
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        return list(reversed(entries))
+        return list(reversed(entries))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Recorre todas las entradas conservadas, de la más antigua a la más reciente."""
+        for segment in self._segments():
+            with segment.open("rb") as f:
+                for raw in f:
+                    entry = _parse(raw)
+                    if entry is not None:
+                        yield entry
+
+    def import_legacy_json(self, legacy_path: Path | str) -> int:
+        """
+        Migra un `feedback.json` antiguo (una lista JSON reescrita entera en
+        cada guardado) al log JSONL. Devuelve cuántas entradas se importan.
+        """
+        legacy = Path(legacy_path)
+        if not legacy.exists() or self.path.exists():
+            return 0
+        try:
+            data = json.loads(legacy.read_text(encoding="utf-8"))
+        except Exception:
+            return 0
+        if not isinstance(data, list):
+            return 0
+        for entry in data:
+            if isinstance(entry, dict):
+                self.append(entry)
+        return len(data)
+
+
+def _parse(raw: bytes) -> Dict[str, Any] | None:
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        # Una línea corrupta (p. ej. un corte de luz a mitad de escritura)
+        # no debe impedir leer el resto del log.
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+def _count_lines(path: Path) -> int:
+    count = 0
+    with path.open("rb") as f:
+        while block := f.read(_READ_BLOCK):
+            count += block.count(b"\n")
+    return count
+
+
+def _reverse_lines(path: Path) -> Iterator[bytes]:
+    """Itera las líneas de un fichero desde el final, leyendo por bloques."""
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            size = min(_READ_BLOCK, position)
+            position -= size
+            f.seek(position)
+            block = f.read(size) + remainder
+            lines = block.split(b"\n")
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
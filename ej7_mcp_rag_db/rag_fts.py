@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+try:
+    from . import rag_db
+except ImportError:
+    import rag_db
+
+
+# Mismo índice FTS5 que define schema.sql, en versión idempotente para
+# añadirlo a bases de datos creadas antes de que existiera.
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5(
+  title, body, tags,
+  content='tickets', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS tickets_fts_ai AFTER INSERT ON tickets BEGIN
+  INSERT INTO tickets_fts(rowid, title, body, tags)
+  VALUES (new.id, new.title, new.body, new.tags);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_fts_ad AFTER DELETE ON tickets BEGIN
+  INSERT INTO tickets_fts(tickets_fts, rowid, title, body, tags)
+  VALUES ('delete', old.id, old.title, old.body, old.tags);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tickets_fts_au AFTER UPDATE ON tickets BEGIN
+  INSERT INTO tickets_fts(tickets_fts, rowid, title, body, tags)
+  VALUES ('delete', old.id, old.title, old.body, old.tags);
+  INSERT INTO tickets_fts(rowid, title, body, tags)
+  VALUES (new.id, new.title, new.body, new.tags);
+END;
+"""
+
+# Palabras muy frecuentes que no aportan nada a BM25.
+_STOPWORDS = {
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los",
+    "me", "mi", "no", "para", "por", "que", "qué", "se", "su", "un", "una", "y",
+    "the", "is", "of", "to", "and", "in", "on", "for",
+}
+
+# Constante k de Reciprocal Rank Fusion (valor habitual en la literatura).
+RRF_K = 60
+
+
+def ensure_fts(db_path: Path | str) -> None:
+    """
+    Crea el índice FTS5 y sus triggers si la base de datos no los tiene
+    todavía, y lo rellena a partir de la tabla `tickets`.
+    """
+    conn = rag_db.connect(db_path)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'tickets_fts'"
+    ).fetchone()
+    if exists:
+        return
+    conn.executescript(_FTS_SCHEMA)
+    with conn:
+        conn.execute("INSERT INTO tickets_fts(tickets_fts) VALUES ('rebuild')")
+
+
+def query_terms(text: str) -> List[str]:
+    """
+    Términos significativos de un texto (en minúsculas, sin stopwords ni
+    repetidos), en el orden en que aparecen.
+    """
+    terms: List[str] = []
+    for term in re.findall(r"\w+", text.lower()):
+        if term in _STOPWORDS or term in terms:
+            continue
+        terms.append(term)
+    return terms
+
+
+def to_match_query(question: str) -> str:
+    """
+    Convierte una pregunta libre en una consulta MATCH de FTS5: cada término
+    entre comillas (para que `413` o `database` no se interpreten como
+    sintaxis FTS) y unidos con OR para que BM25 pondere los más raros.
+    """
+    return " OR ".join(f'"{term}"' for term in query_terms(question))
+
+
+def search_bm25(
+    db_path: Path | str, question: str, limit: int = 20
+) -> List[Tuple[int, float]]:
+    """
+    Devuelve [(ticket_id, bm25)] ordenado por relevancia léxica.
+    En SQLite, bm25() es más negativo cuanto más relevante.
+    """
+    match = to_match_query(question)
+    if not match:
+        return []
+
+    conn = rag_db.connect(db_path, readonly=True)
+    rows = conn.execute(
+        "SELECT rowid, bm25(tickets_fts) FROM tickets_fts "
+        "WHERE tickets_fts MATCH ? ORDER BY bm25(tickets_fts) LIMIT ?",
+        (match, limit),
+    ).fetchall()
+    return [(int(rowid), float(score)) for rowid, score in rows]
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Sequence[int]], k: int = RRF_K
+) -> List[Tuple[int, float]]:
+    """
+    Fusiona varias listas ordenadas de ids con Reciprocal Rank Fusion:
+    score(id) = sum(1 / (k + rank)). Devuelve [(id, score)] de mayor a menor.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
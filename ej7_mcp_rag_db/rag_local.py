@@ -1,15 +1,50 @@
 from __future__ import annotations
 
+import json
 import math
 import os
+import itertools
+import re
 import sqlite3
-from dataclasses import dataclass, asdict
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field, replace
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Tuple
 
-from anthropic import Anthropic
+import numpy as np
 from dotenv import load_dotenv
-from openai import OpenAI
+
+if TYPE_CHECKING:
+    from anthropic import Anthropic
+    from openai import OpenAI
+
+try:
+    # Caso habitual en los tests: importado como ej7_mcp_rag_db.rag_local
+    from . import (
+        rag_ann,
+        rag_cdc,
+        rag_db,
+        rag_embeddings,
+        rag_fts,
+        rag_prompt,
+        rag_rerank,
+        rag_store,
+    )
+except ImportError:
+    # Fallback cuando se ejecuta el script directamente o lo importa
+    # rag_mcp_server.py como módulo suelto.
+    sys.path.append(str(Path(__file__).resolve().parent))
+    import rag_ann
+    import rag_cdc
+    import rag_db
+    import rag_embeddings
+    import rag_fts
+    import rag_prompt
+    import rag_rerank
+    import rag_store
 
 
 BASE_DIR = Path(__file__).parent
@@ -17,28 +52,166 @@ DB_PATH = BASE_DIR / "incidents.db"
 
 load_dotenv()
 
+# Las claves y el modelo se comprueban al usarlos por primera vez (ver
+# _chat_model, _anthropic y _embedder), no al importar: así importar este
+# módulo no exige claves y el arranque del servidor no paga la carga de los
+# SDK de Anthropic y OpenAI.
 MODEL = os.getenv("MODEL")
-if not MODEL:
-    raise RuntimeError(
-        "La variable de entorno MODEL no está definida. "
-        "Crea un archivo .env con una línea como: MODEL=claude-haiku-4-5-20251001"
-    )
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-if not ANTHROPIC_API_KEY:
-    raise RuntimeError("Falta ANTHROPIC_API_KEY en el entorno / .env")
+# Proveedor de embeddings: "openai" (API remota) o "local" (hashing en CPU,
+# sin red; ver rag_embeddings.HashingEmbedder).
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+LOCAL_EMBEDDING_DIM = int(
+    os.getenv("LOCAL_EMBEDDING_DIM", str(rag_embeddings.DEFAULT_LOCAL_DIM))
+)
+LOCAL_EMBEDDING_WORKERS = int(os.getenv("LOCAL_EMBEDDING_WORKERS", "0"))  # 0 = nº de CPUs
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("Falta OPENAI_API_KEY en el entorno / .env para embeddings")
+# Identifica el modelo en rag_store y en las cachés: cambiar de proveedor
+# no mezcla vectores de espacios distintos.
+EMBEDDING_MODEL = (
+    rag_embeddings.local_model_name(LOCAL_EMBEDDING_DIM)
+    if EMBEDDING_PROVIDER == "local"
+    else os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+)
 
-EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+# Troceado y concurrencia de las peticiones de embeddings.
+EMBEDDING_BATCH_SIZE = int(
+    os.getenv("EMBEDDING_BATCH_SIZE", str(rag_embeddings.DEFAULT_MAX_BATCH_ITEMS))
+)
+EMBEDDING_BATCH_TOKENS = int(
+    os.getenv("EMBEDDING_BATCH_TOKENS", str(rag_embeddings.DEFAULT_MAX_BATCH_TOKENS))
+)
+EMBEDDING_CONCURRENCY = int(
+    os.getenv("EMBEDDING_CONCURRENCY", str(rag_embeddings.DEFAULT_CONCURRENCY))
+)
 
-anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Nº máximo de preguntas cuyo embedding se mantiene en caché (LRU).
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
 
+# Tipo de índice de búsqueda: "exact" (producto matriz-vector sobre todo el
+# corpus), "ivf" (aproximado, sub-lineal; útil con muchos tickets),
+# "int8"/"binary" (vectores cuantizados en memoria + reordenación exacta) o
+# "sharded" (búsqueda exacta repartida en RAG_SHARDS procesos).
+RAG_INDEX_KIND = os.getenv("RAG_INDEX_KIND", "exact")
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))  # 0 = sqrt(n_tickets)
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "8"))
+# Con cuantización, nº de candidatos por cada resultado pedido que se
+# reordenan con los vectores float exactos.
+RAG_RESCORE_FACTOR = int(os.getenv("RAG_RESCORE_FACTOR", "4"))
+RAG_SHARDS = int(os.getenv("RAG_SHARDS", "0"))  # 0 = nº de CPUs
 
-@dataclass
+# Nº máximo de entradas del log de cambios (ticket_changes) que se aplican
+# en cada sincronización incremental.
+CDC_BATCH_SIZE = int(os.getenv("CDC_BATCH_SIZE", "1000"))
+# Los cambios incrementales van a un segmento pequeño (delta) que se busca
+# junto al índice principal sin reconstruirlo. Cuando las filas del delta
+# más las del principal que han quedado obsoletas superan esta fracción del
+# principal, se compacta todo en un índice nuevo.
+RAG_DELTA_MAX_FRACTION = float(os.getenv("RAG_DELTA_MAX_FRACTION", "0.1"))
+
+# Estrategia de recuperación: "vector" (solo embeddings) o "hybrid"
+# (embeddings + BM25 sobre el índice FTS5, fusionados con RRF).
+RAG_RETRIEVAL = os.getenv("RAG_RETRIEVAL", "vector")
+# Candidatos que aporta cada retriever antes de fusionar en modo híbrido.
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+
+# Reranking por feedback: peso del ajuste y nº de candidatos extra que se
+# recuperan para que el feedback pueda subir tickets que quedaban fuera del top-k.
+RERANK_WEIGHT = float(os.getenv("RERANK_WEIGHT", str(rag_rerank.DEFAULT_WEIGHT)))
+RERANK_EXTRA_CANDIDATES = int(os.getenv("RERANK_EXTRA_CANDIDATES", "5"))
+
+# Presupuesto (estimado localmente) de tokens del contexto enviado al modelo
+# y mínimo de tokens de cuerpo para que merezca la pena incluir un ticket.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MIN_TICKET_TOKENS = int(os.getenv("CONTEXT_MIN_TICKET_TOKENS", "40"))
+
+# Caché semántica de respuestas: nº máximo de entradas y similitud coseno
+# mínima entre preguntas para reutilizar una respuesta ya generada.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Chunking de tickets largos: tamaño (en tokens estimados) de cada pasaje que
+# se indexa y solape entre pasajes consecutivos. 0 = un vector por ticket.
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "0"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "40"))
+# Un pasaje entra en el contexto si su similitud está a menos de este margen
+# de la del mejor pasaje de su ticket.
+RAG_CHUNK_SCORE_MARGIN = float(os.getenv("RAG_CHUNK_SCORE_MARGIN", "0.05"))
+
+# Clientes y proveedor de embeddings: se crean la primera vez que se usan y
+# se reutilizan después (los tests los sustituyen asignando estos globales).
+anthropic_client: Anthropic | None = None
+openai_client: OpenAI | None = None
+embedder: Any = None
+_CLIENTS_LOCK = threading.RLock()
+
+
+def _require_env(name: str, message: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(message)
+    return value
+
+
+def _chat_model() -> str:
+    if not MODEL:
+        raise RuntimeError(
+            "La variable de entorno MODEL no está definida. "
+            "Crea un archivo .env con una línea como: MODEL=claude-haiku-4-5-20251001"
+        )
+    return MODEL
+
+
+def _anthropic() -> Anthropic:
+    """Cliente de Anthropic, creado (e importado el SDK) en el primer uso."""
+    global anthropic_client
+    with _CLIENTS_LOCK:
+        if anthropic_client is None:
+            api_key = _require_env(
+                "ANTHROPIC_API_KEY", "Falta ANTHROPIC_API_KEY en el entorno / .env"
+            )
+            from anthropic import Anthropic
+
+            anthropic_client = Anthropic(api_key=api_key)
+        return anthropic_client
+
+
+def _openai() -> OpenAI:
+    """Cliente de OpenAI, creado (e importado el SDK) en el primer uso."""
+    global openai_client
+    with _CLIENTS_LOCK:
+        if openai_client is None:
+            api_key = _require_env(
+                "OPENAI_API_KEY", "Falta OPENAI_API_KEY en el entorno / .env para embeddings"
+            )
+            from openai import OpenAI
+
+            openai_client = OpenAI(api_key=api_key)
+        return openai_client
+
+
+def _embedder() -> Any:
+    """Proveedor de embeddings configurado (EMBEDDING_PROVIDER), creado en el primer uso."""
+    global embedder
+    with _CLIENTS_LOCK:
+        if embedder is None:
+            if EMBEDDING_PROVIDER == "local":
+                embedder = rag_embeddings.make_embedder(
+                    "local", dim=LOCAL_EMBEDDING_DIM, workers=LOCAL_EMBEDDING_WORKERS
+                )
+            else:
+                embedder = rag_embeddings.make_embedder(
+                    EMBEDDING_PROVIDER,
+                    client=_openai() if EMBEDDING_PROVIDER == "openai" else None,
+                    model=EMBEDDING_MODEL,
+                    max_items=EMBEDDING_BATCH_SIZE,
+                    max_tokens=EMBEDDING_BATCH_TOKENS,
+                    concurrency=EMBEDDING_CONCURRENCY,
+                )
+        return embedder
+
+
+@dataclass(slots=True)
 class Ticket:
     id: int
     title: str
@@ -50,38 +223,191 @@ class Ticket:
         return asdict(self)
 
 
-_TICKETS: List[Ticket] = []
-_EMBEDDINGS: List[List[float]] = []
+@dataclass(frozen=True, eq=False)
+class IndexSnapshot:
+    """
+    Estado inmutable del índice en memoria.
+
+    Es columnar: solo arrays NumPy contiguos (ids, vectores y metadatos por
+    fila). Los textos de los tickets no se guardan; se leen de SQLite
+    únicamente para los tickets del top-k de cada consulta.
+
+    `refresh_index` construye un snapshot nuevo aparte y lo publica con una
+    única asignación de `_SNAPSHOT`; cada consulta toma una referencia al
+    empezar, así que nunca mezcla vectores de un índice con ids de otro ni
+    espera a que termine una reindexación.
+    """
+
+    # Base de datos de la que procede el índice.
+    db_path: Path | None
+    # Ids de los tickets indexados, en orden ascendente (búsqueda binaria).
+    ticket_ids: np.ndarray
+    # Matriz (n_filas x dim) en float32 con las filas ya normalizadas (norma 1),
+    # de modo que la similitud coseno se reduce a un producto escalar. Sin
+    # chunking hay una fila por ticket; con chunking, una por pasaje.
+    embeddings: np.ndarray
+    # Hash del texto embebido de cada fila, usado para detectar cambios en
+    # la reindexación incremental.
+    row_hashes: np.ndarray
+    # Posición en `ticket_ids` del ticket al que pertenece cada fila.
+    row_tickets: np.ndarray
+    # Rango de palabras del cuerpo del ticket que cubre cada fila.
+    row_spans: np.ndarray
+    # Las filas del ticket i son row_start[i]:row_start[i + 1].
+    row_start: np.ndarray
+    # Índice de búsqueda (exacto, aproximado...) construido sobre `embeddings`.
+    index: Any
+    # Último cambio de `ticket_changes` que ya refleja este snapshot.
+    change_seq: int = 0
+    # Tickets nuevos o modificados desde la última compactación, como un
+    # snapshot pequeño (sin delta propio) con índice exacto. Ver sync_changes.
+    delta: IndexSnapshot | None = None
+    # Posiciones en `ticket_ids` de los tickets borrados o sustituidos por
+    # su versión en `delta`; sus filas se ignoran al buscar.
+    dead: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+
+    @property
+    def ready(self) -> bool:
+        # Publicado por refresh_index/sync_changes, aunque la base de datos
+        # no tenga tickets (el snapshot inicial no tiene db_path).
+        return self.db_path is not None
+
+
+def _empty_snapshot() -> IndexSnapshot:
+    embeddings = np.zeros((0, 0), dtype=np.float32)
+    return IndexSnapshot(
+        db_path=None,
+        ticket_ids=np.zeros(0, dtype=np.int64),
+        embeddings=embeddings,
+        row_hashes=np.zeros(0, dtype="S64"),
+        row_tickets=np.zeros(0, dtype=np.int64),
+        row_spans=np.zeros((0, 2), dtype=np.int32),
+        row_start=np.zeros(1, dtype=np.int64),
+        index=rag_ann.ExactIndex(embeddings),
+    )
+
+
+_SNAPSHOT: IndexSnapshot = _empty_snapshot()
+# Serializa la construcción/actualización del índice (reentrante porque
+# _current_index lo toma antes de llamar a build_index). Las consultas no
+# lo toman salvo que todavía no exista ningún índice.
+_INDEX_LOCK = threading.RLock()
 
+# Caché LRU de embeddings de preguntas: (pregunta normalizada, modelo) -> vector
+# ya normalizado. Evita una llamada de red cuando se repite la misma pregunta.
+_QUERY_CACHE: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+_QUERY_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0}
+_QUERY_CACHE_LOCK = threading.Lock()
 
-def _load_tickets(db_path: Path | str = DB_PATH) -> List[Ticket]:
+# Boosts aprendidos del feedback de los usuarios (en memoria, incremental).
+_RERANKER = rag_rerank.FeedbackReranker(weight=RERANK_WEIGHT)
+
+
+@dataclass
+class _CachedAnswer:
+    question_embedding: np.ndarray
+    # (id, hash del texto) de los tickets recuperados, en orden de ranking.
+    ticket_versions: Tuple[Tuple[int, str], ...]
+    result: Dict[str, Any]
+
+
+# Caché semántica de respuestas (LRU). Se vacía cada vez que el índice cambia.
+_ANSWER_CACHE: "OrderedDict[int, _CachedAnswer]" = OrderedDict()
+_ANSWER_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0}
+_ANSWER_CACHE_LOCK = threading.Lock()
+_ANSWER_CACHE_SEQ = 0
+
+
+_TICKET_COLUMNS = "id, title, body, tags, created_at"
+
+
+def _require_db(db_path: Path | str) -> Path:
+    """
+    Comprueba que la base de datos existe antes de tocarla. Las conexiones
+    de escritura (rag_store, rag_cdc, rag_fts) crearían un fichero vacío que
+    después pasaría por una base de datos real.
+    """
     path = Path(db_path)
     if not path.exists():
         raise RuntimeError(
             f"No se ha encontrado la base de datos {path}. "
             "Ejecuta primero ej7_mcp_rag_db/seed_db.py."
         )
+    return path
 
-    conn = sqlite3.connect(path)
-    try:
-        cur = conn.execute(
-            "SELECT id, title, body, tags, created_at FROM tickets ORDER BY id"
-        )
-        rows = cur.fetchall()
-    finally:
-        conn.close()
-
-    tickets = [
-        Ticket(
-            id=row[0],
-            title=row[1],
-            body=row[2],
-            tags=row[3] or "",
-            created_at=row[4],
-        )
-        for row in rows
-    ]
-    return tickets
+
+def _connect_db(db_path: Path | str) -> sqlite3.Connection:
+    """
+    Conexión de solo lectura (compartida por hilo, ver rag_db) para leer
+    tickets: no compite con las escrituras de seed_db ni del índice.
+    """
+    return rag_db.connect(_require_db(db_path), readonly=True)
+
+
+def _row_to_ticket(row: Tuple[Any, ...]) -> Ticket:
+    return Ticket(
+        id=row[0],
+        title=row[1],
+        body=row[2],
+        tags=row[3] or "",
+        created_at=row[4],
+    )
+
+
+def _load_tickets(db_path: Path | str = DB_PATH) -> Iterator[Ticket]:
+    """
+    Recorre todos los tickets en orden de id sin cargarlos a la vez en
+    memoria (el cursor de SQLite va leyendo filas según se piden).
+    """
+    conn = _connect_db(db_path)
+    for row in conn.execute(f"SELECT {_TICKET_COLUMNS} FROM tickets ORDER BY id"):
+        yield _row_to_ticket(row)
+
+
+def _fetch_tickets(ids: Iterable[int], db_path: Path | str) -> Dict[int, Ticket]:
+    """
+    Materializa solo los tickets pedidos con una consulta `WHERE id IN (...)`.
+    Los ids que ya no existen en la base de datos no aparecen en el resultado.
+    """
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    if not ids:
+        return {}
+    conn = _connect_db(db_path)
+    # Los ids van como un único parámetro JSON: la consulta es siempre la
+    # misma y se reutiliza desde la caché de sentencias preparadas (con un
+    # `?` por id habría una sentencia distinta por cada tamaño de lista).
+    rows = conn.execute(
+        f"SELECT {_TICKET_COLUMNS} FROM tickets "
+        "WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(ids),),
+    ).fetchall()
+    return {row[0]: _row_to_ticket(row) for row in rows}
+
+
+def latest_tickets(limit: int = 5, db_path: Path | str = DB_PATH) -> List[Ticket]:
+    """
+    Devuelve los últimos `limit` tickets (en orden ascendente de id) con
+    una consulta indexada, sin cargar toda la tabla ni tocar el índice
+    de embeddings.
+    """
+    conn = _connect_db(db_path)
+    rows = conn.execute(
+        f"SELECT {_TICKET_COLUMNS} FROM tickets ORDER BY id DESC LIMIT ?",
+        (max(1, limit),),
+    ).fetchall()
+    return [_row_to_ticket(row) for row in reversed(rows)]
+
+
+def get_ticket(ticket_id: int, db_path: Path | str = DB_PATH) -> Ticket | None:
+    """
+    Busca un ticket por clave primaria. Devuelve None si no existe.
+    """
+    conn = _connect_db(db_path)
+    row = conn.execute(
+        f"SELECT {_TICKET_COLUMNS} FROM tickets WHERE id = ?",
+        (ticket_id,),
+    ).fetchone()
+    return _row_to_ticket(row) if row else None
 
 
 def _prepare_text(ticket: Ticket) -> str:
@@ -94,15 +420,63 @@ def _prepare_text(ticket: Ticket) -> str:
     return "\n\n".join(parts)
 
 
+def _split_passages(
+    words: List[str], max_tokens: int, overlap_tokens: int
+) -> List[Tuple[int, int]]:
+    """
+    Divide una lista de palabras en ventanas [inicio, fin) de como mucho
+    `max_tokens` tokens estimados; cada ventana repite las últimas
+    `overlap_tokens` de la anterior para no partir una idea por la mitad.
+    """
+    costs = [(len(word) + 1) / 4 for word in words]
+    if sum(costs) <= max_tokens:
+        return [(0, len(words))]
+
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    while start < len(words):
+        end, used = start, 0.0
+        while end < len(words) and (end == start or used + costs[end] <= max_tokens):
+            used += costs[end]
+            end += 1
+        spans.append((start, end))
+        if end >= len(words):
+            break
+        # Retrocedemos el solape, pero avanzando siempre al menos una palabra.
+        back, used = end, 0.0
+        while back > start + 1 and used + costs[back - 1] <= overlap_tokens:
+            back -= 1
+            used += costs[back]
+        start = back
+    return spans
+
+
+def _ticket_passages(ticket: Ticket) -> List[Tuple[Tuple[int, int], str]]:
+    """
+    Pasajes de un ticket que se indexan, como [(rango de palabras, texto)].
+    Cada pasaje conserva título y tags para no perder contexto. Sin chunking
+    (o si el cuerpo cabe en un pasaje) es el texto completo del ticket, con
+    el mismo hash que los embeddings ya guardados.
+    """
+    words = ticket.body.split()
+    spans = (
+        _split_passages(words, RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP)
+        if RAG_CHUNK_TOKENS > 0
+        else [(0, len(words))]
+    )
+    if len(spans) == 1:
+        return [((0, len(words)), _prepare_text(ticket))]
+    return [
+        ((start, end), _prepare_text(replace(ticket, body=" ".join(words[start:end]))))
+        for start, end in spans
+    ]
+
+
 def _embed_texts(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
 
-    response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=texts,
-    )
-    return [item.embedding for item in response.data]
+    return _embedder().embed(texts)
 
 
 def _cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -116,131 +490,1144 @@ def _cosine_similarity(a: List[float], b: List[float]) -> float:
     return dot / (norm_a * norm_b)
 
 
-def build_index(db_path: Path | str = DB_PATH) -> int:
+def _normalize_rows(vectors: List[List[float]] | np.ndarray) -> np.ndarray:
+    """
+    Convierte los embeddings en una matriz float32 con filas de norma 1.
+
+    Las filas con norma (casi) nula se dejan a cero para que su similitud
+    sea 0, igual que en `_cosine_similarity`.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    safe = np.where(norms < 1e-10, 1.0, norms)
+    matrix = matrix / safe
+    matrix[(norms < 1e-10).ravel()] = 0.0
+    return matrix
+
+
+def _build_search_index(matrix: np.ndarray) -> Any:
+    params: Dict[str, Any] = {}
+    if RAG_INDEX_KIND == "ivf":
+        params = {"nlist": RAG_IVF_NLIST, "nprobe": RAG_IVF_NPROBE}
+    elif RAG_INDEX_KIND in rag_ann.QUANTIZED_KINDS:
+        params = {"rescore": RAG_RESCORE_FACTOR}
+    elif RAG_INDEX_KIND == "sharded":
+        params = {"shards": RAG_SHARDS}
+    return rag_ann.build_index(RAG_INDEX_KIND, matrix, **params)
+
+
+# Nº de generación de los ficheros de vectores volcados por este proceso.
+_SPILL_SEQ = itertools.count()
+
+
+def _spill_vectors(matrix: np.ndarray, db_path: Path | str) -> np.ndarray:
+    """
+    Guarda la matriz normalizada junto a la base de datos y la devuelve
+    mapeada en memoria (solo lectura). Con un índice cuantizado los vectores
+    float solo se leen para reordenar unos pocos candidatos, así que pueden
+    quedarse en disco y en la caché de páginas del sistema operativo.
+
+    Cada construcción escribe su propio fichero
+    (`incidents.vectors.<pid>-<n>.npy`): el del snapshot anterior puede
+    seguir mapeado por consultas en curso, así que no se sobrescribe, sino
+    que se borra cuando ya no queda ningún array que lo use.
+    """
+    db_path = Path(db_path)
+    path = db_path.with_name(f"{db_path.stem}.vectors.{os.getpid()}-{next(_SPILL_SEQ)}.npy")
+    with path.open("wb") as f:
+        np.save(f, matrix)
+    vectors = np.load(path, mmap_mode="r")
+    # Las vistas de `vectors` la referencian como base: el fichero se borra
+    # cuando el snapshot y todas ellas son inalcanzables.
+    weakref.finalize(vectors, _remove_spill, path)
+    return vectors
+
+
+def _remove_spill(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass  # ya borrado o, en Windows, todavía abierto
+
+
+def _previous_vectors(db_path: Path | str) -> Dict[int, Dict[str, np.ndarray]]:
+    """
+    Estado anterior del índice como {ticket_id: {content_hash: vector}}.
+
+    Si hay índice en memoria se usa ese; si no (por ejemplo, justo tras
+    arrancar el proceso) se parte de los embeddings persistidos.
+    """
+    previous: Dict[int, Dict[str, np.ndarray]] = {}
+    snap = _SNAPSHOT
+    if snap.ready and snap.db_path == Path(db_path):
+        row_ids, matrix, hashes, _ = _live_rows(snap)
+        for ticket_id, digest, vector in zip(row_ids.tolist(), hashes.tolist(), matrix):
+            previous.setdefault(ticket_id, {})[digest.decode("ascii")] = vector
+        return previous
+
+    for (ticket_id, digest), vector in rag_store.load_embeddings(
+        db_path, EMBEDDING_MODEL
+    ).items():
+        previous.setdefault(ticket_id, {})[digest] = vector
+    return previous
+
+
+def refresh_index(db_path: Path | str = DB_PATH, force: bool = False) -> Dict[str, int]:
+    """
+    Sincroniza el índice en memoria con la base de datos de forma incremental.
+
+    Solo se calculan embeddings de los tickets (o pasajes, con chunking)
+    nuevos o cuyo texto ha cambiado; los tickets borrados desaparecen del
+    índice y del almacén persistente. Con `force=True` se descartan los
+    embeddings guardados y se recalcula todo.
+
+    Devuelve un dict con los contadores `added`, `updated`, `removed`,
+    `unchanged` y los totales `indexed_tickets` e `indexed_passages`.
+    """
+    global _SNAPSHOT
+
+    # Un único constructor a la vez: evita reindexaciones duplicadas cuando
+    # varias peticiones concurrentes encuentran el índice vacío.
+    with _INDEX_LOCK:
+        _require_db(db_path)
+        if RAG_RETRIEVAL == "hybrid":
+            rag_fts.ensure_fts(db_path)
+        # Los cambios apuntados hasta aquí quedan cubiertos por esta lectura
+        # completa; los posteriores los aplicará sync_changes.
+        has_change_log = rag_cdc.ensure_change_log(db_path)
+        change_seq = rag_cdc.latest_seq(db_path) if has_change_log else 0
+
+        if force:
+            rag_store.prune_embeddings(db_path, EMBEDDING_MODEL, keep=[])
+            previous: Dict[int, Dict[str, np.ndarray]] = {}
+        else:
+            previous = _previous_vectors(db_path)
+
+        # Se recorren los tickets en streaming: de cada uno solo se conservan
+        # su id, el hash de cada fila y, si hay que embeberlo, su texto.
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        ticket_ids: List[int] = []
+        row_tickets: List[int] = []
+        spans: List[Tuple[int, int]] = []
+        hashes: List[str] = []
+        starts = [0]
+        vectors: List[np.ndarray | None] = []
+        missing: List[int] = []
+        missing_texts: List[str] = []
+        for pos, ticket in enumerate(_load_tickets(db_path)):
+            known = previous.get(ticket.id)
+            changed = False
+            for span, text in _ticket_passages(ticket):
+                digest = rag_store.content_hash(text)
+                if known is not None and digest in known:
+                    vectors.append(known[digest])
+                else:
+                    missing.append(len(vectors))
+                    missing_texts.append(text)
+                    vectors.append(None)
+                    changed = True
+                row_tickets.append(pos)
+                spans.append(span)
+                hashes.append(digest)
+            if not changed:
+                stats["unchanged"] += 1
+            else:
+                stats["updated" if known is not None else "added"] += 1
+            ticket_ids.append(ticket.id)
+            starts.append(len(vectors))
+
+        current_ids = set(ticket_ids)
+        stats["removed"] = sum(1 for ticket_id in previous if ticket_id not in current_ids)
+
+        fresh = _embed_texts(missing_texts)
+        del missing_texts
+        for row, vector in zip(missing, fresh):
+            vectors[row] = np.asarray(vector, dtype=np.float32)
+
+        if missing or stats["removed"] or force:
+            rag_store.save_embeddings(
+                db_path,
+                EMBEDDING_MODEL,
+                (
+                    (ticket_ids[row_tickets[row]], hashes[row], vector)
+                    for row, vector in zip(missing, fresh)
+                ),
+            )
+            rag_store.prune_embeddings(
+                db_path,
+                EMBEDDING_MODEL,
+                keep=((ticket_ids[pos], digest) for pos, digest in zip(row_tickets, hashes)),
+            )
+
+        current = _SNAPSHOT
+        if (
+            not missing
+            and not stats["removed"]
+            and not force
+            and current.ready
+            and current.db_path == Path(db_path)
+            and current.index.kind == RAG_INDEX_KIND
+        ):
+            # Nada ha cambiado: se conserva el índice actual tal cual.
+            _SNAPSHOT = replace(current, change_seq=change_seq)
+            if has_change_log:
+                rag_cdc.purge_changes(db_path, change_seq)
+            return {**stats, **_index_counts(current)}
+
+        if missing or stats["removed"] or current.db_path != Path(db_path):
+            # El corpus ha cambiado: las respuestas cacheadas pueden estar obsoletas.
+            clear_answer_cache()
+
+        matrix = (
+            _normalize_rows(np.stack(vectors))  # type: ignore[arg-type]
+            if vectors
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        del vectors
+        snapshot = _make_snapshot(
+            db_path,
+            np.asarray(ticket_ids, dtype=np.int64),
+            matrix,
+            np.asarray(hashes, dtype="S64"),
+            np.asarray(row_tickets, dtype=np.int64),
+            np.asarray(spans, dtype=np.int32).reshape(-1, 2),
+            np.asarray(starts, dtype=np.int64),
+            change_seq,
+        )
+        _SNAPSHOT = snapshot
+        if has_change_log:
+            rag_cdc.purge_changes(db_path, change_seq)
+
+        return {**stats, **_index_counts(snapshot)}
+
+
+def _make_snapshot(
+    db_path: Path | str,
+    ticket_ids: np.ndarray,
+    matrix: np.ndarray,
+    row_hashes: np.ndarray,
+    row_tickets: np.ndarray,
+    row_spans: np.ndarray,
+    row_start: np.ndarray,
+    change_seq: int,
+) -> IndexSnapshot:
+    """
+    Construye el índice de búsqueda sobre `matrix` (ya normalizada) y lo
+    empaqueta en un snapshot listo para publicar. Todo lo costoso ocurre
+    aquí, antes de la publicación; las consultas en curso siguen usando el
+    snapshot anterior hasta que terminan.
+    """
+    if RAG_INDEX_KIND in rag_ann.QUANTIZED_KINDS and matrix.size:
+        matrix = _spill_vectors(matrix, db_path)
+    search_index = _build_search_index(matrix)
+    return IndexSnapshot(
+        db_path=Path(db_path),
+        ticket_ids=ticket_ids,
+        # Algunos índices guardan su propia copia de la matriz (p. ej. el
+        # repartido); se usa esa para no tenerla dos veces.
+        embeddings=search_index.matrix,
+        row_hashes=row_hashes,
+        row_tickets=row_tickets,
+        row_spans=row_spans,
+        row_start=row_start,
+        index=search_index,
+        change_seq=change_seq,
+    )
+
+
+def _sorted_rows(
+    row_ids: np.ndarray, matrix: np.ndarray, hashes: np.ndarray, spans: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Ordena por id de ticket unas filas sueltas (el orden estable mantiene
+    juntos y en orden los pasajes de cada ticket) y devuelve los arrays de
+    un snapshot: ticket_ids, matriz, hashes, row_tickets, rangos y row_start.
+    """
+    order = np.argsort(row_ids, kind="stable")
+    row_ids = row_ids[order]
+    ticket_index = np.unique(row_ids)
+    return (
+        ticket_index,
+        np.ascontiguousarray(matrix[order]),
+        hashes[order],
+        np.searchsorted(ticket_index, row_ids).astype(np.int64),
+        spans[order],
+        np.append(np.searchsorted(row_ids, ticket_index), row_ids.shape[0]).astype(np.int64),
+    )
+
+
+def _make_delta(
+    db_path: Path | str,
+    row_ids: np.ndarray,
+    matrix: np.ndarray,
+    hashes: np.ndarray,
+    spans: np.ndarray,
+    change_seq: int,
+) -> IndexSnapshot | None:
+    """
+    Segmento delta con las filas dadas. Es pequeño, así que usa siempre la
+    búsqueda exacta y se reconstruye entero en cada cambio.
+    """
+    if not row_ids.size:
+        return None
+    ticket_index, matrix, hashes, row_tickets, spans, row_start = _sorted_rows(
+        row_ids, matrix, hashes, spans
+    )
+    return IndexSnapshot(
+        db_path=Path(db_path),
+        ticket_ids=ticket_index,
+        embeddings=matrix,
+        row_hashes=hashes,
+        row_tickets=row_tickets,
+        row_spans=spans,
+        row_start=row_start,
+        index=rag_ann.ExactIndex(matrix),
+        change_seq=change_seq,
+    )
+
+
+def _dead_rows(snap: IndexSnapshot, dead: np.ndarray | None = None) -> int:
+    """Nº de filas del índice principal que pertenecen a tickets obsoletos."""
+    dead = snap.dead if dead is None else dead
+    return int((snap.row_start[dead + 1] - snap.row_start[dead]).sum())
+
+
+def _live_rows(snap: IndexSnapshot) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Filas vigentes de `snap` (las del principal no obsoletas más las del
+    delta) como arrays de id de ticket, vector, hash y rango por fila.
+    """
+    row_ids = snap.ticket_ids[snap.row_tickets]
+    if snap.delta is None and not snap.dead.size:
+        return row_ids, snap.embeddings, snap.row_hashes, snap.row_spans
+
+    keep = ~np.isin(snap.row_tickets, snap.dead)
+    parts = [
+        (
+            row_ids[keep],
+            np.asarray(snap.embeddings[keep], dtype=np.float32),
+            snap.row_hashes[keep],
+            snap.row_spans[keep],
+        )
+    ]
+    delta = snap.delta
+    if delta is not None:
+        parts.append(
+            (delta.ticket_ids[delta.row_tickets], delta.embeddings, delta.row_hashes, delta.row_spans)
+        )
+    row_ids, matrix, hashes, spans = (np.concatenate(column) for column in zip(*parts))
+    return row_ids, matrix, hashes, spans
+
+
+def _index_counts(snap: IndexSnapshot) -> Dict[str, int]:
+    """Tickets y pasajes que se pueden encontrar con `snap`."""
+    tickets = snap.ticket_ids.shape[0] - snap.dead.shape[0]
+    passages = snap.row_hashes.shape[0] - _dead_rows(snap)
+    if snap.delta is not None:
+        tickets += snap.delta.ticket_ids.shape[0]
+        passages += snap.delta.row_hashes.shape[0]
+    return {"indexed_tickets": int(tickets), "indexed_passages": int(passages)}
+
+
+def sync_changes(db_path: Path | str = DB_PATH) -> Dict[str, int]:
+    """
+    Aplica al índice los cambios pendientes del log `ticket_changes`
+    (change data capture con triggers): solo se leen y embeben los tickets
+    afectados, así que un ticket nuevo es buscable en segundos con un coste
+    proporcional a lo que ha cambiado. Las versiones nuevas van al segmento
+    delta del snapshot; el índice principal se reutiliza hasta que toca
+    compactar (ver _apply_changes).
+
+    Si todavía no hay índice (o es de otra base de datos, o está vacío) hace
+    una reindexación completa con `refresh_index`. Devuelve los mismos
+    contadores que `refresh_index` más `changes` (entradas del log aplicadas).
+    """
+    with _INDEX_LOCK:
+        snap = _SNAPSHOT
+        if not snap.ready or snap.db_path != Path(db_path) or not snap.embeddings.size:
+            # Sin índice previo (o vacío, sin dimensión para el delta).
+            return {**refresh_index(db_path), "changes": 0}
+        if not rag_cdc.ensure_change_log(db_path):
+            raise RuntimeError(f"La base de datos {db_path} no tiene tabla `tickets`.")
+        if 0 < rag_cdc.oldest_seq(db_path) <= snap.change_seq:
+            # Los cambios ya aplicados se purgan; si vuelven a aparecer
+            # números antiguos es que el log se ha recreado (p. ej. seed_db).
+            return {**refresh_index(db_path), "changes": 0}
+
+        changes = rag_cdc.read_changes(db_path, snap.change_seq, limit=CDC_BATCH_SIZE)
+        if not changes:
+            return {
+                "added": 0,
+                "updated": 0,
+                "removed": 0,
+                "unchanged": 0,
+                **_index_counts(snap),
+                "changes": 0,
+            }
+
+        stats = _apply_changes(
+            snap, {ticket_id for _, ticket_id, _ in changes}, db_path, changes[-1][0]
+        )
+        rag_cdc.purge_changes(db_path, changes[-1][0])
+        return {**stats, "changes": len(changes)}
+
+
+def _apply_changes(
+    snap: IndexSnapshot, ticket_ids: Iterable[int], db_path: Path | str, change_seq: int
+) -> Dict[str, int]:
+    """
+    Publica un snapshot nuevo en el que los tickets `ticket_ids` se han
+    releído de la base de datos (o eliminado, si ya no existen), sin volver
+    a embeber nada más.
+
+    El índice principal no se reconstruye: las versiones nuevas van al
+    segmento delta y las antiguas se marcan como obsoletas en `dead`. Cuando
+    el delta y lo obsoleto superan RAG_DELTA_MAX_FRACTION del principal, se
+    compacta todo en un índice principal nuevo.
+    """
+    global _SNAPSHOT
+
+    ticket_ids = sorted(set(ticket_ids))
+    fresh = _fetch_tickets(ticket_ids, db_path)
+    current: Dict[int, Tuple[IndexSnapshot, int]] = {}
+    for ticket_id in ticket_ids:
+        found = _locate(snap, ticket_id)
+        if found is not None:
+            current[ticket_id] = found
+
+    stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    new_ids: List[int] = []
+    new_spans: List[Tuple[int, int]] = []
+    new_hashes: List[str] = []
+    new_vectors: List[np.ndarray | None] = []
+    missing: List[int] = []
+    missing_texts: List[str] = []
+    for ticket_id in sorted(fresh):
+        known: Dict[str, np.ndarray] = {}
+        found = current.get(ticket_id)
+        if found is not None:
+            segment, pos = found
+            for row in range(int(segment.row_start[pos]), int(segment.row_start[pos + 1])):
+                known[segment.row_hashes[row].decode("ascii")] = segment.embeddings[row]
+        passages = _ticket_passages(fresh[ticket_id])
+        changed = len(passages) != len(known)
+        for span, text in passages:
+            digest = rag_store.content_hash(text)
+            if digest in known:
+                new_vectors.append(known[digest])
+            else:
+                missing.append(len(new_vectors))
+                missing_texts.append(text)
+                new_vectors.append(None)
+                changed = True
+            new_ids.append(ticket_id)
+            new_spans.append(span)
+            new_hashes.append(digest)
+        if found is None:
+            stats["added"] += 1
+        else:
+            stats["updated" if changed else "unchanged"] += 1
+    stats["removed"] = sum(1 for ticket_id in current if ticket_id not in fresh)
+
+    if not stats["added"] and not stats["updated"] and not stats["removed"]:
+        # Cambios que no afectan al texto indexado (p. ej. solo created_at).
+        _SNAPSHOT = replace(snap, change_seq=change_seq)
+        return {**stats, **_index_counts(snap)}
+
+    fresh_vectors = _embed_texts(missing_texts)
+    for row, vector in zip(missing, fresh_vectors):
+        new_vectors[row] = _normalize_rows(vector)[0]
+
+    touched = set(current) | set(fresh)
+    rag_store.delete_embeddings(db_path, EMBEDDING_MODEL, touched)
+    rag_store.save_embeddings(
+        db_path, EMBEDDING_MODEL, zip(new_ids, new_hashes, new_vectors)  # type: ignore[arg-type]
+    )
+    clear_answer_cache()
+
+    # Delta nuevo: el anterior sin los tickets tocados más sus versiones
+    # nuevas. En el principal, los tickets tocados pasan a estar obsoletos.
+    dim = snap.embeddings.shape[1]
+    parts = [
+        (
+            np.asarray(new_ids, dtype=np.int64),
+            np.asarray(new_vectors, dtype=np.float32).reshape(-1, dim),
+            np.asarray(new_hashes, dtype="S64"),
+            np.asarray(new_spans, dtype=np.int32).reshape(-1, 2),
+        )
+    ]
+    delta = snap.delta
+    if delta is not None:
+        delta_ids = delta.ticket_ids[delta.row_tickets]
+        keep = ~np.isin(delta_ids, np.fromiter(touched, dtype=np.int64))
+        parts.insert(
+            0, (delta_ids[keep], delta.embeddings[keep], delta.row_hashes[keep], delta.row_spans[keep])
+        )
+    row_ids, matrix, hashes, spans = (np.concatenate(column) for column in zip(*parts))
+    base_positions = (_position_of(snap, ticket_id) for ticket_id in touched)
+    dead = np.union1d(
+        snap.dead, np.fromiter((pos for pos in base_positions if pos is not None), dtype=np.int64)
+    )
+
+    if row_ids.shape[0] + _dead_rows(snap, dead) <= RAG_DELTA_MAX_FRACTION * snap.row_hashes.shape[0]:
+        snapshot = replace(
+            snap,
+            delta=_make_delta(db_path, row_ids, matrix, hashes, spans, change_seq),
+            dead=dead,
+            change_seq=change_seq,
+        )
+    else:
+        # Compactación: filas vigentes del principal + delta, en un índice nuevo.
+        keep = ~np.isin(snap.row_tickets, dead)
+        snapshot = _make_snapshot(
+            db_path,
+            *_sorted_rows(
+                np.concatenate([snap.ticket_ids[snap.row_tickets[keep]], row_ids]),
+                np.concatenate([np.asarray(snap.embeddings[keep], dtype=np.float32), matrix]),
+                np.concatenate([snap.row_hashes[keep], hashes]),
+                np.concatenate([snap.row_spans[keep], spans]),
+            ),
+            change_seq,
+        )
+    _SNAPSHOT = snapshot
+    return {**stats, **_index_counts(snapshot)}
+
+
+def index_memory() -> Dict[str, int]:
+    """
+    Bytes que ocupa el índice en memoria, por array. Los textos de los
+    tickets no cuentan porque no se guardan: se leen de SQLite bajo demanda,
+    y tampoco los vectores float si están mapeados desde disco (índices
+    cuantizados); en ese caso cuentan los códigos cuantizados.
+    """
+    snap = _SNAPSHOT
+    embeddings = snap.embeddings
+    arrays = {
+        "embeddings": np.zeros(0) if isinstance(embeddings, np.memmap) else embeddings,
+        "ticket_ids": snap.ticket_ids,
+        "row_hashes": snap.row_hashes,
+        "row_tickets": snap.row_tickets,
+        "row_spans": snap.row_spans,
+        "row_start": snap.row_start,
+    }
+    sizes = {name: int(array.nbytes) for name, array in arrays.items()}
+    sizes["quantized_codes"] = int(getattr(snap.index, "nbytes", 0))
+    # Segmento delta (cambios pendientes de compactar) y tickets obsoletos.
+    delta = snap.delta
+    sizes["delta"] = int(snap.dead.nbytes) + (
+        0
+        if delta is None
+        else sum(
+            int(array.nbytes)
+            for array in (
+                delta.embeddings,
+                delta.ticket_ids,
+                delta.row_hashes,
+                delta.row_tickets,
+                delta.row_spans,
+                delta.row_start,
+            )
+        )
+    )
+    return {**sizes, "total": sum(sizes.values())}
+
+
+def build_index(db_path: Path | str = DB_PATH, force: bool = False) -> int:
     """
     Carga los tickets desde la base de datos y construye
     el índice de embeddings en memoria.
+
+    Los embeddings se persisten junto a incidents.db, así que tras un
+    reinicio solo se calculan los de tickets nuevos o modificados.
     """
-    global _TICKETS, _EMBEDDINGS
+    return refresh_index(db_path, force=force)["indexed_tickets"]
 
-    tickets = _load_tickets(db_path)
-    texts = [_prepare_text(t) for t in tickets]
-    embeddings = _embed_texts(texts)
 
-    _TICKETS = tickets
-    _EMBEDDINGS = embeddings
+def _normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
 
-    return len(_TICKETS)
 
+def _embed_query(question: str) -> np.ndarray | None:
+    """
+    Devuelve el embedding normalizado de la pregunta, usando la caché LRU
+    si esa misma pregunta (ignorando mayúsculas y espacios) ya se embebió
+    con el modelo actual.
+    """
+    key = (_normalize_question(question), EMBEDDING_MODEL)
+    with _QUERY_CACHE_LOCK:
+        cached = _QUERY_CACHE.get(key)
+        if cached is not None:
+            _QUERY_CACHE.move_to_end(key)
+            _QUERY_CACHE_STATS["hits"] += 1
+            return cached
+        _QUERY_CACHE_STATS["misses"] += 1
+
+    embedding_list = _embed_texts([question])
+    if not embedding_list:
+        return None
+    vector = _normalize_rows(embedding_list[0])[0]
 
-def _ensure_index() -> None:
-    if not _TICKETS or not _EMBEDDINGS:
-        build_index(DB_PATH)
+    if QUERY_EMBEDDING_CACHE_SIZE > 0:
+        with _QUERY_CACHE_LOCK:
+            _QUERY_CACHE[key] = vector
+            _QUERY_CACHE.move_to_end(key)
+            while len(_QUERY_CACHE) > QUERY_EMBEDDING_CACHE_SIZE:
+                _QUERY_CACHE.popitem(last=False)
+    return vector
+
+
+def query_cache_stats() -> Dict[str, int]:
+    """
+    Contadores de la caché de embeddings de preguntas.
+    """
+    with _QUERY_CACHE_LOCK:
+        return {
+            **_QUERY_CACHE_STATS,
+            "size": len(_QUERY_CACHE),
+            "max_size": QUERY_EMBEDDING_CACHE_SIZE,
+        }
+
+
+def _ticket_versions(
+    candidates: List[Tuple[Ticket, float]]
+) -> Tuple[Tuple[int, str], ...]:
+    return tuple(
+        (ticket.id, rag_store.content_hash(_prepare_text(ticket)))
+        for ticket, _ in candidates
+    )
+
+
+def _lookup_answer(
+    question_embedding: np.ndarray, versions: Tuple[Tuple[int, str], ...]
+) -> Dict[str, Any] | None:
+    """
+    Busca una respuesta cacheada para una pregunta casi idéntica
+    (similitud >= ANSWER_CACHE_THRESHOLD) que se respondió con exactamente
+    los mismos tickets y en la misma versión.
+    """
+    with _ANSWER_CACHE_LOCK:
+        best_key: int | None = None
+        best_score = ANSWER_CACHE_THRESHOLD
+        for key, entry in _ANSWER_CACHE.items():
+            if entry.ticket_versions != versions:
+                continue
+            score = float(entry.question_embedding @ question_embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            _ANSWER_CACHE_STATS["misses"] += 1
+            return None
+
+        _ANSWER_CACHE.move_to_end(best_key)
+        _ANSWER_CACHE_STATS["hits"] += 1
+        return _ANSWER_CACHE[best_key].result
+
+
+def _store_answer(
+    question_embedding: np.ndarray,
+    versions: Tuple[Tuple[int, str], ...],
+    result: Dict[str, Any],
+) -> None:
+    global _ANSWER_CACHE_SEQ
+
+    if ANSWER_CACHE_SIZE <= 0:
+        return
+    with _ANSWER_CACHE_LOCK:
+        _ANSWER_CACHE_SEQ += 1
+        _ANSWER_CACHE[_ANSWER_CACHE_SEQ] = _CachedAnswer(
+            question_embedding=question_embedding,
+            ticket_versions=versions,
+            result=result,
+        )
+        while len(_ANSWER_CACHE) > ANSWER_CACHE_SIZE:
+            _ANSWER_CACHE.popitem(last=False)
+
+
+def clear_answer_cache() -> None:
+    """
+    Invalida todas las respuestas cacheadas (se llama al cambiar el corpus).
+    """
+    with _ANSWER_CACHE_LOCK:
+        _ANSWER_CACHE.clear()
+
+
+def answer_cache_stats() -> Dict[str, int]:
+    """
+    Contadores de la caché semántica de respuestas.
+    """
+    with _ANSWER_CACHE_LOCK:
+        return {
+            **_ANSWER_CACHE_STATS,
+            "size": len(_ANSWER_CACHE),
+            "max_size": ANSWER_CACHE_SIZE,
+        }
+
+
+def _current_index() -> IndexSnapshot:
+    """
+    Snapshot del índice que debe usar una consulta. Solo si todavía no se ha
+    construido ninguno se construye aquí (la primera vez, en el CLI); el
+    resto de reindexaciones no bloquean a las consultas.
+    """
+    snap = _SNAPSHOT
+    if not snap.ready:
+        with _INDEX_LOCK:
+            if not _SNAPSHOT.ready:
+                build_index(DB_PATH)
+            snap = _SNAPSHOT
+    return snap
+
+
+def index_ready() -> bool:
+    """
+    Indica si ya hay un índice publicado con el que responder sin esperar.
+    """
+    return _SNAPSHOT.ready
 
 
 def _search_similar(
-    question: str, k: int = 5
+    question: str, k: int = 5, question_embedding: np.ndarray | None = None
+) -> List[Tuple[Ticket, float]]:
+    return _rerank(*_search_candidates(question, k, question_embedding), k)
+
+
+def _search_candidates(
+    question: str, k: int, question_embedding: np.ndarray | None = None
+) -> Tuple[List[Tuple[Ticket, float]], List[float]]:
+    """
+    Candidatos de la búsqueda en su orden original, antes del reranking
+    por feedback (con algunos de más si el reranking está activo).
+
+    Devuelve también la puntuación de ranking de cada candidato, que es la
+    que ajusta el reranking: la similitud coseno en búsqueda por vectores y
+    la puntuación RRF normalizada en búsqueda híbrida.
+    """
+    snap = _current_index()
+    if not snap.embeddings.size:
+        # Índice publicado pero sin tickets: no hace falta embeber la pregunta.
+        return [], []
+
+    if question_embedding is None:
+        question_embedding = _embed_query(question)
+    if question_embedding is None:
+        return [], []
+    if question_embedding.shape[0] != snap.embeddings.shape[1]:
+        return [], []
+
+    # Si hay feedback acumulado, pedimos algunos candidatos más para que el
+    # reranking tenga margen para reordenar.
+    pool = k + RERANK_EXTRA_CANDIDATES if _RERANKER.active else k
+
+    fused: Dict[int, float] = {}
+    if RAG_RETRIEVAL == "hybrid":
+        hits, fused = _search_hybrid(snap, question, question_embedding, pool)
+    else:
+        hits = _search_vectors(snap, question_embedding, pool)
+    candidates = _materialize(snap, hits)
+    return candidates, [fused.get(t.id, score) for t, score in candidates]
+
+
+def _rerank(
+    candidates: List[Tuple[Ticket, float]], scores: List[float], k: int
 ) -> List[Tuple[Ticket, float]]:
-    _ensure_index()
+    if not _RERANKER.active:
+        return candidates
+    return _RERANKER.rerank(candidates, [t.id for t, _ in candidates], k, scores=scores)
 
-    question_embedding_list = _embed_texts([question])
-    if not question_embedding_list:
+
+def record_feedback(entry: Dict[str, Any]) -> None:
+    """
+    Incorpora una entrada de feedback (con `helpful`, `source_ids` y el
+    `cluster_id` de la respuesta) a los boosts del reranking. No hace I/O: el almacenamiento es cosa del servidor.
+    """
+    _RERANKER.observe(entry)
+
+
+# Resultado de la búsqueda antes de leer los textos de SQLite: (segmento
+# del snapshot, posición del ticket en él, filas/pasajes que han
+# coincidido, similitud).
+_Hit = Tuple[IndexSnapshot, int, List[int], float]
+
+
+def _position_of(snap: IndexSnapshot, ticket_id: int) -> int | None:
+    """Posición de un ticket en `snap.ticket_ids` (búsqueda binaria), o None."""
+    pos = int(np.searchsorted(snap.ticket_ids, ticket_id))
+    if pos < snap.ticket_ids.shape[0] and snap.ticket_ids[pos] == ticket_id:
+        return pos
+    return None
+
+
+def _locate(snap: IndexSnapshot, ticket_id: int) -> Tuple[IndexSnapshot, int] | None:
+    """
+    Segmento (el delta o el principal) y posición en él de la versión
+    vigente de un ticket, o None si no está indexado.
+    """
+    if snap.delta is not None:
+        pos = _position_of(snap.delta, ticket_id)
+        if pos is not None:
+            return snap.delta, pos
+    pos = _position_of(snap, ticket_id)
+    if pos is None or pos in snap.dead:
+        return None
+    return snap, pos
+
+
+def _ticket_excerpt(snap: IndexSnapshot, ticket: Ticket, pos: int, rows: List[int]) -> Ticket:
+    """
+    `ticket` con el cuerpo reducido a los pasajes de `rows`, fusionando los
+    que se solapan. Si el ticket tiene un único pasaje, o los pasajes
+    cubren todo el cuerpo, se devuelve tal cual.
+    """
+    if snap.row_start[pos + 1] - snap.row_start[pos] <= 1:
+        return ticket
+
+    merged: List[List[int]] = []
+    for start, end in sorted(snap.row_spans[rows].tolist()):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    words = ticket.body.split()
+    if merged == [[0, len(words)]]:
+        return ticket
+    return replace(ticket, body=" … ".join(" ".join(words[s:e]) for s, e in merged))
+
+
+def _materialize(snap: IndexSnapshot, hits: List[_Hit]) -> List[Tuple[Ticket, float]]:
+    """
+    Lee de SQLite, en una sola consulta, los tickets de `hits` y los reduce
+    a sus pasajes coincidentes. Los tickets borrados desde la última
+    indexación se descartan.
+    """
+    ids = [int(segment.ticket_ids[pos]) for segment, pos, _, _ in hits]
+    tickets = _fetch_tickets(ids, snap.db_path)  # type: ignore[arg-type]
+    results: List[Tuple[Ticket, float]] = []
+    for ticket_id, (segment, pos, rows, score) in zip(ids, hits):
+        ticket = tickets.get(ticket_id)
+        if ticket is not None:
+            results.append((_ticket_excerpt(segment, ticket, pos, rows), score))
+    return results
+
+
+def _search_vectors(snap: IndexSnapshot, question_embedding: np.ndarray, k: int) -> List[_Hit]:
+    """
+    Top-k de tickets por similitud de embeddings: se busca en el índice
+    principal y en el delta y se fusionan los resultados.
+
+    Con chunking el índice contiene pasajes: la puntuación de un ticket es
+    la de su mejor pasaje y solo se conservan los pasajes que aparecen entre
+    los resultados con una similitud cercana a la del mejor
+    (RAG_CHUNK_SCORE_MARGIN).
+    """
+    k = max(1, k)
+    hits = _search_segment(snap, question_embedding, k)
+    if snap.delta is not None:
+        hits += _search_segment(snap.delta, question_embedding, k)
+        hits = sorted(hits, key=lambda hit: -hit[3])[:k]
+    return hits
+
+
+def _search_segment(segment: IndexSnapshot, question_embedding: np.ndarray, k: int) -> List[_Hit]:
+    """
+    Top-k de un solo segmento, sin los tickets obsoletos (`segment.dead`).
+    Se piden al índice tantas filas de más como filas obsoletas haya.
+    """
+    n_rows = segment.embeddings.shape[0]
+    if not n_rows:
         return []
-    question_embedding = question_embedding_list[0]
+    dead = set(segment.dead.tolist())
+    extra = _dead_rows(segment)
+    if n_rows == segment.ticket_ids.shape[0]:
+        # Una fila por ticket: el índice devuelve directamente las
+        # posiciones y puntuaciones del top-k.
+        positions, scores = segment.index.search(question_embedding, min(k + extra, n_rows))
+        hits = [
+            (segment, int(i), [int(i)], float(score))
+            for i, score in zip(positions, scores)
+            if int(i) not in dead
+        ]
+        return hits[:k]
 
-    scored: List[Tuple[Ticket, float]] = []
-    for ticket, emb in zip(_TICKETS, _EMBEDDINGS):
-        score = _cosine_similarity(question_embedding, emb)
-        scored.append((ticket, score))
+    # Varios pasajes de un mismo ticket pueden copar los primeros puestos:
+    # se piden más filas hasta reunir k tickets distintos.
+    wanted = k * 4 + extra
+    while True:
+        positions, scores = segment.index.search(question_embedding, min(wanted, n_rows))
+        best: Dict[int, float] = {}
+        matched: Dict[int, List[int]] = {}
+        for row, score in zip(positions.tolist(), scores.tolist()):
+            pos = int(segment.row_tickets[row])
+            if pos in dead:
+                continue
+            best.setdefault(pos, score)
+            if score >= best[pos] - RAG_CHUNK_SCORE_MARGIN:
+                matched.setdefault(pos, []).append(row)
+        if len(best) >= k or wanted >= n_rows:
+            break
+        wanted *= 2
 
-    scored.sort(key=lambda x: x[1], reverse=True)
-    return scored[: max(1, k)]
+    # `best` conserva el orden de aparición, que ya es de mayor a menor.
+    return [(segment, pos, matched[pos], best[pos]) for pos in list(best)[:k]]
 
 
-def _build_context(
-    question: str, candidates: List[Tuple[Ticket, float]]
-) -> str:
-    lines: List[str] = []
-    lines.append(
-        "Eres un asistente de soporte técnico interno. "
-        "Debes responder usando exclusivamente la información de los tickets "
-        "de incidencias que se muestran a continuación."
+def _best_passage(segment: IndexSnapshot, pos: int, question_embedding: np.ndarray) -> _Hit:
+    """
+    Ticket `pos` de `segment` con su pasaje más parecido a la pregunta.
+    """
+    start, end = int(segment.row_start[pos]), int(segment.row_start[pos + 1])
+    scores = segment.embeddings[start:end] @ question_embedding
+    best = int(np.argmax(scores))
+    return segment, pos, [start + best], float(scores[best])
+
+
+def _search_hybrid(
+    snap: IndexSnapshot, question: str, question_embedding: np.ndarray, k: int
+) -> Tuple[List[_Hit], Dict[int, float]]:
+    """
+    Recuperación híbrida: combina el ranking por embeddings con el ranking
+    BM25 del índice FTS5 mediante Reciprocal Rank Fusion. Así, términos muy
+    concretos (`413`, `database is locked`, `rabbitmq`) que los embeddings
+    diluyen siguen pesando en el orden final.
+
+    La puntuación de cada hit sigue siendo la similitud coseno del ticket
+    (la de su mejor pasaje, con chunking); el orden lo da la puntuación RRF,
+    que se devuelve aparte por ticket, normalizada para que el primero valga
+    1, y es la que ajusta el reranking por feedback.
+    """
+    pool = max(k, RAG_HYBRID_CANDIDATES)
+    by_vector = {
+        int(hit[0].ticket_ids[hit[1]]): hit
+        for hit in _search_vectors(snap, question_embedding, pool)
+    }
+    lexical_ids = [
+        ticket_id
+        for ticket_id, _ in rag_fts.search_bm25(snap.db_path, question, limit=pool)  # type: ignore[arg-type]
+    ]
+
+    results: List[_Hit] = []
+    fused: Dict[int, float] = {}
+    for ticket_id, rrf in rag_fts.reciprocal_rank_fusion([list(by_vector), lexical_ids]):
+        if ticket_id in by_vector:
+            results.append(by_vector[ticket_id])
+        else:
+            found = _locate(snap, ticket_id)
+            if found is None:
+                # Ticket presente en la base de datos pero aún no indexado.
+                continue
+            results.append(_best_passage(*found, question_embedding))
+        fused[ticket_id] = rrf
+        if len(results) >= max(1, k):
+            break
+    top = max(fused.values(), default=1.0)
+    return results, {ticket_id: rrf / top for ticket_id, rrf in fused.items()}
+
+
+def benchmark_index(k: int = 5, n_queries: int = 100, seed: int = 0) -> Dict[str, Any]:
+    """
+    Mide el recall@k del índice configurado frente a la búsqueda exacta,
+    usando como consultas embeddings de tickets del propio corpus.
+    """
+    snap = _current_index()
+    rng = np.random.default_rng(seed)
+    n = snap.embeddings.shape[0]
+    queries = snap.embeddings[rng.choice(n, size=min(n_queries, n), replace=False)]
+    return {
+        "index_kind": snap.index.kind,
+        "tickets": n,
+        "k": k,
+        **rag_ann.recall_at_k(snap.index, queries, k),
+        "memory_bytes": index_memory()["total"],
+    }
+
+
+# El prompt se envía en tres bloques, de más estable a menos, para que
+# Anthropic pueda reutilizar el prefijo con prompt caching:
+#   1. instrucciones (idénticas en todas las llamadas);
+#   2. tickets, ordenados por id (idénticos entre preguntas de seguimiento
+#      que recuperan los mismos tickets);
+#   3. la pregunta, siempre al final y fuera de la caché.
+_CONTEXT_INSTRUCTIONS = (
+    "Eres un asistente de soporte técnico interno. "
+    "Debes responder usando exclusivamente la información de los tickets "
+    "de incidencias que se muestran a continuación.\n"
+    "\nInstrucciones:\n"
+    "- Usa solo los datos de estos tickets para contestar.\n"
+    "- Si la información no es suficiente, indica claramente que no puedes "
+    "responder con seguridad.\n"
+    "- Si procede, propone pasos concretos de diagnóstico o solución.\n"
+)
+_TICKETS_HEADER = "TICKETS RELEVANTES:"
+
+
+@dataclass
+class ContextPack:
+    # Bloque de tickets (cacheable) y bloque final con la pregunta.
+    tickets: str
+    question: str
+    # Estimación local de tokens del contexto completo.
+    tokens: int
+    # Tickets que han entrado en el contexto, por orden de relevancia (los de
+    # menor puntuación se descartan si no caben en el presupuesto).
+    candidates: List[Tuple[Ticket, float]]
+
+    @property
+    def text(self) -> str:
+        """Contexto completo tal y como lo lee el modelo."""
+        return "\n".join([_CONTEXT_INSTRUCTIONS, self.tickets, self.question])
+
+
+def _ticket_block(ticket: Ticket, body: str) -> str:
+    # Sin la puntuación de la búsqueda: cambia con cada pregunta y rompería
+    # la caché de prompts aunque los tickets sean los mismos.
+    return (
+        f"\n---\nID: {ticket.id}\nTítulo: {ticket.title}\nTags: {ticket.tags}\n"
+        f"Cuerpo:\n{body}\n"
     )
-    lines.append("")
-    lines.append("TICKETS RELEVANTES:")
-    for ticket, score in candidates:
-        lines.append(
-            f"\n---\nID: {ticket.id}\nTítulo: {ticket.title}\nTags: {ticket.tags}\n"
-            f"Relevancia aproximada: {score:.3f}\n"
-            f"Cuerpo:\n{ticket.body}\n"
-        )
 
-    lines.append(
-        "\nInstrucciones:\n"
-        "- Usa solo los datos de estos tickets para contestar.\n"
-        "- Si la información no es suficiente, indica claramente que no puedes "
-        "responder con seguridad.\n"
-        "- Si procede, propone pasos concretos de diagnóstico o solución.\n"
+
+def _relevant_passages(body: str, question: str, max_tokens: int) -> str:
+    """
+    Recorta el cuerpo de un ticket a `max_tokens` quedándose con las frases
+    que comparten más términos con la pregunta (en su orden original).
+    """
+    if rag_embeddings.estimate_tokens(body) <= max_tokens:
+        return body
+
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+|\n+", body) if s.strip()]
+    terms = set(rag_fts.query_terms(question))
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(terms & set(rag_fts.query_terms(sentences[i]))), i),
     )
 
-    lines.append(f"\nPregunta del usuario:\n{question}")
-    return "\n".join(lines)
+    chosen: List[int] = []
+    used = 0
+    for i in ranked:
+        cost = rag_embeddings.estimate_tokens(sentences[i])
+        if used + cost > max_tokens:
+            continue
+        chosen.append(i)
+        used += cost
 
+    if not chosen:
+        # Ni siquiera cabe una frase: cortamos la más relevante a mano.
+        return sentences[ranked[0]][: max(0, max_tokens * 4 - 1)] + "…"
+    return " … ".join(sentences[i] for i in sorted(chosen))
 
-def answer(question: str, k: int = 5) -> Dict[str, Any]:
+
+def _build_context(
+    question: str,
+    candidates: List[Tuple[Ticket, float]],
+    token_budget: int | None = None,
+) -> ContextPack:
     """
-    Implementa el pipeline RAG local:
+    Construye el prompt con los tickets recuperados respetando un
+    presupuesto de tokens (CONTEXT_TOKEN_BUDGET por defecto).
 
-    - Embedding de la pregunta.
-    - Búsqueda semántica sobre los tickets.
-    - Construcción de contexto.
-    - Llamada al modelo de chat (Anthropic).
+    Los tickets se añaden en orden de relevancia; cada uno puede usar como
+    mucho su parte proporcional del presupuesto restante, así que los
+    cuerpos largos se reducen a sus frases más relevantes. Cuando ya no
+    queda sitio, los tickets restantes (los de menor puntuación) se descartan.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    footer = f"Pregunta del usuario:\n{question}"
+    remaining = budget - rag_embeddings.estimate_tokens(
+        "\n".join([_CONTEXT_INSTRUCTIONS, _TICKETS_HEADER, footer])
+    )
 
-    Devuelve un dict con:
-    - 'answer': respuesta generada por el modelo.
-    - 'sources': lista de tickets usados como contexto.
+    blocks: Dict[int, str] = {}
+    included: List[Tuple[Ticket, float]] = []
+    for pos, (ticket, score) in enumerate(candidates):
+        overhead = rag_embeddings.estimate_tokens(_ticket_block(ticket, ""))
+        share = remaining // (len(candidates) - pos) if remaining > 0 else 0
+        body_budget = max(share, remaining if pos == len(candidates) - 1 else 0) - overhead
+        if body_budget < CONTEXT_MIN_TICKET_TOKENS:
+            if included:
+                break
+            # Siempre entra al menos el ticket más relevante, aunque recortado.
+            body_budget = CONTEXT_MIN_TICKET_TOKENS
+
+        block = _ticket_block(ticket, _relevant_passages(ticket.body, question, body_budget))
+        blocks[ticket.id] = block
+        included.append((ticket, score))
+        remaining -= rag_embeddings.estimate_tokens(block)
+
+    tickets = "\n".join([_TICKETS_HEADER, *(blocks[i] for i in sorted(blocks))])
+    pack = ContextPack(tickets=tickets, question=footer, tokens=0, candidates=included)
+    pack.tokens = rag_embeddings.estimate_tokens(pack.text)
+    return pack
+
+
+SYSTEM_PROMPT = (
+    "Eres un asistente de soporte técnico que responde solo con la "
+    "información proporcionada en los tickets de incidencias."
+)
+NO_TICKETS_ANSWER = "No he encontrado tickets relevantes para tu pregunta."
+EMPTY_ANSWER = "No he podido generar una respuesta clara a partir de los tickets."
+
+
+def _retrieve(
+    question: str, k: int
+) -> Tuple[np.ndarray | None, List[Tuple[Ticket, float]], int | None]:
+    """
+    Valida la pregunta, calcula su embedding y recupera los k tickets
+    más relevantes. Es la parte común de answer() y answer_stream().
+
+    Devuelve también el cluster de la pregunta para el reranking (el top-1
+    antes de reordenar), que el cliente devuelve junto con su feedback.
     """
-    question = question.strip()
     if not question:
         raise ValueError("La pregunta no puede estar vacía.")
 
-    candidates = _search_similar(question, k=k)
-    if not candidates:
-        return {
-            "answer": "No he encontrado tickets relevantes para tu pregunta.",
-            "sources": [],
-        }
+    question_embedding = _embed_query(question)
+    if question_embedding is None:
+        return None, [], None
+    candidates, scores = _search_candidates(question, k, question_embedding=question_embedding)
+    cluster_id = rag_rerank.cluster_key([t.id for t, _ in candidates])
+    return question_embedding, _rerank(candidates, scores, k), cluster_id
 
-    context = _build_context(question, candidates)
 
-    response = anthropic_client.messages.create(
-        model=MODEL,
-        max_tokens=600,
-        system=(
-            "Eres un asistente de soporte técnico que responde solo con la "
-            "información proporcionada en los tickets de incidencias."
-        ),
-        messages=[
+def _chat_request(context: ContextPack) -> Dict[str, Any]:
+    """
+    Petición a Anthropic con prompt caching: el system prompt y las
+    instrucciones llevan un punto de caché, el bloque de tickets otro, y la
+    pregunta va la última, sin caché. Si el prefijo no llega al mínimo de
+    tokens cacheables del modelo, Anthropic simplemente no lo cachea.
+    """
+    return {
+        "model": _chat_model(),
+        "max_tokens": 600,
+        "system": [{"type": "text", "text": SYSTEM_PROMPT}],
+        "messages": [
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "text",
-                        "text": context,
-                    }
+                        "text": _CONTEXT_INSTRUCTIONS,
+                        "cache_control": rag_prompt.CACHE_CONTROL,
+                    },
+                    {
+                        "type": "text",
+                        "text": context.tickets,
+                        "cache_control": rag_prompt.CACHE_CONTROL,
+                    },
+                    {
+                        "type": "text",
+                        "text": context.question,
+                    },
                 ],
             }
         ],
-    )
+    }
 
-    text_parts = [
-        block.text for block in response.content if block.type == "text"
-    ]
-    final_answer = "\n\n".join(text_parts).strip() or (
-        "No he podido generar una respuesta clara a partir de los tickets."
-    )
 
-    sources = [
+def _sources(candidates: List[Tuple[Ticket, float]]) -> List[Dict[str, Any]]:
+    return [
         {
             **ticket.as_source(),
             "score": score,
@@ -248,10 +1635,128 @@ def answer(question: str, k: int = 5) -> Dict[str, Any]:
         for ticket, score in candidates
     ]
 
-    return {
+
+def answer(question: str, k: int = 5) -> Dict[str, Any]:
+    """
+    Implementa el pipeline RAG local:
+
+    - Embedding de la pregunta.
+    - Búsqueda semántica sobre los tickets.
+    - Caché semántica: si una pregunta casi idéntica ya se respondió con
+      los mismos tickets, se reutiliza esa respuesta.
+    - Construcción de contexto.
+    - Llamada al modelo de chat (Anthropic).
+
+    Devuelve un dict con:
+    - 'answer': respuesta generada por el modelo.
+    - 'sources': lista de tickets usados como contexto.
+    - 'context_tokens': tokens estimados del contexto enviado al modelo.
+    - 'usage': tokens de la llamada al modelo, incluidos
+      `cache_creation_input_tokens` y `cache_read_input_tokens` (todo 0 si
+      no hubo llamada).
+    - 'cached': True si la respuesta sale de la caché semántica.
+    - 'cluster_id': cluster de la pregunta para el reranking; se pasa a
+      save_feedback junto con los ids de `sources`.
+    """
+    question = question.strip()
+    question_embedding, candidates, cluster_id = _retrieve(question, k)
+    if question_embedding is None or not candidates:
+        return {
+            "answer": NO_TICKETS_ANSWER,
+            "sources": [],
+            "usage": rag_prompt.token_usage(None),
+            "cached": False,
+            "cluster_id": cluster_id,
+        }
+
+    versions = _ticket_versions(candidates)
+    cached = _lookup_answer(question_embedding, versions)
+    if cached is not None:
+        return {
+            **cached,
+            "usage": rag_prompt.token_usage(None),
+            "cached": True,
+            "cluster_id": cluster_id,
+        }
+
+    context = _build_context(question, candidates)
+
+    response = _anthropic().messages.create(**_chat_request(context))
+
+    text_parts = [
+        block.text for block in response.content if block.type == "text"
+    ]
+    final_answer = "\n\n".join(text_parts).strip() or EMPTY_ANSWER
+
+    result = {
         "answer": final_answer,
-        "sources": sources,
+        "sources": _sources(context.candidates),
+        "context_tokens": context.tokens,
     }
+    _store_answer(question_embedding, versions, result)
+    return {
+        **result,
+        "usage": rag_prompt.token_usage(getattr(response, "usage", None)),
+        "cached": False,
+        "cluster_id": cluster_id,
+    }
+
+
+def answer_stream(question: str, k: int = 5) -> Iterator[Dict[str, Any]]:
+    """
+    Variante en streaming de answer(): en lugar de esperar a la respuesta
+    completa, va emitiendo eventos según están disponibles:
+
+    - {"type": "sources", "sources": [...]}: en cuanto termina la búsqueda.
+    - {"type": "token", "text": "..."}: fragmentos de la respuesta del modelo.
+    - {"type": "done", "answer": ..., "sources": ..., "cached": ...}: el
+      mismo dict que devolvería answer().
+    """
+    question = question.strip()
+    question_embedding, candidates, cluster_id = _retrieve(question, k)
+    if question_embedding is None or not candidates:
+        yield {"type": "sources", "sources": []}
+        yield {"type": "token", "text": NO_TICKETS_ANSWER}
+        yield {
+            "type": "done",
+            "answer": NO_TICKETS_ANSWER,
+            "sources": [],
+            "usage": rag_prompt.token_usage(None),
+            "cached": False,
+            "cluster_id": cluster_id,
+        }
+        return
+
+    versions = _ticket_versions(candidates)
+    cached = _lookup_answer(question_embedding, versions)
+    if cached is not None:
+        yield {"type": "sources", "sources": cached["sources"]}
+        yield {"type": "token", "text": cached["answer"]}
+        yield {
+            "type": "done",
+            **cached,
+            "usage": rag_prompt.token_usage(None),
+            "cached": True,
+            "cluster_id": cluster_id,
+        }
+        return
+
+    context = _build_context(question, candidates)
+    sources = _sources(context.candidates)
+    yield {"type": "sources", "sources": sources}
+
+    parts: List[str] = []
+    with _anthropic().messages.stream(**_chat_request(context)) as stream:
+        for text in stream.text_stream:
+            if text:
+                parts.append(text)
+                yield {"type": "token", "text": text}
+        usage = rag_prompt.token_usage(stream.get_final_message().usage)
+
+    final_answer = "".join(parts).strip() or EMPTY_ANSWER
+    result = {"answer": final_answer, "sources": sources, "context_tokens": context.tokens}
+    _store_answer(question_embedding, versions, result)
+    yield {"type": "done", **result, "usage": usage, "cached": False, "cluster_id": cluster_id}
 
 
 def main() -> None:
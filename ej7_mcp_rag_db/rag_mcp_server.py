@@ -1,37 +1,213 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List
 from pathlib import Path
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
 import json
+import os
+import threading
 from datetime import datetime, UTC
 
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 
+import rag_db
+import rag_feedback
 import rag_local
+import rag_refresh
 
 
 BASE_DIR = Path(__file__).parent
-FEEDBACK_PATH = BASE_DIR / "feedback.json"
+FEEDBACK_PATH = BASE_DIR / "feedback.jsonl"
+# Formato antiguo (lista JSON reescrita entera); se migra al log JSONL.
+LEGACY_FEEDBACK_PATH = BASE_DIR / "feedback.json"
+
+# Rotación del log de feedback: tamaño máximo por fichero y nº de ficheros rotados.
+FEEDBACK_MAX_BYTES = int(
+    os.getenv("FEEDBACK_MAX_BYTES", str(rag_feedback.DEFAULT_MAX_BYTES))
+)
+FEEDBACK_BACKUPS = int(os.getenv("FEEDBACK_BACKUPS", str(rag_feedback.DEFAULT_BACKUPS)))
+_FEEDBACK_STORES: Dict[Path, rag_feedback.FeedbackStore] = {}
+# Evita que dos hilos del pool carguen a la vez el feedback histórico (se
+# contaría dos veces en el reranker).
+_FEEDBACK_STORES_LOCK = threading.Lock()
+
+# Nº máximo de llamadas bloqueantes (embeddings, Anthropic, SQLite) que se
+# ejecutan a la vez fuera del event loop.
+RAG_MAX_WORKERS = int(os.getenv("RAG_MAX_WORKERS", "8"))
+
+# Los clientes de OpenAI/Anthropic que usa rag_local son síncronos: si los
+# llamáramos directamente desde un tool async, bloquearían el event loop y
+# todas las peticiones concurrentes quedarían serializadas. Por eso el trabajo
+# bloqueante se delega a este pool acotado.
+_EXECUTOR = ThreadPoolExecutor(max_workers=RAG_MAX_WORKERS, thread_name_prefix="rag")
+
+# Reindexación en segundo plano: cada RAG_REFRESH_INTERVAL segundos (0 = solo
+# cuando cambia incidents.db) y comprobando cambios cada RAG_REFRESH_POLL.
+RAG_REFRESH_INTERVAL = float(
+    os.getenv("RAG_REFRESH_INTERVAL", str(rag_refresh.DEFAULT_INTERVAL))
+)
+RAG_REFRESH_POLL = float(os.getenv("RAG_REFRESH_POLL", str(rag_refresh.DEFAULT_POLL)))
+_REFRESHER = rag_refresh.IndexRefresher(
+    lambda: rag_local.sync_changes(rag_local.DB_PATH),
+    rag_local.DB_PATH,
+    interval=RAG_REFRESH_INTERVAL,
+    poll=RAG_REFRESH_POLL,
+)
+
+INDEX_BUILDING_ANSWER = (
+    "El índice de tickets se está construyendo en segundo plano. "
+    "Vuelve a intentarlo en unos segundos."
+)
+INDEX_ERROR_ANSWER = "No se ha podido construir el índice de tickets: {error}"
 
 
 mcp = FastMCP("incidents-rag")
 
 
+async def _run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Ejecuta `func` en el pool de hilos sin bloquear el event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+async def _iterate_blocking(
+    factory: Callable[[], Iterator[Dict[str, Any]]]
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Consume un generador síncrono en el pool de hilos y va entregando sus
+    elementos al event loop en cuanto se producen.
+
+    Si el consumidor deja de iterar (se cierra este generador, p. ej. porque
+    el cliente se ha desconectado), el productor se detiene en el siguiente
+    elemento y cierra el generador síncrono en lugar de agotarlo.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[Any] = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def produce() -> None:
+        items = None
+        try:
+            items = factory()
+            for item in items:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except BaseException as exc:  # se re-lanza en el event loop
+            loop.call_soon_threadsafe(queue.put_nowait, exc)
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()  # p. ej. cierra el stream de Anthropic
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(_EXECUTOR, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        await producer
+
+
 @mcp.tool()
-async def index_tickets() -> Dict[str, Any]:
+async def index_tickets(full_rebuild: bool = False) -> Dict[str, Any]:
+    """
+    Sincroniza el índice de embeddings con la base de datos.
+
+    Por defecto es incremental: solo se embeben los tickets nuevos o
+    modificados y se descartan los borrados. Con full_rebuild=True se
+    recalculan todos los embeddings desde cero.
+
+    Devuelve el total indexado y los contadores added/updated/removed/unchanged.
+    """
+    return await _run_blocking(rag_local.refresh_index, force=full_rebuild)
+
+
+def _index_building() -> Dict[str, Any] | None:
     """
-    Reconstruye el índice de embeddings desde la base de datos.
+    Si todavía no hay ningún índice publicado, pide al refresher que lo
+    construya y devuelve una respuesta inmediata en lugar de esperar. Si el
+    último intento falló, la respuesta incluye el error (`error`) en lugar
+    de decir que el índice se está construyendo.
     """
-    count = rag_local.build_index()
-    return {"indexed_tickets": count}
+    if rag_local.index_ready():
+        return None
+    _REFRESHER.start()
+    _REFRESHER.trigger()  # reintenta, por si el fallo era pasajero
+    error = _REFRESHER.last_error
+    if error is not None:
+        return {
+            "answer": INDEX_ERROR_ANSWER.format(error=error),
+            "sources": [],
+            "indexing": False,
+            "error": str(error),
+        }
+    return {"answer": INDEX_BUILDING_ANSWER, "sources": [], "indexing": True}
 
 
 @mcp.tool()
 async def rag_answer(question: str, k: int = 5) -> Dict[str, Any]:
     """
     Ejecuta el pipeline RAG y devuelve la respuesta junto con las fuentes.
+
+    Nunca espera a una reindexación: usa el último índice publicado y, si
+    aún no hay ninguno, responde que se está construyendo.
+    """
+    building = _index_building()
+    if building is not None:
+        return building
+
+    def run() -> Dict[str, Any]:
+        _feedback_store()  # carga el feedback histórico en el reranker (solo la 1ª vez)
+        return rag_local.answer(question=question, k=k)
+
+    return await _run_blocking(run)
+
+
+@mcp.tool()
+async def rag_answer_stream(question: str, ctx: Context, k: int = 5) -> Dict[str, Any]:
+    """
+    Igual que rag_answer, pero va enviando el progreso al cliente MCP:
+    primero las fuentes recuperadas y después la respuesta según se genera,
+    mediante notificaciones de progreso.
+
+    Al terminar devuelve el mismo dict que rag_answer (answer + sources).
     """
-    return rag_local.answer(question=question, k=k)
+    building = _index_building()
+    if building is not None:
+        return building
+
+    def events() -> Iterator[Dict[str, Any]]:
+        _feedback_store()  # carga el feedback histórico en el reranker (solo la 1ª vez)
+        return rag_local.answer_stream(question=question, k=k)
+
+    result: Dict[str, Any] = {}
+    chunks = 0
+    async with contextlib.aclosing(_iterate_blocking(events)) as stream:
+        async for event in stream:
+            if event["type"] == "sources":
+                await ctx.report_progress(
+                    progress=0,
+                    message=json.dumps({"sources": event["sources"]}, ensure_ascii=False),
+                )
+            elif event["type"] == "token":
+                chunks += 1
+                await ctx.report_progress(progress=chunks, message=event["text"])
+            elif event["type"] == "done":
+                result = {key: value for key, value in event.items() if key != "type"}
+    return result
 
 
 @mcp.resource("tickets/latest/{limit}")
@@ -41,15 +217,10 @@ def resource_latest_tickets(limit: int = 5) -> List[Dict[str, Any]]:
 
     A diferencia de rag_answer (tool), este recurso no ejecuta el pipeline RAG
     ni llama al modelo, solo expone datos de la base de conocimiento.
+    Se resuelve con una consulta SQL indexada (ORDER BY id DESC LIMIT ?):
+    nunca reconstruye el índice ni calcula embeddings.
     """
-    # Nos apoyamos en build_index() para asegurarnos de que hay tickets cargados.
-    rag_local.build_index()
-
-    # Accedemos a los tickets a través de la función privada de carga.
-    # No recalculamos embeddings aquí: solo necesitamos los datos brutos.
-    tickets = rag_local._load_tickets(rag_local.DB_PATH)  # type: ignore[attr-defined]
-    limited = tickets[-max(1, limit) :]
-    return [t.as_source() for t in limited]
+    return [t.as_source() for t in rag_local.latest_tickets(limit)]
 
 
 @mcp.resource("tickets/{ticket_id}")
@@ -59,38 +230,76 @@ def resource_ticket_by_id(ticket_id: int) -> Dict[str, Any] | None:
 
     Devuelve el ticket como dict o None si no existe.
     """
-    tickets = rag_local._load_tickets(rag_local.DB_PATH)  # type: ignore[attr-defined]
-    for t in tickets:
-        if t.id == ticket_id:
-            return t.as_source()
-    return None
+    ticket = rag_local.get_ticket(ticket_id)
+    return ticket.as_source() if ticket else None
+
+
+def _feedback_store() -> rag_feedback.FeedbackStore:
+    """
+    Devuelve el almacén de feedback asociado a FEEDBACK_PATH (uno por ruta,
+    para que todas las llamadas compartan el mismo lock y contador).
+
+    La primera vez migra el antiguo feedback.json si existe y carga todo el
+    feedback histórico en el reranker de rag_local; a partir de ahí el
+    reranker se actualiza entrada a entrada. Esa primera carga lee el log
+    entero, así que hay que llamarla desde el pool de hilos, nunca desde el
+    event loop.
+    """
+    store = _FEEDBACK_STORES.get(FEEDBACK_PATH)
+    if store is not None:
+        return store
+    with _FEEDBACK_STORES_LOCK:
+        store = _FEEDBACK_STORES.get(FEEDBACK_PATH)
+        if store is None:
+            store = rag_feedback.FeedbackStore(
+                FEEDBACK_PATH,
+                max_bytes=FEEDBACK_MAX_BYTES,
+                backups=FEEDBACK_BACKUPS,
+            )
+            store.import_legacy_json(LEGACY_FEEDBACK_PATH)
+            for entry in store:
+                rag_local.record_feedback(entry)
+            _FEEDBACK_STORES[FEEDBACK_PATH] = store
+    return store
 
 
 @mcp.tool()
-async def save_feedback(question: str, answer: str, helpful: bool) -> Dict[str, Any]:
+async def save_feedback(
+    question: str,
+    answer: str,
+    helpful: bool,
+    source_ids: List[int] | None = None,
+    cluster_id: int | None = None,
+) -> Dict[str, Any]:
     """
     Guarda feedback de un usuario sobre una respuesta RAG.
 
-    Esto ilustra c_mem: memoria persistente sencilla almacenada en disco.
+    Esto ilustra c_mem: memoria persistente sencilla almacenada en disco,
+    como un log JSONL en el que cada feedback es una línea añadida al final.
+
+    Si se pasan `source_ids` (los ids de `sources` que devolvió rag_answer),
+    el feedback alimenta además el reranking: los tickets que acaban en
+    respuestas poco útiles bajan en el ranking de futuras preguntas. Con el
+    `cluster_id` de esa misma respuesta, el ajuste también se aplica a las
+    preguntas del mismo tema.
     """
-    entry = {
+    entry: Dict[str, Any] = {
         "timestamp": datetime.now(UTC).isoformat(),
         "question": question,
         "answer": answer,
         "helpful": bool(helpful),
     }
+    if source_ids:
+        entry["source_ids"] = [int(i) for i in source_ids]
+    if cluster_id is not None:
+        entry["cluster_id"] = int(cluster_id)
 
-    data: List[Dict[str, Any]] = []
-    if FEEDBACK_PATH.exists():
-        try:
-            data = json.loads(FEEDBACK_PATH.read_text(encoding="utf-8"))
-        except Exception:
-            data = []
-
-    data.append(entry)
-    FEEDBACK_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    def save() -> int:
+        total = _feedback_store().append(entry)
+        rag_local.record_feedback(entry)
+        return total
 
-    return {"saved": True, "total_feedback": len(data)}
+    return {"saved": True, "total_feedback": await _run_blocking(save)}
 
 
 @mcp.tool()
@@ -98,38 +307,30 @@ async def list_feedback(limit: int = 10) -> List[Dict[str, Any]]:
     """
     Devuelve las últimas entradas de feedback guardadas.
     """
-    if not FEEDBACK_PATH.exists():
-        return []
-
-    try:
-        data = json.loads(FEEDBACK_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return []
-
-    return list(data[-max(1, limit) :])
+    return await _run_blocking(lambda: _feedback_store().tail(limit))
 
 
 @mcp.resource("feedback/latest/{limit}")
-def resource_latest_feedback(limit: int = 5) -> List[Dict[str, Any]]:
+async def resource_latest_feedback(limit: int = 5) -> List[Dict[str, Any]]:
     """
     Resource MCP para leer feedback reciente sin modificar el estado.
     """
-    if not FEEDBACK_PATH.exists():
-        return []
-
-    try:
-        data = json.loads(FEEDBACK_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return []
-
-    return list(data[-max(1, limit) :])
+    return await _run_blocking(lambda: _feedback_store().tail(limit))
 
 
 def main() -> None:
     """
-    Lanza el servidor MCP por STDIO.
+    Lanza el servidor MCP por STDIO, con el refresher del índice en
+    segundo plano.
     """
-    mcp.run(transport="stdio")
+    _REFRESHER.start()
+    # Carga el feedback histórico en el reranker antes de la primera pregunta.
+    _EXECUTOR.submit(_feedback_store)
+    try:
+        mcp.run(transport="stdio")
+    finally:
+        _REFRESHER.stop()
+        rag_db.close_all()
 
 
 if __name__ == "__main__":
@@ -1,35 +1,113 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import math
 import os
-from typing import Any, Dict, List, Tuple
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 
-from anthropic import Anthropic
 from dotenv import load_dotenv
-from openai import OpenAI
 
+if TYPE_CHECKING:
+    from anthropic import Anthropic
+    from openai import OpenAI
 
-load_dotenv()
+try:
+    from . import rag_embeddings, rag_prompt
+except ImportError:
+    # Ejecutado directamente como script.
+    sys.path.append(str(Path(__file__).resolve().parent))
+    import rag_embeddings
+    import rag_prompt
 
-MODEL = os.getenv("MODEL")
-if not MODEL:
-    raise RuntimeError(
-        "La variable de entorno MODEL no está definida. "
-        "Crea un archivo .env con una línea como: MODEL=claude-haiku-4-5-20251001"
-    )
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-if not ANTHROPIC_API_KEY:
-    raise RuntimeError("Falta ANTHROPIC_API_KEY en el entorno / .env")
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("Falta OPENAI_API_KEY en el entorno / .env para embeddings")
+load_dotenv()
 
-EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+MODEL = os.getenv("MODEL")
 
-anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# "openai" (API remota) o "local" (hashing en CPU, sin red).
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+LOCAL_EMBEDDING_DIM = int(
+    os.getenv("LOCAL_EMBEDDING_DIM", str(rag_embeddings.DEFAULT_LOCAL_DIM))
+)
+EMBEDDING_MODEL = (
+    rag_embeddings.local_model_name(LOCAL_EMBEDDING_DIM)
+    if EMBEDDING_PROVIDER == "local"
+    else os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+)
+
+# Fichero JSON opcional donde guardar los embeddings del corpus entre
+# ejecuciones (vacío = solo en memoria).
+RAG_MINIMAL_CACHE_PATH = os.getenv("RAG_MINIMAL_CACHE_PATH", "")
+
+# Clientes y proveedor de embeddings: se crean la primera vez que se usan,
+# así que importar el módulo no exige claves (los tests sustituyen estos
+# globales).
+anthropic_client: Anthropic | None = None
+openai_client: OpenAI | None = None
+embedder: Any = None
+_CLIENTS_LOCK = threading.RLock()
+
+
+def _require_env(name: str, message: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(message)
+    return value
+
+
+def _chat_model() -> str:
+    if not MODEL:
+        raise RuntimeError(
+            "La variable de entorno MODEL no está definida. "
+            "Crea un archivo .env con una línea como: MODEL=claude-haiku-4-5-20251001"
+        )
+    return MODEL
+
+
+def _anthropic() -> Anthropic:
+    """Cliente de Anthropic, creado (e importado el SDK) en el primer uso."""
+    global anthropic_client
+    with _CLIENTS_LOCK:
+        if anthropic_client is None:
+            api_key = _require_env(
+                "ANTHROPIC_API_KEY", "Falta ANTHROPIC_API_KEY en el entorno / .env"
+            )
+            from anthropic import Anthropic
+
+            anthropic_client = Anthropic(api_key=api_key)
+        return anthropic_client
+
+
+def _openai() -> OpenAI:
+    """Cliente de OpenAI, creado (e importado el SDK) en el primer uso."""
+    global openai_client
+    with _CLIENTS_LOCK:
+        if openai_client is None:
+            api_key = _require_env(
+                "OPENAI_API_KEY", "Falta OPENAI_API_KEY en el entorno / .env para embeddings"
+            )
+            from openai import OpenAI
+
+            openai_client = OpenAI(api_key=api_key)
+        return openai_client
+
+
+def _embedder() -> Any:
+    """Proveedor de embeddings configurado (EMBEDDING_PROVIDER), creado en el primer uso."""
+    global embedder
+    with _CLIENTS_LOCK:
+        if embedder is None:
+            embedder = rag_embeddings.make_embedder(
+                EMBEDDING_PROVIDER,
+                client=_openai() if EMBEDDING_PROVIDER == "openai" else None,
+                model=EMBEDDING_MODEL,
+                dim=LOCAL_EMBEDDING_DIM,
+            )
+        return embedder
 
 
 TICKETS: List[Dict[str, Any]] = [
@@ -80,12 +158,64 @@ def _prepare_text(ticket: Dict[str, Any]) -> str:
 def _embed_texts(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
+    return _embedder().embed(texts)
+
+
+# Embeddings del corpus ya calculados, junto con la huella de los textos de
+# los que salieron. Mientras TICKETS no cambie, cada pregunta solo necesita
+# embeber la propia pregunta.
+_CORPUS_CACHE: Dict[str, Any] = {"key": None, "embeddings": []}
 
-    response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=texts,
-    )
-    return [item.embedding for item in response.data]
+
+def _corpus_key(texts: List[str]) -> str:
+    """Huella del corpus: cambia si cambia cualquier ticket o el modelo."""
+    payload = json.dumps([EMBEDDING_MODEL, texts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_corpus_cache(key: str) -> List[List[float]] | None:
+    if not RAG_MINIMAL_CACHE_PATH:
+        return None
+    try:
+        data = json.loads(Path(RAG_MINIMAL_CACHE_PATH).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("key") != key:
+        return None
+    return data.get("embeddings")
+
+
+def _save_corpus_cache(key: str, embeddings: List[List[float]]) -> None:
+    if not RAG_MINIMAL_CACHE_PATH:
+        return
+    path = Path(RAG_MINIMAL_CACHE_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Se escribe en un fichero temporal y se renombra para no dejar nunca
+    # un JSON a medias si el proceso se interrumpe.
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"key": key, "embeddings": embeddings}), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _corpus_embeddings() -> List[List[float]]:
+    """
+    Embeddings de TICKETS, calculados una sola vez y memorizados por la
+    huella de su contenido. Si se define RAG_MINIMAL_CACHE_PATH también se
+    guardan en disco, así que ni siquiera hace falta recalcularlos al
+    reiniciar el proceso. Si la lista cambia, se vuelven a calcular.
+    """
+    texts = [_prepare_text(t) for t in TICKETS]
+    key = _corpus_key(texts)
+    if _CORPUS_CACHE["key"] == key:
+        return _CORPUS_CACHE["embeddings"]
+
+    embeddings = _load_corpus_cache(key)
+    if embeddings is None or len(embeddings) != len(texts):
+        embeddings = _embed_texts(texts)
+        _save_corpus_cache(key, embeddings)
+
+    _CORPUS_CACHE.update(key=key, embeddings=embeddings)
+    return embeddings
 
 
 def _cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -102,8 +232,7 @@ def _cosine_similarity(a: List[float], b: List[float]) -> float:
 def _search_similar(
     question: str, k: int = 5
 ) -> List[Tuple[Dict[str, Any], float]]:
-    ticket_texts = [_prepare_text(t) for t in TICKETS]
-    ticket_embs = _embed_texts(ticket_texts)
+    ticket_embs = _corpus_embeddings()
     question_emb_list = _embed_texts([question])
 
     if not question_emb_list or not ticket_embs:
@@ -119,32 +248,60 @@ def _search_similar(
     return scored[: max(1, k)]
 
 
-def _build_context(
-    question: str, candidates: List[Tuple[Dict[str, Any], float]]
-) -> str:
-    lines: List[str] = []
-    lines.append(
-        "Eres un asistente de soporte técnico. "
-        "Responde usando únicamente la información de los tickets."
-    )
-    lines.append("")
-    lines.append("TICKETS RELEVANTES:")
+SYSTEM_PROMPT = (
+    "Eres un asistente de soporte técnico que responde solo con la "
+    "información de los tickets proporcionados."
+)
+INSTRUCTIONS = (
+    "Eres un asistente de soporte técnico. "
+    "Responde usando únicamente la información de los tickets.\n"
+    "\nInstrucciones:\n"
+    "- No inventes datos fuera de lo que dicen los tickets.\n"
+    "- Si no hay información suficiente, dilo explícitamente.\n"
+)
 
-    for ticket, score in candidates:
+
+def _tickets_block(candidates: List[Tuple[Dict[str, Any], float]]) -> str:
+    """
+    Bloque de tickets ordenado por id y sin puntuaciones, para que dos
+    preguntas que recuperan los mismos tickets envíen exactamente el mismo
+    texto y Anthropic pueda reutilizarlo desde su caché de prompts.
+    """
+    lines: List[str] = ["TICKETS RELEVANTES:"]
+    for ticket, _ in sorted(candidates, key=lambda x: x[0]["id"]):
         lines.append(
             f"\n---\nID: {ticket['id']}\nTítulo: {ticket['title']}\nTags: {ticket.get('tags', '')}\n"
-            f"Relevancia aproximada: {score:.3f}\n"
             f"Cuerpo:\n{ticket['body']}\n"
         )
+    return "\n".join(lines)
 
-    lines.append(
-        "\nInstrucciones:\n"
-        "- No inventes datos fuera de lo que dicen los tickets.\n"
-        "- Si no hay información suficiente, dilo explícitamente.\n"
-    )
 
-    lines.append(f"\nPregunta del usuario:\n{question}")
-    return "\n".join(lines)
+def _build_messages(
+    question: str, candidates: List[Tuple[Dict[str, Any], float]]
+) -> List[Dict[str, Any]]:
+    """
+    Mensaje para el modelo, de la parte más estable a la menos: las
+    instrucciones y los tickets llevan un punto de caché (`cache_control`)
+    y la pregunta va la última, fuera de la caché.
+    """
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": INSTRUCTIONS,
+                    "cache_control": rag_prompt.CACHE_CONTROL,
+                },
+                {
+                    "type": "text",
+                    "text": _tickets_block(candidates),
+                    "cache_control": rag_prompt.CACHE_CONTROL,
+                },
+                {"type": "text", "text": f"Pregunta del usuario:\n{question}"},
+            ],
+        }
+    ]
 
 
 def answer(question: str, k: int = 5) -> Dict[str, Any]:
@@ -152,8 +309,10 @@ def answer(question: str, k: int = 5) -> Dict[str, Any]:
     Versión mínima del pipeline RAG:
 
     - Tickets en memoria (sin base de datos).
-    - Embeddings vía OpenAI.
+    - Embeddings vía OpenAI o el proveedor local (EMBEDDING_PROVIDER=local).
     - Similitud coseno implementada a mano.
+    - Prompt caching de Anthropic para instrucciones y tickets; `usage`
+      indica cuántos tokens se escribieron en la caché y cuántos se leyeron.
     """
     question = question.strip()
     if not question:
@@ -164,28 +323,14 @@ def answer(question: str, k: int = 5) -> Dict[str, Any]:
         return {
             "answer": "No he encontrado tickets relevantes para tu pregunta.",
             "sources": [],
+            "usage": rag_prompt.token_usage(None),
         }
 
-    context = _build_context(question, candidates)
-
-    response = anthropic_client.messages.create(
-        model=MODEL,
+    response = _anthropic().messages.create(
+        model=_chat_model(),
         max_tokens=600,
-        system=(
-            "Eres un asistente de soporte técnico que responde solo con la "
-            "información de los tickets proporcionados."
-        ),
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": context,
-                    }
-                ],
-            }
-        ],
+        system=[{"type": "text", "text": SYSTEM_PROMPT}],
+        messages=_build_messages(question, candidates),
     )
 
     text_parts = [
@@ -206,6 +351,7 @@ def answer(question: str, k: int = 5) -> Dict[str, Any]:
     return {
         "answer": final_answer,
         "sources": sources,
+        "usage": rag_prompt.token_usage(getattr(response, "usage", None)),
     }
 
 
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from typing import Any, Dict
+
+
+# Piezas de prompt caching de Anthropic compartidas por rag_local y
+# rag_minimal: el marcador que se pone en cada bloque cacheable y la lectura
+# de los tokens que informa la API.
+
+# Punto de caché efímero (unos minutos) al final de un bloque del prompt.
+CACHE_CONTROL = {"type": "ephemeral"}
+
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+
+def token_usage(usage: Any) -> Dict[str, int]:
+    """
+    Tokens consumidos por una llamada al modelo, incluidos los escritos en
+    y leídos de la caché de prompts (0 si no aplica o si no hubo llamada).
+    """
+    return {field: int(getattr(usage, field, 0) or 0) for field in USAGE_FIELDS}
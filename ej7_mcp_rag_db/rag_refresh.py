@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300.0
+DEFAULT_POLL = 2.0
+
+
+class IndexRefresher:
+    """
+    Hilo en segundo plano que mantiene el índice RAG al día.
+
+    Llama a `refresh` (normalmente `rag_local.sync_changes`, que aplica el
+    log de cambios o reindexa entero si hace falta) fuera del camino de las
+    peticiones:
+
+    - nada más arrancar, para tener un primer índice;
+    - cuando cambia la base de datos, detectado con `PRAGMA data_version`
+      (cambia cada vez que otra conexión confirma una escritura);
+    - cada `interval` segundos aunque no se detecten cambios (0 = nunca);
+    - cuando alguien lo pide con `trigger()`.
+
+    Como rag_local publica cada snapshot nuevo con una única asignación,
+    las consultas siguen usando el anterior mientras tanto.
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[], Dict[str, Any]],
+        db_path: Path | str,
+        interval: float = DEFAULT_INTERVAL,
+        poll: float = DEFAULT_POLL,
+    ) -> None:
+        self.refresh = refresh
+        self.db_path = Path(db_path)
+        self.interval = interval
+        self.poll = poll
+        self.last_result: Dict[str, Any] | None = None
+        self.last_error: BaseException | None = None
+        self.refreshes = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._conn: sqlite3.Connection | None = None
+        self._inode: int | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Arranca el hilo (si no estaba ya en marcha)."""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="rag-index-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def trigger(self) -> None:
+        """Pide una reindexación lo antes posible."""
+        self._wake.set()
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        """Para el hilo y espera (como mucho `timeout`) a que termine."""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _data_version(self) -> Tuple[int, int] | None:
+        """
+        Versión de la base de datos como (inodo, PRAGMA data_version), o None
+        si todavía no existe. La conexión se mantiene abierta porque
+        data_version solo refleja cambios hechos por otras conexiones; el
+        inodo detecta que el fichero se ha recreado (p. ej. con seed_db).
+        """
+        try:
+            inode = self.db_path.stat().st_ino
+        except FileNotFoundError:
+            self._close()
+            return None
+        if self._conn is None or inode != self._inode:
+            self._close()
+            self._conn = sqlite3.connect(self.db_path)
+            self._inode = inode
+        try:
+            return inode, int(self._conn.execute("PRAGMA data_version").fetchone()[0])
+        except sqlite3.Error:
+            self._close()
+            return None
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self) -> None:
+        version: Tuple[int, int] | None = None
+        next_run = 0.0
+        try:
+            while not self._stop.is_set():
+                current = self._data_version()
+                triggered = self._wake.is_set()
+                self._wake.clear()
+                changed = current is not None and current != version
+                due = self.interval > 0 and time.monotonic() >= next_run
+                if triggered or changed or due:
+                    # La versión se toma antes de reindexar: un cambio que
+                    # llegue durante la reindexación provoca otra pasada.
+                    version = current
+                    self._refresh_once()
+                    next_run = time.monotonic() + self.interval
+                self._wake.wait(self.poll)
+        finally:
+            self._close()
+
+    def _refresh_once(self) -> None:
+        try:
+            self.last_result = self.refresh()
+            self.last_error = None
+        except Exception as exc:  # el hilo no debe morir por un fallo puntual
+            self.last_error = exc
+            logger.exception("Error al reindexar los tickets en segundo plano")
+        finally:
+            self.refreshes += 1
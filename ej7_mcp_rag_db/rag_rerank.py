@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Sequence, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+DEFAULT_WEIGHT = 0.05
+DEFAULT_PRIOR = 2.0
+
+
+class FeedbackReranker:
+    """
+    Reordena los candidatos de la búsqueda según el feedback acumulado.
+
+    Por cada ticket se cuentan los votos útil/no útil de las respuestas en
+    las que apareció como fuente, tanto en global como por "cluster" de
+    pregunta. Como cluster usamos el ticket top-1 de la recuperación antes
+    de reordenar (`cluster_key`): dos preguntas cuyo mejor resultado es el
+    mismo ticket tratan casi siempre del mismo problema, y así no hace falta
+    ningún cálculo extra. Como el reranking cambia el orden de las fuentes,
+    el cluster no se deduce de ellas: viaja con la respuesta (`cluster_id`)
+    y vuelve en el feedback.
+
+    Todo vive en memoria y se actualiza de forma incremental con cada
+    feedback (`observe`), de modo que reordenar no hace I/O.
+    """
+
+    def __init__(self, weight: float = DEFAULT_WEIGHT, prior: float = DEFAULT_PRIOR) -> None:
+        self.weight = weight
+        self.prior = prior
+        self._tickets: Dict[int, List[int]] = {}
+        self._clusters: Dict[Tuple[int, int], List[int]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._tickets)
+
+    def observe(self, entry: Dict[str, Any]) -> None:
+        """
+        Incorpora una entrada de feedback con `helpful`, `source_ids` (ids
+        de los tickets usados como fuente) y, si se conoce, `cluster_id` (el
+        de la respuesta). Sin `cluster_id` solo cuentan los votos globales.
+        Las entradas sin fuentes se ignoran.
+        """
+        source_ids = [int(i) for i in entry.get("source_ids") or []]
+        if not source_ids:
+            return
+        slot = 0 if entry.get("helpful") else 1
+        cluster = entry.get("cluster_id")
+        with self._lock:
+            for ticket_id in source_ids:
+                self._tickets.setdefault(ticket_id, [0, 0])[slot] += 1
+                if cluster is not None:
+                    self._clusters.setdefault((int(cluster), ticket_id), [0, 0])[slot] += 1
+
+    def _ratio(self, votes: List[int] | None) -> float:
+        # Diferencia de votos suavizada: con pocos votos el efecto es pequeño.
+        if not votes:
+            return 0.0
+        helpful, unhelpful = votes
+        return (helpful - unhelpful) / (helpful + unhelpful + self.prior)
+
+    def boost(self, ticket_id: int, cluster: int | None = None) -> float:
+        """
+        Ajuste (positivo o negativo) que se suma a la similitud del ticket.
+        """
+        value = self._ratio(self._tickets.get(ticket_id))
+        if cluster is not None:
+            value += self._ratio(self._clusters.get((cluster, ticket_id)))
+        return self.weight * value
+
+    def rerank(
+        self,
+        candidates: Sequence[Tuple[T, float]],
+        ids: Sequence[int],
+        k: int,
+        scores: Sequence[float] | None = None,
+    ) -> List[Tuple[T, float]]:
+        """
+        Reordena `candidates` (pares (item, similitud) con sus `ids`) sumando
+        el boost de feedback y devuelve los k mejores. La puntuación devuelta
+        es la similitud original; solo cambia el orden.
+
+        `scores` es la puntuación de ranking a la que se suma el boost (p. ej.
+        la de la fusión RRF en búsqueda híbrida); por defecto, la similitud.
+        """
+        if not candidates:
+            return []
+        if scores is None:
+            scores = [score for _, score in candidates]
+        cluster = cluster_key(ids)
+        adjusted = [
+            (score + self.boost(ticket_id, cluster), pos)
+            for pos, (score, ticket_id) in enumerate(zip(scores, ids))
+        ]
+        adjusted.sort(key=lambda x: (-x[0], x[1]))
+        return [candidates[pos] for _, pos in adjusted[: max(1, k)]]
+
+
+def cluster_key(ids: Sequence[int]) -> int | None:
+    """
+    Cluster de una consulta a partir de los ids recuperados, en el orden de
+    la búsqueda (antes de reordenar): el ticket top-1.
+    """
+    return int(ids[0]) if ids else None
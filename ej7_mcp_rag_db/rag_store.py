@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+try:
+    from . import rag_db
+except ImportError:
+    import rag_db
+
+
+# Tabla "sidecar" dentro de incidents.db donde se guardan los embeddings ya
+# calculados. Es solo una caché: si se borra, el índice se reconstruye
+# llamando de nuevo a la API de embeddings.
+EMBEDDINGS_TABLE = "ticket_embeddings"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {EMBEDDINGS_TABLE} (
+  ticket_id INTEGER NOT NULL,
+  content_hash TEXT NOT NULL,
+  model TEXT NOT NULL,
+  dim INTEGER NOT NULL,
+  vector BLOB NOT NULL,
+  PRIMARY KEY (ticket_id, content_hash, model)
+)
+"""
+
+EmbeddingKey = Tuple[int, str]
+
+
+def content_hash(text: str) -> str:
+    """
+    Huella del texto que se embebe. Si el texto de un ticket cambia,
+    cambia la huella y el embedding guardado deja de ser válido.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _connect(db_path: Path | str) -> sqlite3.Connection:
+    conn = rag_db.connect(db_path)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def load_embeddings(db_path: Path | str, model: str) -> Dict[EmbeddingKey, np.ndarray]:
+    """
+    Devuelve los embeddings guardados para `model`, indexados por
+    (ticket_id, content_hash). No hace ninguna llamada de red.
+    """
+    conn = _connect(db_path)
+    rows = conn.execute(
+        f"SELECT ticket_id, content_hash, vector FROM {EMBEDDINGS_TABLE} "
+        "WHERE model = ?",
+        (model,),
+    ).fetchall()
+
+    return {
+        (int(ticket_id), str(digest)): np.frombuffer(blob, dtype=np.float32)
+        for ticket_id, digest, blob in rows
+    }
+
+
+def save_embeddings(
+    db_path: Path | str,
+    model: str,
+    items: Iterable[Tuple[int, str, Iterable[float]]],
+) -> int:
+    """
+    Guarda (ticket_id, content_hash, vector) para `model`.
+    Devuelve cuántos embeddings se han escrito.
+    """
+    rows = []
+    for ticket_id, digest, vector in items:
+        arr = np.asarray(vector, dtype=np.float32)
+        rows.append((int(ticket_id), digest, model, int(arr.shape[0]), arr.tobytes()))
+
+    if not rows:
+        return 0
+
+    conn = _connect(db_path)
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {EMBEDDINGS_TABLE} "
+            "(ticket_id, content_hash, model, dim, vector) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    return len(rows)
+
+
+def prune_embeddings(
+    db_path: Path | str, model: str, keep: Iterable[EmbeddingKey]
+) -> int:
+    """
+    Borra los embeddings de `model` cuya clave (ticket_id, content_hash)
+    no esté en `keep`: tickets eliminados o versiones antiguas de su texto.
+    Devuelve cuántas filas se han borrado.
+    """
+    conn = _connect(db_path)
+    with conn:
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS keep_keys "
+            "(ticket_id INTEGER, content_hash TEXT, PRIMARY KEY (ticket_id, content_hash))"
+        )
+        conn.execute("DELETE FROM keep_keys")
+        conn.executemany(
+            "INSERT OR IGNORE INTO keep_keys (ticket_id, content_hash) VALUES (?, ?)",
+            ((int(ticket_id), digest) for ticket_id, digest in keep),
+        )
+        cur = conn.execute(
+            f"DELETE FROM {EMBEDDINGS_TABLE} WHERE model = ? AND NOT EXISTS ("
+            "SELECT 1 FROM keep_keys k "
+            f"WHERE k.ticket_id = {EMBEDDINGS_TABLE}.ticket_id "
+            f"AND k.content_hash = {EMBEDDINGS_TABLE}.content_hash)",
+            (model,),
+        )
+        deleted = cur.rowcount
+    return deleted
+
+
+def delete_embeddings(db_path: Path | str, model: str, ticket_ids: Iterable[int]) -> int:
+    """
+    Borra todos los embeddings de `model` de los tickets indicados (p. ej.
+    antes de guardar los de su nueva versión). Devuelve cuántas filas se
+    han borrado.
+    """
+    ids = [(int(ticket_id),) for ticket_id in ticket_ids]
+    if not ids:
+        return 0
+    conn = _connect(db_path)
+    with conn:
+        cur = conn.executemany(
+            f"DELETE FROM {EMBEDDINGS_TABLE} WHERE model = ? AND ticket_id = ?",
+            ((model, ticket_id) for (ticket_id,) in ids),
+        )
+        deleted = cur.rowcount
+    return deleted
@@ -1,3 +1,5 @@
+DROP TABLE IF EXISTS ticket_changes;
+DROP TABLE IF EXISTS tickets_fts;
 DROP TABLE IF EXISTS tickets;
 
 CREATE TABLE tickets (
@@ -8,3 +10,51 @@ CREATE TABLE tickets (
   created_at TEXT NOT NULL
 );
 
+-- Índice de texto completo (FTS5) sobre los tickets, usado por la búsqueda
+-- léxica/híbrida de rag_local. Es una tabla "external content": no duplica
+-- el texto y los triggers la mantienen sincronizada con `tickets`.
+CREATE VIRTUAL TABLE tickets_fts USING fts5(
+  title, body, tags,
+  content='tickets', content_rowid='id'
+);
+
+CREATE TRIGGER tickets_fts_ai AFTER INSERT ON tickets BEGIN
+  INSERT INTO tickets_fts(rowid, title, body, tags)
+  VALUES (new.id, new.title, new.body, new.tags);
+END;
+
+CREATE TRIGGER tickets_fts_ad AFTER DELETE ON tickets BEGIN
+  INSERT INTO tickets_fts(tickets_fts, rowid, title, body, tags)
+  VALUES ('delete', old.id, old.title, old.body, old.tags);
+END;
+
+CREATE TRIGGER tickets_fts_au AFTER UPDATE ON tickets BEGIN
+  INSERT INTO tickets_fts(tickets_fts, rowid, title, body, tags)
+  VALUES ('delete', old.id, old.title, old.body, old.tags);
+  INSERT INTO tickets_fts(rowid, title, body, tags)
+  VALUES (new.id, new.title, new.body, new.tags);
+END;
+
+-- Change data capture: cada alta, modificación o baja de un ticket se apunta
+-- en `ticket_changes`. El servidor RAG consume este log para reindexar solo
+-- los tickets afectados, en segundos y sin releer toda la tabla.
+CREATE TABLE ticket_changes (
+  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  ticket_id INTEGER NOT NULL,
+  op TEXT NOT NULL,
+  changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TRIGGER tickets_cdc_ai AFTER INSERT ON tickets BEGIN
+  INSERT INTO ticket_changes(ticket_id, op) VALUES (new.id, 'insert');
+END;
+
+CREATE TRIGGER tickets_cdc_au AFTER UPDATE ON tickets BEGIN
+  INSERT INTO ticket_changes(ticket_id, op)
+  SELECT old.id, 'delete' WHERE old.id != new.id;
+  INSERT INTO ticket_changes(ticket_id, op) VALUES (new.id, 'update');
+END;
+
+CREATE TRIGGER tickets_cdc_ad AFTER DELETE ON tickets BEGIN
+  INSERT INTO ticket_changes(ticket_id, op) VALUES (old.id, 'delete');
+END;
@@ -103,11 +103,18 @@ def _seed_tickets(conn: sqlite3.Connection) -> None:
 
 
 def main() -> None:
-    if DB_PATH.exists():
-        DB_PATH.unlink()
+    # Además de la base de datos se borran sus ficheros de WAL: si quedaran
+    # los de la versión anterior, SQLite intentaría aplicarlos a la nueva.
+    for suffix in ("", "-wal", "-shm"):
+        path = DB_PATH.with_name(DB_PATH.name + suffix)
+        if path.exists():
+            path.unlink()
 
     conn = sqlite3.connect(DB_PATH)
     try:
+        # Modo WAL (se guarda en el fichero): el servidor RAG puede seguir
+        # leyendo mientras se escribe, sin bloqueos entre lectores y escritores.
+        conn.execute("PRAGMA journal_mode=WAL")
         schema_sql = _load_schema()
         conn.executescript(schema_sql)
         _seed_tickets(conn)
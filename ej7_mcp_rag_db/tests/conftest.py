@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+import pytest
+
+from ej7_mcp_rag_db.tests.helpers import reset_rag_state
+
+# Con pytest, cada test empieza con el estado global de rag_local y rag_db
+# limpio (con unittest lo hace RagStateTestCase, en helpers.py).
+
+
+@pytest.fixture(autouse=True)
+def _isolated_rag_state():
+    yield
+    reset_rag_state()
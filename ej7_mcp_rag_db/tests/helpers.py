@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import sqlite3
+import unittest
+from pathlib import Path
+
+from ej7_mcp_rag_db import rag_db, rag_local, seed_db
+
+# Utilidades compartidas por los tests de ej7 que construyen índices sobre
+# una base de datos temporal. Con unittest, RagStateTestCase limpia el estado
+# global de rag_local y rag_db después de cada test; con pytest lo hace
+# además el fixture de conftest.py.
+
+
+def make_tickets(n: int) -> list[rag_local.Ticket]:
+    return [
+        rag_local.Ticket(
+            id=i + 1,
+            title=f"Ticket {i + 1}",
+            body=f"Cuerpo del ticket {i + 1}.",
+            tags="",
+            created_at="2025-01-01T00:00:00Z",
+        )
+        for i in range(n)
+    ]
+
+
+def write_tickets(db_path: Path, tickets: list[rag_local.Ticket]) -> None:
+    """Crea una base de datos con el esquema real y los tickets dados."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(seed_db._load_schema())
+        conn.executemany(
+            "INSERT INTO tickets (id, title, body, tags, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(t.id, t.title, t.body, t.tags, t.created_at) for t in tickets],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reset_rag_state() -> None:
+    """Descarta el índice publicado y las conexiones SQLite cacheadas."""
+    rag_local._SNAPSHOT = rag_local._empty_snapshot()
+    rag_db.close_all()
+
+
+class RagStateTestCase(unittest.TestCase):
+    """
+    Base de los tests que publican índices o abren conexiones con rag_db:
+    al terminar cada test se restaura el estado global (ver reset_rag_state).
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.addCleanup(reset_rag_state)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import gc
+import unittest
+
+import numpy as np
+
+from ej7_mcp_rag_db import rag_ann
+
+
+class IVFIndexTests(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(3)
+        self.matrix = rag_ann._synthetic_corpus(2000, 32, clusters=20, rng=rng)
+        self.queries = self.matrix[rng.choice(2000, size=50, replace=False)]
+
+    def test_ivf_probing_all_lists_equals_exact_search(self) -> None:
+        ivf = rag_ann.IVFFlatIndex(self.matrix, nlist=16, nprobe=16)
+        exact = rag_ann.ExactIndex(self.matrix)
+
+        for query in self.queries:
+            got, got_scores = ivf.search(query, 5)
+            want, want_scores = exact.search(query, 5)
+            self.assertEqual(got.tolist(), want.tolist())
+            np.testing.assert_allclose(got_scores, want_scores, rtol=1e-6)
+
+    def test_ivf_recall_against_exact_search(self) -> None:
+        ivf = rag_ann.build_index("ivf", self.matrix, nlist=32, nprobe=4)
+        result = rag_ann.recall_at_k(ivf, self.queries, k=5)
+        self.assertGreaterEqual(result["recall_at_k"], 0.9)
+
+    def test_int8_quantization_keeps_recall_with_a_quarter_of_the_memory(self) -> None:
+        index = rag_ann.build_index("int8", self.matrix, rescore=4)
+        result = rag_ann.recall_at_k(index, self.queries, k=5)
+        self.assertGreaterEqual(result["recall_at_k"], 0.98)
+        self.assertLessEqual(index.codes.nbytes, self.matrix.nbytes // 4)
+
+    def test_binary_quantization_rescores_with_exact_scores(self) -> None:
+        index = rag_ann.QuantizedIndex(self.matrix, kind="binary", rescore=2000)
+        exact = rag_ann.ExactIndex(self.matrix)
+        self.assertEqual(index.codes.nbytes, self.matrix.shape[0] * 32 // 8)
+
+        # Si la lista corta abarca todo el corpus, el resultado es el exacto.
+        for query in self.queries[:10]:
+            got, got_scores = index.search(query, 5)
+            want, want_scores = exact.search(query, 5)
+            self.assertEqual(got.tolist(), want.tolist())
+            np.testing.assert_allclose(got_scores, want_scores, rtol=1e-6)
+
+    def test_sharded_search_merges_to_the_exact_top_k(self) -> None:
+        index = rag_ann.build_index("sharded", self.matrix, shards=3, workers=2)
+        self.addCleanup(index.close)
+        exact = rag_ann.ExactIndex(self.matrix)
+        self.assertEqual([end - start for start, end in index.bounds], [666, 667, 667])
+
+        for query in self.queries[:10]:
+            got, got_scores = index.search(query, 5)
+            want, want_scores = exact.search(query, 5)
+            self.assertEqual(got.tolist(), want.tolist())
+            np.testing.assert_allclose(got_scores, want_scores, rtol=1e-6)
+
+    def test_sharded_matrix_views_outlive_close_and_pool_is_shared(self) -> None:
+        first = rag_ann.build_index("sharded", self.matrix[:100], shards=2, workers=2)
+        second = rag_ann.build_index("sharded", self.matrix[100:200], shards=2, workers=2)
+        self.addCleanup(second.close)
+        self.assertIs(first._pool, second._pool)
+        first.search(self.queries[0], 3)
+
+        # Las vistas de la matriz mantienen vivo el segmento compartido:
+        # siguen siendo válidas después de cerrar y descartar el índice.
+        row = first.matrix[5]
+        first.close()
+        del first
+        gc.collect()
+        np.testing.assert_allclose(row, self.matrix[5])
+        got, _ = second.search(self.queries[0], 3)
+        want, _ = rag_ann.ExactIndex(self.matrix[100:200]).search(self.queries[0], 3)
+        self.assertEqual(got.tolist(), want.tolist())
+
+    def test_sharded_indexes_of_different_sizes_share_the_pool(self) -> None:
+        first = rag_ann.build_index("sharded", self.matrix[:100], shards=2)
+        self.addCleanup(first.close)
+        # Con una sola fila el índice tiene un único bloque, pero no cambia
+        # (ni para) el pool que usa el primero.
+        second = rag_ann.build_index("sharded", self.matrix[:1], shards=2)
+        self.addCleanup(second.close)
+        self.assertEqual(second.shards, 1)
+        self.assertIs(first._pool, second._pool)
+
+        got, _ = first.search(self.queries[0], 3)
+        want, _ = rag_ann.ExactIndex(self.matrix[:100]).search(self.queries[0], 3)
+        self.assertEqual(got.tolist(), want.tolist())
+
+    def test_unknown_index_kind_raises(self) -> None:
+        with self.assertRaises(ValueError):
+            rag_ann.build_index("hnsw", self.matrix)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from ej7_mcp_rag_db import rag_cdc, rag_local
+from ej7_mcp_rag_db.tests.helpers import RagStateTestCase, make_tickets, write_tickets
+
+
+def _fake_embed(texts: list[str]) -> list[list[float]]:
+    # Vector determinista a partir del texto, para no llamar a OpenAI.
+    return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in texts]
+
+
+class ChangeLogTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        write_tickets(self.db_path, make_tickets(2))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_triggers_log_every_change_in_order(self) -> None:
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute("UPDATE tickets SET body = 'Nuevo cuerpo.' WHERE id = 1")
+            conn.execute("DELETE FROM tickets WHERE id = 2")
+        conn.close()
+
+        changes = rag_cdc.read_changes(self.db_path, 0)
+        self.assertEqual(
+            [(ticket_id, op) for _, ticket_id, op in changes],
+            [(1, "insert"), (2, "insert"), (1, "update"), (2, "delete")],
+        )
+        self.assertEqual(rag_cdc.latest_seq(self.db_path), changes[-1][0])
+        self.assertEqual(rag_cdc.read_changes(self.db_path, changes[1][0], limit=1), [changes[2]])
+
+        self.assertEqual(rag_cdc.purge_changes(self.db_path, changes[1][0]), 2)
+        self.assertEqual(rag_cdc.oldest_seq(self.db_path), changes[2][0])
+
+    def test_change_log_is_added_to_existing_databases(self) -> None:
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(
+            "DROP TRIGGER tickets_cdc_ai; DROP TRIGGER tickets_cdc_au; "
+            "DROP TRIGGER tickets_cdc_ad; DROP TABLE ticket_changes;"
+        )
+        conn.close()
+
+        self.assertTrue(rag_cdc.ensure_change_log(self.db_path))
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute("DELETE FROM tickets WHERE id = 1")
+        conn.close()
+        self.assertEqual([op for _, _, op in rag_cdc.read_changes(self.db_path, 0)], ["delete"])
+
+        self.assertFalse(rag_cdc.ensure_change_log(Path(self.tmp_dir.name) / "missing.db"))
+
+
+class SyncChangesTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        write_tickets(self.db_path, make_tickets(4))
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed):
+            rag_local.refresh_index(self.db_path, force=True)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _execute(self, *statements: str) -> None:
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+        conn.close()
+
+    def test_full_refresh_consumes_the_change_log(self) -> None:
+        self.assertEqual(rag_cdc.oldest_seq(self.db_path), 0)
+        self.assertEqual(rag_local._SNAPSHOT.change_seq, 4)
+
+    def test_sync_only_embeds_the_changed_tickets(self) -> None:
+        self._execute(
+            "INSERT INTO tickets (id, title, body, tags, created_at) "
+            "VALUES (5, 'Ticket 5', 'Error 413 al subir ficheros.', '', '2025-01-02T00:00:00Z')",
+            "UPDATE tickets SET body = 'Cuerpo editado.' WHERE id = 2",
+            "UPDATE tickets SET created_at = '2025-02-01T00:00:00Z' WHERE id = 3",
+            "DELETE FROM tickets WHERE id = 4",
+        )
+
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed) as embed, patch.object(
+            rag_local, "_load_tickets", side_effect=AssertionError("no debe releer la tabla")
+        ):
+            stats = rag_local.sync_changes(self.db_path)
+
+        embed.assert_called_once()
+        self.assertEqual(len(embed.call_args.args[0]), 2)
+        self.assertEqual(
+            stats,
+            {
+                "added": 1,
+                "updated": 1,
+                "removed": 1,
+                "unchanged": 1,
+                "indexed_tickets": 4,
+                "indexed_passages": 4,
+                "changes": 4,
+            },
+        )
+        self.assertEqual(rag_cdc.oldest_seq(self.db_path), 0)
+
+        snap = rag_local._SNAPSHOT
+        self.assertEqual(snap.ticket_ids.tolist(), [1, 2, 3, 5])
+        self.assertEqual(snap.row_start.tolist(), [0, 1, 2, 3, 4])
+
+        # El índice incremental es el mismo que saldría de reindexar entero.
+        embeddings = snap.embeddings.copy()
+        hashes = snap.row_hashes.copy()
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed):
+            rag_local.refresh_index(self.db_path, force=True)
+        self.assertEqual(rag_local._SNAPSHOT.row_hashes.tolist(), hashes.tolist())
+        self.assertTrue((abs(rag_local._SNAPSHOT.embeddings - embeddings) < 1e-6).all())
+
+        stored = rag_local.rag_store.load_embeddings(self.db_path, rag_local.EMBEDDING_MODEL)
+        self.assertEqual(sorted(ticket_id for ticket_id, _ in stored), [1, 2, 3, 5])
+
+    def test_small_changes_go_to_the_delta_and_reuse_the_base_index(self) -> None:
+        write_tickets(self.db_path, make_tickets(40))
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed):
+            rag_local.refresh_index(self.db_path, force=True)
+        base = rag_local._SNAPSHOT
+
+        self._execute(
+            "UPDATE tickets SET body = 'Cuerpo editado.' WHERE id = 7",
+            "DELETE FROM tickets WHERE id = 8",
+        )
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed) as embed:
+            stats = rag_local.sync_changes(self.db_path)
+
+        self.assertEqual(len(embed.call_args.args[0]), 1)
+        self.assertEqual((stats["indexed_tickets"], stats["indexed_passages"]), (39, 39))
+        snap = rag_local._SNAPSHOT
+        self.assertIs(snap.index, base.index)
+        self.assertIs(snap.embeddings, base.embeddings)
+        self.assertEqual(snap.delta.ticket_ids.tolist(), [7])
+        self.assertEqual(snap.dead.tolist(), [6, 7])
+
+        # La versión nueva sale del delta; la antigua y la borrada no aparecen.
+        results = rag_local._search_similar(
+            "pregunta", k=40, question_embedding=snap.delta.embeddings[0]
+        )
+        ids = [ticket.id for ticket, _ in results]
+        self.assertEqual(ids[0], 7)
+        self.assertEqual(sorted(ids), [i for i in range(1, 41) if i != 8])
+        self.assertEqual(results[0][0].body, "Cuerpo editado.")
+
+        # Al superar RAG_DELTA_MAX_FRACTION se compacta en un índice nuevo,
+        # igual al de una reindexación completa.
+        self._execute(*(f"UPDATE tickets SET body = 'Otro {i}.' WHERE id = {i}" for i in range(1, 4)))
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed):
+            rag_local.sync_changes(self.db_path)
+        compacted = rag_local._SNAPSHOT
+        self.assertIsNone(compacted.delta)
+        self.assertIsNot(compacted.index, base.index)
+        self.assertEqual(compacted.dead.tolist(), [])
+
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed):
+            rag_local.refresh_index(self.db_path, force=True)
+        self.assertEqual(compacted.ticket_ids.tolist(), rag_local._SNAPSHOT.ticket_ids.tolist())
+        self.assertEqual(compacted.row_hashes.tolist(), rag_local._SNAPSHOT.row_hashes.tolist())
+        self.assertTrue((abs(compacted.embeddings - rag_local._SNAPSHOT.embeddings) < 1e-6).all())
+
+    def test_sync_without_changes_does_nothing(self) -> None:
+        before = rag_local._SNAPSHOT
+        with patch.object(rag_local, "_embed_texts", side_effect=AssertionError):
+            stats = rag_local.sync_changes(self.db_path)
+        self.assertEqual(stats["changes"], 0)
+        self.assertIs(rag_local._SNAPSHOT, before)
+
+    def test_recreated_change_log_falls_back_to_a_full_refresh(self) -> None:
+        self._execute("UPDATE tickets SET body = 'Otro cuerpo.' WHERE id = 1")
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed):
+            rag_local.sync_changes(self.db_path)
+
+        # Como tras seed_db: la base de datos se rehace y el log vuelve a empezar.
+        write_tickets(self.db_path, make_tickets(2))
+        with patch.object(rag_local, "_embed_texts", side_effect=_fake_embed), patch.object(
+            rag_local, "_load_tickets", wraps=rag_local._load_tickets
+        ) as load:
+            rag_local.sync_changes(self.db_path)
+
+        load.assert_called_once()
+        self.assertEqual(rag_local._SNAPSHOT.ticket_ids.tolist(), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
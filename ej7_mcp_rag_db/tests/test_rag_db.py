@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import sqlite3
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from ej7_mcp_rag_db import rag_db
+
+
+class ConnectionManagerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        conn = rag_db.connect(self.db_path)
+        with conn:
+            conn.execute("CREATE TABLE tickets (id INTEGER PRIMARY KEY, title TEXT)")
+            conn.execute("INSERT INTO tickets (title) VALUES ('primero')")
+
+    def tearDown(self) -> None:
+        rag_db.close_all()
+        self.tmp_dir.cleanup()
+
+    def test_connections_are_reused_per_thread_and_tuned(self) -> None:
+        conn = rag_db.connect(self.db_path)
+        self.assertIs(rag_db.connect(str(self.db_path)), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(
+            conn.execute("PRAGMA cache_size").fetchone()[0], -rag_db.SQLITE_CACHE_SIZE_KIB
+        )
+
+        other: list[sqlite3.Connection] = []
+        thread = threading.Thread(target=lambda: other.append(rag_db.connect(self.db_path)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_close_all_reopens_connections_cached_by_other_threads(self) -> None:
+        ready, closed = threading.Event(), threading.Event()
+        titles: list[str] = []
+
+        def worker() -> None:
+            rag_db.connect(self.db_path)
+            ready.set()
+            closed.wait(5)
+            conn = rag_db.connect(self.db_path)
+            titles.append(conn.execute("SELECT title FROM tickets").fetchone()[0])
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        ready.wait(5)
+        rag_db.close_all()
+        closed.set()
+        thread.join(5)
+        self.assertEqual(titles, ["primero"])
+
+    def test_readonly_connection_rejects_writes(self) -> None:
+        conn = rag_db.connect(self.db_path, readonly=True)
+        self.assertIsNot(conn, rag_db.connect(self.db_path))
+        self.assertEqual(conn.execute("SELECT title FROM tickets").fetchall(), [("primero",)])
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO tickets (title) VALUES ('no')")
+
+    def test_readers_do_not_wait_for_an_open_write_transaction(self) -> None:
+        reader = rag_db.connect(self.db_path, readonly=True)
+        writer = sqlite3.connect(self.db_path, timeout=0)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute("INSERT INTO tickets (title) VALUES ('segundo')")
+            # Con WAL el lector ve la última versión confirmada sin bloquearse.
+            self.assertEqual(reader.execute("SELECT COUNT(*) FROM tickets").fetchone()[0], 1)
+            writer.commit()
+        finally:
+            writer.close()
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM tickets").fetchone()[0], 2)
+
+    def test_recreated_database_gets_a_new_connection(self) -> None:
+        old = rag_db.connect(self.db_path, readonly=True)
+        for suffix in ("", "-wal", "-shm"):
+            Path(str(self.db_path) + suffix).unlink(missing_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE tickets (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.close()
+
+        new = rag_db.connect(self.db_path, readonly=True)
+        self.assertIsNot(new, old)
+        self.assertEqual(new.execute("SELECT COUNT(*) FROM tickets").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import unittest
+
+from openai import OpenAI
+
+from ej7_mcp_rag_db import rag_embeddings
+
+
+class _FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    """
+    Servidor de embeddings falso compatible con la API de OpenAI:
+    el vector de cada texto es [longitud, código del primer carácter].
+    La primera petición responde 429 para forzar un reintento.
+    """
+
+    requests: list[list[str]] = []
+    rate_limited_once = False
+
+    def do_POST(self) -> None:  # noqa: N802 - API de BaseHTTPRequestHandler
+        length = int(self.headers["Content-Length"])
+        payload = json.loads(self.rfile.read(length))
+
+        if not type(self).rate_limited_once:
+            type(self).rate_limited_once = True
+            self._send(429, {"error": {"message": "Rate limit", "type": "rate_limit"}})
+            return
+
+        texts = payload["input"]
+        type(self).requests.append(texts)
+        data = [
+            {"object": "embedding", "index": i, "embedding": [float(len(t)), float(ord(t[0]))]}
+            for i, t in enumerate(texts)
+        ]
+        # Devolvemos los elementos al revés para comprobar que se reordenan por index.
+        self._send(
+            200,
+            {
+                "object": "list",
+                "data": list(reversed(data)),
+                "model": payload["model"],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+    def _send(self, status: int, body: dict) -> None:
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class BatchedEmbeddingTests(unittest.TestCase):
+    def setUp(self) -> None:
+        _FakeEmbeddingHandler.requests = []
+        _FakeEmbeddingHandler.rate_limited_once = False
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeEmbeddingHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        port = self.server.server_address[1]
+        self.client = OpenAI(
+            api_key="test", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0
+        )
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.client.close()
+
+    def test_split_batches_respects_items_and_tokens(self) -> None:
+        texts = ["a" * 40, "b" * 40, "c" * 400, "d"]
+        batches = rag_embeddings.split_batches(texts, max_items=2, max_tokens=50)
+        self.assertEqual(batches, [[0, 1], [2], [3]])
+
+    def test_embed_batched_keeps_order_and_retries_rate_limits(self) -> None:
+        texts = [chr(ord("a") + i % 26) * (i + 1) for i in range(23)]
+
+        vectors = rag_embeddings.embed_batched(
+            self.client,
+            "fake-model",
+            texts,
+            max_items=5,
+            concurrency=3,
+            base_delay=0.01,
+        )
+
+        self.assertEqual(vectors, [[float(len(t)), float(ord(t[0]))] for t in texts])
+        self.assertEqual(len(_FakeEmbeddingHandler.requests), 5)
+        self.assertTrue(all(len(batch) <= 5 for batch in _FakeEmbeddingHandler.requests))
+
+
+class LocalEmbedderTests(unittest.TestCase):
+    def test_hash_embeddings_are_deterministic_and_normalized(self) -> None:
+        vector = rag_embeddings.hash_embed("Timeout en nginx al subir ficheros", dim=64)
+        self.assertEqual(len(vector), 64)
+        self.assertAlmostEqual(sum(x * x for x in vector), 1.0, places=6)
+        self.assertEqual(vector, rag_embeddings.hash_embed("Timeout en nginx al subir ficheros", 64))
+        self.assertEqual(rag_embeddings.hash_embed("", dim=8), [0.0] * 8)
+
+    def test_similar_texts_score_higher_than_unrelated_ones(self) -> None:
+        def cosine(a: str, b: str) -> float:
+            va, vb = rag_embeddings.hash_embed(a), rag_embeddings.hash_embed(b)
+            return sum(x * y for x, y in zip(va, vb))
+
+        question = "¿Por qué fallan las subidas de ficheros con error 413?"
+        related = "Subidas de ficheros fallan con error 413 Request Entity Too Large"
+        unrelated = "Usuarios no pueden restablecer la contraseña por SMTP"
+        self.assertGreater(cosine(question, related), cosine(question, unrelated) + 0.2)
+
+    def test_parallel_embedding_matches_serial(self) -> None:
+        texts = [f"ticket {i} con error {i % 7}" for i in range(10)]
+        serial = rag_embeddings.HashingEmbedder(dim=32, workers=1)
+        parallel = rag_embeddings.HashingEmbedder(dim=32, workers=2, parallel_min=4)
+        self.assertEqual(parallel.embed(texts), serial.embed(texts))
+
+    def test_make_embedder_selects_the_provider(self) -> None:
+        local = rag_embeddings.make_embedder("local", dim=128)
+        self.assertEqual(local.name, "local-hash-128")
+        remote = rag_embeddings.make_embedder("openai", client=object(), model="m")
+        self.assertEqual(remote.name, "m")
+        with self.assertRaises(ValueError):
+            rag_embeddings.make_embedder("tfhub")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from ej7_mcp_rag_db import rag_feedback
+
+
+class FeedbackStoreTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "feedback.jsonl"
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_concurrent_appends_are_not_lost(self) -> None:
+        store = rag_feedback.FeedbackStore(self.path)
+
+        def worker(n: int) -> None:
+            for i in range(50):
+                store.append({"worker": n, "i": i})
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(store.count(), 400)
+        lines = self.path.read_text(encoding="utf-8").splitlines()
+        self.assertEqual(len(lines), 400)
+        self.assertTrue(all(json.loads(line) for line in lines))
+
+    def test_tail_reads_across_rotated_segments(self) -> None:
+        store = rag_feedback.FeedbackStore(self.path, max_bytes=200, backups=2)
+        for i in range(20):
+            store.append({"i": i, "question": "¿Qué pasó?"})
+
+        self.assertTrue(self.path.with_name("feedback.jsonl.1").exists())
+        self.assertEqual([e["i"] for e in store.tail(5)], [15, 16, 17, 18, 19])
+        kept = [e["i"] for e in store]
+        self.assertEqual(kept, list(range(20 - len(kept), 20)))
+        self.assertEqual(store.count(), len(kept))
+        self.assertEqual(rag_feedback.FeedbackStore(self.path, backups=2).count(), len(kept))
+
+    def test_import_legacy_json(self) -> None:
+        legacy = Path(self.tmp_dir.name) / "feedback.json"
+        legacy.write_text(json.dumps([{"question": "a"}, {"question": "b"}]), encoding="utf-8")
+
+        store = rag_feedback.FeedbackStore(self.path)
+        self.assertEqual(store.import_legacy_json(legacy), 2)
+        self.assertEqual([e["question"] for e in store.tail(10)], ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
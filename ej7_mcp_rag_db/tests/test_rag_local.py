@@ -0,0 +1,598 @@
+from __future__ import annotations
+
+import gc
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from ej7_mcp_rag_db import rag_local, seed_db
+from ej7_mcp_rag_db.tests.helpers import RagStateTestCase, make_tickets, write_tickets
+
+
+class LazyImportTests(RagStateTestCase):
+    def test_import_needs_no_keys_and_does_not_load_the_sdks(self) -> None:
+        env = {
+            k: v
+            for k, v in os.environ.items()
+            if k not in ("MODEL", "ANTHROPIC_API_KEY", "OPENAI_API_KEY")
+        }
+        code = (
+            "import sys; from ej7_mcp_rag_db import rag_local; "
+            "print(sorted(m for m in ('anthropic', 'openai') if m in sys.modules))"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=Path(__file__).resolve().parents[2],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(out.stdout.strip(), "[]")
+
+    def test_missing_key_is_reported_on_first_use(self) -> None:
+        with patch.object(rag_local, "anthropic_client", None), patch.dict(
+            os.environ, {"ANTHROPIC_API_KEY": ""}
+        ):
+            with self.assertRaisesRegex(RuntimeError, "ANTHROPIC_API_KEY"):
+                rag_local._anthropic()
+
+
+class VectorSearchTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        rag_local._QUERY_CACHE.clear()
+        rag_local._QUERY_CACHE_STATS.update(hits=0, misses=0)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_search_similar_matches_pure_python_ranking(self) -> None:
+        rng = random.Random(7)
+        tickets = make_tickets(40)
+        vectors = [[rng.uniform(-1, 1) for _ in range(16)] for _ in tickets]
+        question_vec = [rng.uniform(-1, 1) for _ in range(16)]
+
+        write_tickets(self.db_path, tickets)
+        with patch.object(rag_local, "_embed_texts", return_value=vectors):
+            rag_local.build_index(self.db_path)
+
+        with patch.object(rag_local, "_embed_texts", return_value=[question_vec]):
+            results = rag_local._search_similar("pregunta", k=5)
+
+        expected = sorted(
+            (
+                (t, rag_local._cosine_similarity(question_vec, v))
+                for t, v in zip(tickets, vectors)
+            ),
+            key=lambda x: x[1],
+            reverse=True,
+        )[:5]
+
+        self.assertEqual([t.id for t, _ in results], [t.id for t, _ in expected])
+        for (_, got), (_, want) in zip(results, expected):
+            self.assertAlmostEqual(got, want, places=5)
+
+    def test_unhelpful_feedback_pushes_ticket_down(self) -> None:
+        tickets = make_tickets(4)
+        vectors = [[1.0, 0.0], [0.98, 0.2], [0.9, 0.4], [0.0, 1.0]]
+        write_tickets(self.db_path, tickets)
+        with patch.object(rag_local, "_embed_texts", return_value=vectors):
+            rag_local.build_index(self.db_path)
+
+        reranker = rag_local.rag_rerank.FeedbackReranker(weight=0.2)
+        with patch.object(rag_local, "_RERANKER", reranker), patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0]]
+        ):
+            before = [t.id for t, _ in rag_local._search_similar("pregunta", k=2)]
+            for _ in range(5):
+                rag_local.record_feedback({"helpful": False, "source_ids": [1, 2]})
+                rag_local.record_feedback({"helpful": True, "source_ids": [2, 3]})
+            after = [t.id for t, _ in rag_local._search_similar("pregunta", k=2)]
+
+        self.assertEqual(before, [1, 2])
+        self.assertEqual(after, [3, 2])
+
+    def test_feedback_cluster_is_the_top_1_before_reranking(self) -> None:
+        tickets = make_tickets(4)
+        vectors = [[1.0, 0.0], [0.98, 0.2], [0.9, 0.4], [0.0, 1.0]]
+        write_tickets(self.db_path, tickets)
+        with patch.object(rag_local, "_embed_texts", return_value=vectors):
+            rag_local.build_index(self.db_path)
+
+        reranker = rag_local.rag_rerank.FeedbackReranker(weight=0.2)
+        with patch.object(rag_local, "_RERANKER", reranker), patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0]]
+        ):
+            _, first, cluster_id = rag_local._retrieve("pregunta", k=2)
+            for _ in range(5):
+                rag_local.record_feedback(
+                    {"helpful": False, "source_ids": [1], "cluster_id": cluster_id}
+                )
+
+            # El feedback reordena las fuentes, pero el cluster no cambia.
+            _, second, second_cluster = rag_local._retrieve("pregunta", k=2)
+            for _ in range(5):
+                rag_local.record_feedback(
+                    {"helpful": True, "source_ids": [3], "cluster_id": second_cluster}
+                )
+            _, third, _ = rag_local._retrieve("pregunta", k=2)
+
+        self.assertEqual(cluster_id, 1)
+        self.assertEqual([t.id for t, _ in first], [1, 2])
+        self.assertEqual([t.id for t, _ in second], [2, 3])
+        self.assertEqual(second_cluster, cluster_id)
+        self.assertGreater(reranker.boost(3, cluster=cluster_id), reranker.boost(3))
+        self.assertEqual([t.id for t, _ in third], [3, 2])
+
+    def test_index_is_columnar_and_fetches_only_top_k(self) -> None:
+        tickets = make_tickets(50)
+        write_tickets(self.db_path, tickets)
+        vectors = [[float(i), 1.0] for i in range(50)]
+        with patch.object(rag_local, "_embed_texts", return_value=vectors):
+            rag_local.build_index(self.db_path)
+
+        memory = rag_local.index_memory()
+        self.assertEqual(memory["embeddings"], 50 * 2 * 4)
+        self.assertLess(memory["total"], 50 * 200)
+        self.assertFalse(hasattr(tickets[0], "__dict__"))
+
+        fetch = MagicMock(wraps=rag_local._fetch_tickets)
+        with patch.object(rag_local, "_fetch_tickets", fetch), patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0]]
+        ):
+            results = rag_local._search_similar("pregunta", k=3)
+
+        fetch.assert_called_once()
+        self.assertEqual(sorted(fetch.call_args.args[0]), [48, 49, 50])
+        self.assertEqual([t.id for t, _ in results], [50, 49, 48])
+        self.assertEqual(results[0][0].body, "Cuerpo del ticket 50.")
+
+    def test_quantized_index_keeps_float_vectors_on_disk(self) -> None:
+        rng = random.Random(11)
+        tickets = make_tickets(40)
+        vectors = [[rng.uniform(-1, 1) for _ in range(16)] for _ in tickets]
+        question_vec = [rng.uniform(-1, 1) for _ in range(16)]
+        write_tickets(self.db_path, tickets)
+
+        with patch.object(rag_local, "_embed_texts", return_value=vectors):
+            rag_local.build_index(self.db_path)
+        with patch.object(rag_local, "_embed_texts", return_value=[question_vec]):
+            exact = rag_local._search_similar("pregunta", k=5)
+
+        with patch.object(rag_local, "RAG_INDEX_KIND", "int8"), patch.object(
+            rag_local, "RAG_RESCORE_FACTOR", 8
+        ):
+            # Cambiar de índice no vuelve a calcular embeddings.
+            rag_local.build_index(self.db_path)
+            results = rag_local._search_similar("pregunta", k=5)
+            memory = rag_local.index_memory()
+
+        self.assertIsInstance(rag_local._SNAPSHOT.embeddings, rag_local.np.memmap)
+        self.assertEqual(memory["embeddings"], 0)
+        self.assertEqual(memory["quantized_codes"], 40 * 16 + 16 * 4)
+        self.assertEqual([t.id for t, _ in results], [t.id for t, _ in exact])
+        for (_, got), (_, want) in zip(results, exact):
+            self.assertAlmostEqual(got, want, places=5)
+
+    def test_each_quantized_build_spills_to_its_own_file(self) -> None:
+        write_tickets(self.db_path, make_tickets(4))
+        vectors = [[1.0, 0.0], [0.8, 0.6], [0.0, 1.0], [0.6, 0.8]]
+        with patch.object(rag_local, "RAG_INDEX_KIND", "int8"), patch.object(
+            rag_local, "_embed_texts", return_value=vectors
+        ):
+            rag_local.build_index(self.db_path)
+            first = Path(rag_local._SNAPSHOT.embeddings.filename)
+            # Una consulta en curso que aún lee el snapshot anterior.
+            row = rag_local._SNAPSHOT.embeddings[1]
+            rag_local.build_index(self.db_path, force=True)
+            second = Path(rag_local._SNAPSHOT.embeddings.filename)
+
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.exists())
+        self.assertAlmostEqual(float(row[0]), 0.8, places=5)
+
+        # El fichero viejo se borra cuando nadie lo usa; el actual se conserva.
+        del row
+        gc.collect()
+        self.assertFalse(first.exists())
+        self.assertTrue(second.exists())
+
+    def test_repeated_question_hits_query_cache(self) -> None:
+        with patch.object(rag_local, "_embed_texts", return_value=[[3.0, 4.0]]) as embed:
+            first = rag_local._embed_query("¿Por qué falla el login?")
+            second = rag_local._embed_query("  ¿por qué  falla el LOGIN? ")
+
+        embed.assert_called_once()
+        assert first is not None and second is not None
+        self.assertEqual(second.tolist(), first.tolist())
+        stats = rag_local.query_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+
+class ContextBudgetTests(RagStateTestCase):
+    def test_context_respects_budget_and_keeps_relevant_passages(self) -> None:
+        filler = "Se revisaron métricas generales sin encontrar nada raro. " * 40
+        tickets = [
+            rag_local.Ticket(
+                id=i,
+                title=f"Incidencia {i}",
+                body=filler + "El error 413 lo provoca client_max_body_size en nginx. " + filler,
+                tags="nginx",
+                created_at="2025-01-01T00:00:00Z",
+            )
+            for i in range(1, 6)
+        ]
+        candidates = [(t, 1.0 - 0.1 * t.id) for t in tickets]
+
+        pack = rag_local._build_context("¿Por qué nginx da 413?", candidates, token_budget=350)
+
+        self.assertLessEqual(pack.tokens, 350)
+        self.assertGreaterEqual(len(pack.candidates), 1)
+        self.assertLess(len(pack.candidates), len(candidates))
+        self.assertEqual(
+            [t.id for t, _ in pack.candidates], [t.id for t, _ in candidates[: len(pack.candidates)]]
+        )
+        self.assertIn("client_max_body_size", pack.text)
+        self.assertTrue(pack.text.rstrip().endswith("¿Por qué nginx da 413?"))
+
+    def test_short_tickets_are_kept_whole(self) -> None:
+        tickets = make_tickets(3)
+        pack = rag_local._build_context("pregunta", [(t, 0.5) for t in tickets], token_budget=3000)
+        self.assertEqual(len(pack.candidates), 3)
+        for ticket in tickets:
+            self.assertIn(ticket.body, pack.text)
+
+
+class EmbeddingStoreTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        # Base de datos real (vacía); los tickets los aporta cada test.
+        write_tickets(self.db_path, [])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_missing_database_is_reported_and_not_created(self) -> None:
+        missing = Path(self.tmp_dir.name) / "missing.db"
+        with patch.object(rag_local, "_embed_texts") as embed:
+            with self.assertRaisesRegex(RuntimeError, "seed_db.py"):
+                rag_local.build_index(missing)
+        embed.assert_not_called()
+        self.assertFalse(missing.exists())
+
+    def test_empty_database_publishes_a_ready_index(self) -> None:
+        with patch.object(rag_local, "_embed_texts", return_value=[]):
+            self.assertEqual(rag_local.build_index(self.db_path), 0)
+        self.assertTrue(rag_local.index_ready())
+
+        # Publicado pero vacío: no se reconstruye ni se embebe la pregunta.
+        with patch.object(rag_local, "build_index") as build, patch.object(
+            rag_local, "_embed_texts", side_effect=AssertionError
+        ):
+            self.assertEqual(rag_local._search_similar("pregunta"), [])
+        build.assert_not_called()
+
+    def test_rebuild_reuses_persisted_embeddings(self) -> None:
+        tickets = make_tickets(3)
+        vectors = [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+
+        with patch.object(rag_local, "_load_tickets", return_value=tickets), patch.object(
+            rag_local, "_embed_texts", return_value=vectors
+        ) as first_embed:
+            rag_local.build_index(self.db_path)
+        self.assertEqual(first_embed.call_count, 1)
+
+        with patch.object(rag_local, "_load_tickets", return_value=tickets), patch.object(
+            rag_local, "_embed_texts", return_value=[]
+        ) as second_embed:
+            count = rag_local.build_index(self.db_path)
+
+        self.assertEqual(count, 3)
+        second_embed.assert_called_once_with([])
+        self.assertEqual(rag_local._SNAPSHOT.embeddings.shape, (3, 2))
+
+    def test_refresh_index_only_embeds_the_delta(self) -> None:
+        tickets = make_tickets(3)
+        with patch.object(rag_local, "_load_tickets", return_value=tickets), patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+        ):
+            rag_local.refresh_index(self.db_path)
+
+        changed = [
+            tickets[0],
+            rag_local.Ticket(
+                id=2,
+                title="Ticket 2 editado",
+                body="Nuevo cuerpo.",
+                tags="",
+                created_at="2025-01-01T00:00:00Z",
+            ),
+            make_tickets(4)[3],
+        ]
+        with patch.object(rag_local, "_load_tickets", return_value=changed), patch.object(
+            rag_local, "_embed_texts", return_value=[[0.5, 0.5], [0.2, 0.8]]
+        ) as embed:
+            stats = rag_local.refresh_index(self.db_path)
+
+        embed.assert_called_once()
+        self.assertEqual(len(embed.call_args.args[0]), 2)
+        self.assertEqual(
+            stats,
+            {
+                "added": 1,
+                "updated": 1,
+                "removed": 1,
+                "unchanged": 1,
+                "indexed_tickets": 3,
+                "indexed_passages": 3,
+            },
+        )
+        stored = rag_local.rag_store.load_embeddings(self.db_path, rag_local.EMBEDDING_MODEL)
+        self.assertEqual(sorted(ticket_id for ticket_id, _ in stored), [1, 2, 4])
+
+
+class ChunkingTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        rag_local._QUERY_CACHE.clear()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_passages_overlap_and_cover_the_body(self) -> None:
+        words = [f"palabra{i:03d}" for i in range(300)]
+        spans = rag_local._split_passages(words, max_tokens=50, overlap_tokens=10)
+
+        self.assertGreater(len(spans), 1)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], len(words))
+        for (_, prev_end), (start, _) in zip(spans, spans[1:]):
+            self.assertLess(start, prev_end)
+
+    def test_long_ticket_is_retrieved_by_its_matching_passage(self) -> None:
+        filler = "Se revisaron métricas generales sin encontrar nada raro. " * 30
+        tickets = [
+            rag_local.Ticket(
+                id=1,
+                title="Postmortem nginx",
+                body=filler + "El error 413 lo provoca client_max_body_size en nginx. " + filler,
+                tags="nginx",
+                created_at="2025-01-01T00:00:00Z",
+            ),
+            *make_tickets(3)[1:],
+        ]
+
+        def fake_embed(texts: list[str]) -> list[list[float]]:
+            return [[1.0, 0.0] if "413" in t else [0.1, 1.0] for t in texts]
+
+        write_tickets(self.db_path, tickets)
+        with patch.object(rag_local, "RAG_CHUNK_TOKENS", 60), patch.object(
+            rag_local, "_embed_texts", side_effect=fake_embed
+        ):
+            stats = rag_local.refresh_index(self.db_path)
+            results = rag_local._search_similar("¿Por qué nginx da 413?", k=2)
+
+        self.assertEqual(stats["indexed_tickets"], 3)
+        self.assertGreater(stats["indexed_passages"], 3)
+        ticket, score = results[0]
+        self.assertEqual(ticket.id, 1)
+        self.assertAlmostEqual(score, 1.0, places=5)
+        self.assertIn("client_max_body_size", ticket.body)
+        self.assertLess(len(ticket.body), len(tickets[0].body) // 2)
+        self.assertEqual(len(results), 2)
+
+
+def _fake_usage(**tokens: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        input_tokens=tokens.get("input_tokens", 10),
+        output_tokens=tokens.get("output_tokens", 5),
+        cache_creation_input_tokens=tokens.get("cache_creation_input_tokens", 0),
+        cache_read_input_tokens=tokens.get("cache_read_input_tokens", 0),
+    )
+
+
+def _fake_anthropic(text: str, **usage: int) -> MagicMock:
+    client = MagicMock()
+    client.messages.create.return_value = SimpleNamespace(
+        content=[SimpleNamespace(type="text", text=text)], usage=_fake_usage(**usage)
+    )
+    return client
+
+
+class AnswerCacheTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        rag_local._QUERY_CACHE.clear()
+        rag_local.clear_answer_cache()
+
+        self.tickets = make_tickets(3)
+        write_tickets(self.db_path, self.tickets)
+        with patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+        ):
+            rag_local.build_index(self.db_path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_near_identical_question_reuses_answer(self) -> None:
+        client = _fake_anthropic("Reinicia el pod.")
+        question_vectors = {"¿Cómo arreglo el login?": [1.0, 0.1], "¿Cómo arreglo login?": [1.0, 0.11]}
+
+        def fake_embed(texts: list[str]) -> list[list[float]]:
+            return [question_vectors[t] for t in texts]
+
+        with patch.object(rag_local, "_embed_texts", side_effect=fake_embed), patch.object(
+            rag_local, "anthropic_client", client
+        ):
+            first = rag_local.answer("¿Cómo arreglo el login?", k=2)
+            second = rag_local.answer("¿Cómo arreglo login?", k=2)
+
+        client.messages.create.assert_called_once()
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["answer"], "Reinicia el pod.")
+        self.assertEqual(
+            [src["id"] for src in second["sources"]], [src["id"] for src in first["sources"]]
+        )
+
+    def test_answer_stream_emits_sources_before_tokens(self) -> None:
+        client = MagicMock()
+        stream = MagicMock()
+        stream.text_stream = iter(["Reinicia ", "el pod."])
+        stream.get_final_message.return_value = SimpleNamespace(
+            usage=_fake_usage(cache_read_input_tokens=1200)
+        )
+        client.messages.stream.return_value.__enter__.return_value = stream
+
+        with patch.object(rag_local, "_embed_texts", return_value=[[1.0, 0.1]]), patch.object(
+            rag_local, "anthropic_client", client
+        ):
+            events = list(rag_local.answer_stream("¿Qué hago?", k=2))
+
+        self.assertEqual([e["type"] for e in events], ["sources", "token", "token", "done"])
+        self.assertEqual(len(events[0]["sources"]), 2)
+        self.assertEqual(events[-1]["answer"], "Reinicia el pod.")
+        self.assertEqual(events[-1]["usage"]["cache_read_input_tokens"], 1200)
+        self.assertFalse(events[-1]["cached"])
+
+    def test_stable_prefix_is_cacheable_and_question_goes_last(self) -> None:
+        client = _fake_anthropic("Respuesta.", cache_creation_input_tokens=1500)
+        question_vectors = {"¿Qué pasa con el login?": [1.0, 0.1], "¿Y cómo lo arreglo?": [0.1, 1.0]}
+
+        def fake_embed(texts: list[str]) -> list[list[float]]:
+            return [question_vectors[t] for t in texts]
+
+        with patch.object(rag_local, "_embed_texts", side_effect=fake_embed), patch.object(
+            rag_local, "anthropic_client", client
+        ):
+            first = rag_local.answer("¿Qué pasa con el login?", k=3)
+            rag_local.answer("¿Y cómo lo arreglo?", k=3)
+
+        self.assertEqual(first["usage"]["cache_creation_input_tokens"], 1500)
+        self.assertEqual(first["usage"]["cache_read_input_tokens"], 0)
+
+        requests = [call.kwargs for call in client.messages.create.call_args_list]
+        blocks = [request["messages"][0]["content"] for request in requests]
+        for content in blocks:
+            self.assertEqual(
+                [block.get("cache_control") for block in content],
+                [{"type": "ephemeral"}, {"type": "ephemeral"}, None],
+            )
+            self.assertTrue(content[-1]["text"].startswith("Pregunta del usuario:"))
+        # Los mismos tickets en otro orden de relevancia dan el mismo prefijo.
+        self.assertEqual(blocks[0][:2], blocks[1][:2])
+        self.assertEqual(requests[0]["system"], requests[1]["system"])
+
+    def test_index_change_invalidates_answer_cache(self) -> None:
+        client = _fake_anthropic("Respuesta.")
+        with patch.object(rag_local, "_embed_texts", return_value=[[1.0, 0.1]]), patch.object(
+            rag_local, "anthropic_client", client
+        ):
+            rag_local.answer("pregunta", k=2)
+
+        self.assertEqual(rag_local.answer_cache_stats()["size"], 1)
+        with patch.object(rag_local, "_load_tickets", return_value=self.tickets[:2]):
+            rag_local.refresh_index(self.db_path)
+        self.assertEqual(rag_local.answer_cache_stats()["size"], 0)
+
+
+class SeededDatabaseTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executescript(seed_db._load_schema())
+            seed_db._seed_tickets(conn)
+        finally:
+            conn.close()
+        rag_local._QUERY_CACHE.clear()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_latest_tickets_and_get_ticket_use_sql_lookups(self) -> None:
+        with patch.object(rag_local, "_embed_texts") as embed:
+            latest = rag_local.latest_tickets(2, db_path=self.db_path)
+            ticket = rag_local.get_ticket(3, db_path=self.db_path)
+            missing = rag_local.get_ticket(999, db_path=self.db_path)
+
+        embed.assert_not_called()
+        self.assertEqual([t.id for t in latest], [6, 7])
+        assert ticket is not None
+        self.assertEqual(ticket.title, "Usuarios no pueden restablecer la contraseña")
+        self.assertIsNone(missing)
+
+    def test_bm25_finds_exact_error_codes(self) -> None:
+        hits = rag_local.rag_fts.search_bm25(self.db_path, "¿Por qué da un 413 al subir?")
+        self.assertEqual(hits[0][0], 6)
+
+    def test_hybrid_search_promotes_lexical_matches(self) -> None:
+        # Embeddings que colocan el ticket 6 (error 413) el último en el ranking vectorial.
+        vectors = [[1.0, 0.1 * i] for i in range(6)] + [[0.0, 1.0]]
+        with patch.object(rag_local, "RAG_RETRIEVAL", "hybrid"), patch.object(
+            rag_local, "_embed_texts", return_value=vectors
+        ):
+            rag_local.build_index(self.db_path)
+
+        with patch.object(rag_local, "RAG_RETRIEVAL", "hybrid"), patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0]]
+        ):
+            results = rag_local._search_similar("413 Request Entity Too Large", k=3)
+
+        self.assertEqual(results[0][0].id, 6)
+        self.assertEqual(len(results), 3)
+
+    def test_feedback_reranks_the_fused_ranking_in_hybrid_search(self) -> None:
+        vectors = [[1.0, 0.1 * i] for i in range(6)] + [[0.0, 1.0]]
+        with patch.object(rag_local, "RAG_RETRIEVAL", "hybrid"), patch.object(
+            rag_local, "_embed_texts", return_value=vectors
+        ):
+            rag_local.build_index(self.db_path)
+
+        reranker = rag_local.rag_rerank.FeedbackReranker()
+        with patch.object(rag_local, "RAG_RETRIEVAL", "hybrid"), patch.object(
+            rag_local, "_RERANKER", reranker
+        ), patch.object(rag_local, "_embed_texts", return_value=[[1.0, 0.0]]):
+            before = [t.id for t, _ in rag_local._search_similar("413 Request Entity Too Large", k=3)]
+            rag_local.record_feedback({"helpful": True, "source_ids": [2]})
+            after = [t.id for t, _ in rag_local._search_similar("413 Request Entity Too Large", k=3)]
+
+        # El boost se suma a la puntuación de la fusión, no a la similitud
+        # coseno: el ticket 6, que solo destaca por BM25, no se pierde.
+        self.assertEqual(before[0], 6)
+        self.assertEqual(after[0], 6)
+        self.assertEqual(set(after), set(before))
+
+    def test_local_embedder_indexes_and_searches_without_network(self) -> None:
+        local = rag_local.rag_embeddings.make_embedder("local", workers=1)
+        with patch.object(rag_local, "embedder", local), patch.object(
+            rag_local, "EMBEDDING_MODEL", local.name
+        ), patch.object(rag_local, "openai_client", None):
+            rag_local.build_index(self.db_path)
+            results = rag_local._search_similar("Los adjuntos grandes fallan al subir", k=3)
+
+        self.assertEqual(results[0][0].id, 6)
+        self.assertEqual(rag_local._SNAPSHOT.embeddings.shape[1], local.dim)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import asyncio
 from pathlib import Path
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from ej7_mcp_rag_db import rag_mcp_server as server
 from ej7_mcp_rag_db import rag_local
@@ -26,30 +29,145 @@ class TicketResourcesTests(unittest.TestCase):
         )
 
     def test_resource_latest_tickets_returns_limited_subset(self) -> None:
-        with patch.object(server.rag_local, "build_index", return_value=2), patch.object(
-            server.rag_local, "_load_tickets", return_value=[self.ticket1, self.ticket2]
-        ):
+        with patch.object(
+            server.rag_local, "latest_tickets", return_value=[self.ticket2]
+        ) as latest, patch.object(server.rag_local, "build_index") as build:
             data = server.resource_latest_tickets(limit=1)
 
+        latest.assert_called_once_with(1)
+        build.assert_not_called()
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]["id"], self.ticket2.id)
         self.assertIn("title", data[0])
 
     def test_resource_ticket_by_id(self) -> None:
-        with patch.object(server.rag_local, "_load_tickets", return_value=[self.ticket1, self.ticket2]):
+        with patch.object(server.rag_local, "get_ticket", return_value=self.ticket1):
             data = server.resource_ticket_by_id(ticket_id=1)
 
         self.assertIsNotNone(data)
         assert data is not None
         self.assertEqual(data["title"], "Error 500")
 
+    def test_resource_ticket_by_id_missing(self) -> None:
+        with patch.object(server.rag_local, "get_ticket", return_value=None):
+            self.assertIsNone(server.resource_ticket_by_id(ticket_id=99))
+
+
+class RagStreamingToolTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        ready = patch.object(server.rag_local, "index_ready", return_value=True)
+        ready.start()
+        self.addCleanup(ready.stop)
+
+    async def test_rag_answer_does_not_wait_for_the_first_index(self) -> None:
+        refresher = MagicMock(last_error=None)
+        with patch.object(server.rag_local, "index_ready", return_value=False), patch.object(
+            server, "_REFRESHER", refresher
+        ), patch.object(server.rag_local, "answer") as answer:
+            result = await server.rag_answer("¿Qué pasa?")
+
+        answer.assert_not_called()
+        refresher.start.assert_called_once()
+        refresher.trigger.assert_called_once()
+        self.assertTrue(result["indexing"])
+        self.assertEqual(result["sources"], [])
+
+    async def test_rag_answer_reports_the_last_indexing_error(self) -> None:
+        refresher = MagicMock(last_error=RuntimeError("No se ha encontrado la base de datos"))
+        with patch.object(server.rag_local, "index_ready", return_value=False), patch.object(
+            server, "_REFRESHER", refresher
+        ), patch.object(server.rag_local, "answer") as answer:
+            result = await server.rag_answer("¿Qué pasa?")
+
+        answer.assert_not_called()
+        refresher.trigger.assert_called_once()
+        self.assertFalse(result["indexing"])
+        self.assertEqual(result["error"], "No se ha encontrado la base de datos")
+        self.assertIn("No se ha encontrado la base de datos", result["answer"])
+
+    async def test_rag_answer_does_not_block_event_loop(self) -> None:
+        def slow_answer(question: str, k: int) -> dict:
+            time.sleep(0.2)
+            return {"answer": question, "sources": []}
+
+        with patch.object(server.rag_local, "answer", side_effect=slow_answer):
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                server.rag_answer("a"), server.rag_answer("b"), server.rag_answer("c")
+            )
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual([r["answer"] for r in results], ["a", "b", "c"])
+        self.assertLess(elapsed, 0.5)
+
+    async def test_feedback_history_is_loaded_off_the_event_loop(self) -> None:
+        threads: list[threading.Thread] = []
+        store = patch.object(
+            server, "_feedback_store", side_effect=lambda: threads.append(threading.current_thread())
+        )
+        answer = {"answer": "ok", "sources": []}
+        with store, patch.object(server.rag_local, "answer", return_value=answer), patch.object(
+            server.rag_local, "answer_stream", return_value=iter([{"type": "done", **answer}])
+        ):
+            await server.rag_answer("¿Qué pasa?")
+            await server.rag_answer_stream("¿Qué pasa?", MagicMock())
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    async def test_closing_the_stream_stops_the_producer_early(self) -> None:
+        closed = threading.Event()
+
+        def slow_events():
+            try:
+                for i in range(50):
+                    yield {"type": "token", "text": str(i)}
+                    time.sleep(0.05)
+            finally:
+                closed.set()
+
+        start = time.perf_counter()
+        stream = server._iterate_blocking(slow_events)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(closed.is_set())
+        self.assertLess(elapsed, 1.0)
+
+    async def test_rag_answer_stream_reports_progress_and_returns_result(self) -> None:
+        events = [
+            {"type": "sources", "sources": [{"id": 1, "title": "Error 500"}]},
+            {"type": "token", "text": "Revisa "},
+            {"type": "token", "text": "los locks."},
+            {
+                "type": "done",
+                "answer": "Revisa los locks.",
+                "sources": [{"id": 1, "title": "Error 500"}],
+                "cached": False,
+            },
+        ]
+        ctx = MagicMock()
+        ctx.report_progress = AsyncMock()
+
+        with patch.object(server.rag_local, "answer_stream", return_value=iter(events)):
+            result = await server.rag_answer_stream("¿Qué pasa?", ctx, k=1)
+
+        self.assertEqual(result["answer"], "Revisa los locks.")
+        self.assertNotIn("type", result)
+        messages = [call.kwargs["message"] for call in ctx.report_progress.await_args_list]
+        self.assertIn('"sources"', messages[0])
+        self.assertEqual(messages[1:], ["Revisa ", "los locks."])
+
 
 class FeedbackToolsTests(unittest.IsolatedAsyncioTestCase):
     def setUp(self) -> None:
-        self.temp_feedback = Path("ej7_mcp_rag_db/tests/tmp_feedback.json")
+        self.temp_feedback = Path("ej7_mcp_rag_db/tests/tmp_feedback.jsonl")
         if self.temp_feedback.exists():
             self.temp_feedback.unlink()
         server.FEEDBACK_PATH = self.temp_feedback
+        server._FEEDBACK_STORES.clear()
 
     def tearDown(self) -> None:
         if self.temp_feedback.exists():
@@ -64,6 +182,34 @@ class FeedbackToolsTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(len(entries), 1)
         self.assertEqual(entries[0]["question"], "¿Qué pasó?")
 
-        latest = server.resource_latest_feedback(limit=1)
+        latest = await server.resource_latest_feedback(limit=1)
         self.assertEqual(len(latest), 1)
         self.assertEqual(latest[0]["answer"], "Todo bien")
+
+    async def test_feedback_io_runs_off_the_event_loop(self) -> None:
+        threads: list[threading.Thread] = []
+        real_store = server._feedback_store
+
+        def store() -> object:
+            threads.append(threading.current_thread())
+            return real_store()
+
+        with patch.object(server, "_feedback_store", side_effect=store):
+            await server.save_feedback("¿Qué pasó?", "Todo bien", True)
+            await server.list_feedback(limit=5)
+            await server.resource_latest_feedback(limit=5)
+
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    async def test_save_feedback_with_sources_feeds_reranker(self) -> None:
+        with patch.object(server.rag_local, "record_feedback") as record:
+            await server.save_feedback(
+                "¿Qué pasó?", "Nada útil", False, source_ids=[3, 1], cluster_id=1
+            )
+
+        entry = record.call_args.args[0]
+        self.assertEqual(entry["source_ids"], [3, 1])
+        self.assertEqual(entry["cluster_id"], 1)
+        self.assertFalse(entry["helpful"])
+        self.assertEqual((await server.list_feedback(limit=1))[0]["source_ids"], [3, 1])
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from ej7_mcp_rag_db import rag_minimal
+
+
+def _fake_embed(texts: list[str]) -> list[list[float]]:
+    return [[1.0, 0.0] if "contraseña" in text else [0.0, 1.0] for text in texts]
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_import_needs_no_keys_and_does_not_load_the_sdks(self) -> None:
+        env = {
+            k: v
+            for k, v in os.environ.items()
+            if k not in ("MODEL", "ANTHROPIC_API_KEY", "OPENAI_API_KEY")
+        }
+        code = (
+            "import sys; from ej7_mcp_rag_db import rag_minimal; "
+            "print(sorted(m for m in ('anthropic', 'openai') if m in sys.modules))"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=Path(__file__).resolve().parents[2],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(out.stdout.strip(), "[]")
+
+    def test_missing_model_is_reported_on_first_use(self) -> None:
+        with patch.object(rag_minimal, "MODEL", None):
+            with self.assertRaisesRegex(RuntimeError, "MODEL"):
+                rag_minimal._chat_model()
+
+
+class CorpusCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        rag_minimal._CORPUS_CACHE.update(key=None, embeddings=[])
+        self.addCleanup(rag_minimal._CORPUS_CACHE.update, key=None, embeddings=[])
+
+    def test_corpus_is_embedded_once_and_queries_cost_one_call(self) -> None:
+        with patch.object(rag_minimal, "RAG_MINIMAL_CACHE_PATH", ""), patch.object(
+            rag_minimal, "_embed_texts", side_effect=_fake_embed
+        ) as embed:
+            first = rag_minimal._search_similar("reset de contraseña", k=1)
+            rag_minimal._search_similar("panel de administración lento", k=1)
+
+        self.assertEqual(first[0][0]["id"], 3)
+        self.assertEqual([len(call.args[0]) for call in embed.call_args_list], [3, 1, 1])
+
+    def test_changing_tickets_invalidates_the_cache(self) -> None:
+        extra = {**rag_minimal.TICKETS[0], "id": 4, "body": "Otro ticket."}
+        with patch.object(rag_minimal, "RAG_MINIMAL_CACHE_PATH", ""), patch.object(
+            rag_minimal, "_embed_texts", side_effect=_fake_embed
+        ) as embed:
+            rag_minimal._search_similar("pregunta", k=1)
+            with patch.object(rag_minimal, "TICKETS", rag_minimal.TICKETS + [extra]):
+                rag_minimal._search_similar("pregunta", k=1)
+
+        self.assertEqual([len(call.args[0]) for call in embed.call_args_list], [3, 1, 4, 1])
+
+    def test_persisted_cache_survives_a_restart(self) -> None:
+        cache_path = str(Path(self.tmp_dir.name) / "corpus.json")
+        with patch.object(rag_minimal, "RAG_MINIMAL_CACHE_PATH", cache_path):
+            with patch.object(rag_minimal, "_embed_texts", side_effect=_fake_embed):
+                rag_minimal._search_similar("pregunta", k=1)
+
+            # Como si el proceso se reiniciara: la memoria está vacía.
+            rag_minimal._CORPUS_CACHE.update(key=None, embeddings=[])
+            with patch.object(rag_minimal, "_embed_texts", side_effect=_fake_embed) as embed:
+                rag_minimal._search_similar("pregunta", k=1)
+
+        embed.assert_called_once_with(["pregunta"])
+
+
+class PromptCachingTests(unittest.TestCase):
+    def test_tickets_block_is_stable_and_usage_is_reported(self) -> None:
+        client = MagicMock()
+        client.messages.create.return_value = SimpleNamespace(
+            content=[SimpleNamespace(type="text", text="Renueva las credenciales SMTP.")],
+            usage=SimpleNamespace(
+                input_tokens=12,
+                output_tokens=8,
+                cache_creation_input_tokens=0,
+                cache_read_input_tokens=1100,
+            ),
+        )
+        candidates = [(rag_minimal.TICKETS[2], 0.9), (rag_minimal.TICKETS[0], 0.4)]
+
+        with patch.object(rag_minimal, "_search_similar", return_value=candidates), patch.object(
+            rag_minimal, "anthropic_client", client
+        ), patch.object(rag_minimal, "MODEL", "test-model"):
+            result = rag_minimal.answer("¿Por qué no llega el correo?", k=2)
+
+        self.assertEqual(result["usage"]["cache_read_input_tokens"], 1100)
+        content = client.messages.create.call_args.kwargs["messages"][0]["content"]
+        self.assertEqual([b.get("cache_control") for b in content][-1], None)
+        self.assertEqual(content[-1]["text"], "Pregunta del usuario:\n¿Por qué no llega el correo?")
+        self.assertEqual(
+            content[1]["text"], rag_minimal._tickets_block(list(reversed(candidates)))
+        )
+        self.assertLess(content[1]["text"].index("ID: 1"), content[1]["text"].index("ID: 3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from typing import Callable
+from unittest.mock import patch
+
+from ej7_mcp_rag_db import rag_local, rag_refresh
+from ej7_mcp_rag_db.tests.helpers import RagStateTestCase, make_tickets, write_tickets
+
+
+def _wait_for(predicate: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class IndexRefresherTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE tickets (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _start(self, refresh: Callable[[], dict]) -> rag_refresh.IndexRefresher:
+        refresher = rag_refresh.IndexRefresher(refresh, self.db_path, interval=0, poll=0.02)
+        refresher.start()
+        self.addCleanup(refresher.stop)
+        return refresher
+
+    def test_refreshes_on_start_and_when_the_database_changes(self) -> None:
+        refresher = self._start(lambda: {"ok": True})
+
+        self.assertTrue(_wait_for(lambda: refresher.refreshes == 1))
+        time.sleep(0.1)
+        self.assertEqual(refresher.refreshes, 1)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO tickets (title) VALUES ('nuevo')")
+        conn.commit()
+        conn.close()
+
+        self.assertTrue(_wait_for(lambda: refresher.refreshes == 2))
+        self.assertEqual(refresher.last_result, {"ok": True})
+
+    def test_errors_are_kept_and_trigger_forces_a_refresh(self) -> None:
+        outcomes = [RuntimeError("sin base de datos"), {"ok": True}]
+
+        def refresh() -> dict:
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with self.assertLogs(rag_refresh.logger, level="ERROR"):
+            refresher = self._start(refresh)
+            self.assertTrue(_wait_for(lambda: refresher.refreshes == 1))
+        self.assertIsInstance(refresher.last_error, RuntimeError)
+
+        refresher.trigger()
+        self.assertTrue(_wait_for(lambda: refresher.refreshes == 2))
+        self.assertIsNone(refresher.last_error)
+        self.assertTrue(refresher.running)
+
+
+class SnapshotSwapTests(RagStateTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "incidents.db"
+        rag_local._QUERY_CACHE.clear()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_queries_use_the_old_snapshot_while_reindexing(self) -> None:
+        tickets = make_tickets(3)
+        write_tickets(self.db_path, tickets)
+        with patch.object(
+            rag_local, "_embed_texts", return_value=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+        ):
+            rag_local.build_index(self.db_path)
+        old = rag_local._SNAPSHOT
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE tickets SET body = 'Cuerpo nuevo.' WHERE id = 2")
+        conn.commit()
+        conn.close()
+
+        embedding_started = threading.Event()
+        release = threading.Event()
+
+        def slow_embed(texts: list[str]) -> list[list[float]]:
+            embedding_started.set()
+            release.wait(5)
+            return [[0.0, 1.0] for _ in texts]
+
+        with patch.object(rag_local, "_embed_texts", side_effect=slow_embed):
+            worker = threading.Thread(target=rag_local.refresh_index, args=(self.db_path,))
+            worker.start()
+            self.assertTrue(embedding_started.wait(5))
+
+            # La reindexación está a medias: la consulta no espera y usa el snapshot anterior.
+            start = time.perf_counter()
+            results = rag_local._search_similar(
+                "pregunta", k=1, question_embedding=rag_local._normalize_rows([1.0, 0.0])[0]
+            )
+            elapsed = time.perf_counter() - start
+            self.assertIs(rag_local._SNAPSHOT, old)
+
+            release.set()
+            worker.join(5)
+
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual([t.id for t, _ in results], [1])
+        self.assertIsNot(rag_local._SNAPSHOT, old)
+        self.assertEqual(rag_local._SNAPSHOT.ticket_ids.tolist(), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()